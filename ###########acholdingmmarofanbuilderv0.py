@@ -5,7 +5,21 @@ import math
 import struct
 import random
 import json
-from collections import deque
+import zlib
+import hashlib
+import time
+import queue
+import threading
+import itertools
+import weakref
+import re
+from array import array
+from collections import deque, OrderedDict
+
+import numpy as np
+
+import mfbconvert
+from mfbconvert import LevelFormatError
 
 # -------------------------
 # CONSTANTS & CONFIG
@@ -21,6 +35,7 @@ CANVAS_WIDTH = WINDOW_WIDTH - SIDEBAR_WIDTH
 CANVAS_HEIGHT = WINDOW_HEIGHT - CANVAS_Y - STATUSBAR_HEIGHT
 
 GRID_SIZE = 32
+MAX_LAYERS = mfbconvert.MAX_LAYERS
 FPS = 60
 ZOOM_MIN, ZOOM_MAX = 0.25, 4.0
 ZOOM_STEP = 0.25
@@ -43,6 +58,12 @@ YELLOW = (255, 255, 0)
 GRAY   = (128, 128, 128)
 SMBX_GRID = (40, 40, 40)
 
+AUTOSAVE_INTERVAL = 60000   # ms between background autosaves
+AUTOSAVE_SLOTS    = 3       # rotating recovery files per level
+AUTOSAVE_DIR      = "autosave"
+JOURNAL_FLUSH_INTERVAL = 2000        # ms between journal appends
+JOURNAL_COMPACT_BYTES  = 256 * 1024  # fold the journal into the .lvl past this
+
 GRAVITY           = 0.5
 JUMP_STRENGTH     = -10
 MOVE_SPEED        = 4
@@ -63,6 +84,7 @@ SMBX_ASSETS = "smbx_assets"
 TILESET_DIR = os.path.join(SMBX_ASSETS, "tilesets")
 BACKGROUND_DIR = os.path.join(SMBX_ASSETS, "backgrounds")
 NPC_GFX_DIR = os.path.join(SMBX_ASSETS, "npc")
+GFX_CACHE_DIR = os.path.join(SMBX_ASSETS, ".cache")
 
 USE_GRAPHICS = os.path.isdir(SMBX_ASSETS)
 
@@ -145,18 +167,300 @@ current_theme = 'SMB1'
 # -------------------------
 # LOAD GRAPHICS (if assets exist)
 # -------------------------
+# SMBX sheets: block-N / background-N / npc-N as .png or .gif, with an
+# optional black-on-white mask (block-Nm.gif) and an optional npc-N.txt or
+# .ini giving gfxwidth/gfxheight/frames. Frames are stacked vertically.
+# Decoded RGBA frames are cached under GFX_CACHE_DIR so later startups skip
+# image decoding and slicing; convert_alpha() happens on first draw, once a
+# display exists.
 tile_images = {}
 bgo_images = {}
 npc_images = {}
+sprite_frames = {}      # (kind, name) -> [Surface, ...]
+
+GFX_KINDS = {'tile': (TILESET_DIR, 'block', TILE_SMBX_IDS, tile_images),
+             'bgo':  (BACKGROUND_DIR, 'background', BGO_SMBX_IDS, bgo_images),
+             'npc':  (NPC_GFX_DIR, 'npc', NPC_SMBX_IDS, npc_images)}
+GFX_CACHE_MAGIC = b'MFBG'
+GFX_CACHE_HEAD = struct.Struct('<4sHHH')    # magic, frame w, frame h, frame count
+
+def _first_existing(*paths):
+    for p in paths:
+        if os.path.isfile(p):
+            return p
+    return None
+
+def sheet_sources(kind, name):
+    folder, prefix, ids, _ = GFX_KINDS[kind]
+    base = os.path.join(folder, f"{prefix}-{ids[name]}")
+    image = _first_existing(base + ".png", base + ".gif")
+    if image is None:
+        return None
+    return (image, _first_existing(base + "m.gif", base + "m.png"),
+            _first_existing(base + ".txt", base + ".ini"))
+
+def read_gfx_config(path):
+    cfg = {}
+    if path:
+        with open(path, encoding='utf-8', errors='ignore') as f:
+            for line in f:
+                key, sep, value = line.partition('=')
+                if sep:
+                    try:
+                        cfg[key.strip().lower()] = int(value.strip().strip('"'))
+                    except ValueError:
+                        pass
+    return cfg
+
+def decode_sheet(kind, sources):
+    image_path, mask_path, cfg_path = sources
+    sheet = pygame.image.load(image_path)
+    w, h = sheet.get_size()
+    rgba = pygame.Surface((w, h), pygame.SRCALPHA)
+    rgba.blit(sheet, (0, 0))
+    if mask_path:
+        # SMBX masks are black where the sprite is opaque.
+        mask = pygame.mask.from_threshold(pygame.image.load(mask_path), (0,0,0), (64,64,64,255))
+        alpha = mask.to_surface(setcolor=(255,255,255,255), unsetcolor=(255,255,255,0))
+        rgba.blit(alpha, (0, 0), special_flags=pygame.BLEND_RGBA_MULT)
+    cfg = read_gfx_config(cfg_path)
+    fw = max(1, min(w, cfg.get('gfxwidth', w)))
+    if 'gfxheight' in cfg:
+        fh = cfg['gfxheight']
+    elif 'frames' in cfg:
+        fh = h // max(1, cfg['frames'])
+    else:
+        fh = fw if h % fw == 0 else h
+    fh = max(1, min(h, fh))
+    count = max(1, min(cfg.get('frames', h // fh), h // fh))
+    return [rgba.subsurface((0, i*fh, fw, fh)).copy() for i in range(count)]
+
+def _source_signature(sources):
+    return [[p, os.stat(p).st_mtime_ns, os.stat(p).st_size] for p in sources if p]
+
+def _source_hash(sources):
+    h = hashlib.sha1()
+    for p in sources:
+        if p:
+            with open(p, 'rb') as f:
+                h.update(f.read())
+    return h.hexdigest()
+
+def read_frame_cache(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    magic, fw, fh, count = GFX_CACHE_HEAD.unpack_from(data)
+    size = fw*fh*4
+    if magic != GFX_CACHE_MAGIC or len(data) != GFX_CACHE_HEAD.size + size*count:
+        raise ValueError("bad frame cache")
+    off = GFX_CACHE_HEAD.size
+    return [pygame.image.frombytes(data[off+i*size:off+(i+1)*size], (fw, fh), 'RGBA').copy()
+            for i in range(count)]
+
+def write_frame_cache(path, frames):
+    fw, fh = frames[0].get_size()
+    data = GFX_CACHE_HEAD.pack(GFX_CACHE_MAGIC, fw, fh, len(frames))
+    data += b''.join(pygame.image.tobytes(f, 'RGBA') for f in frames)
+    tmp = path + ".tmp"
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+def load_sheet(kind, name, index):
+    """Frames for one object type, from the disk cache when the sources are unchanged."""
+    sources = sheet_sources(kind, name)
+    if sources is None:
+        return None
+    sig = _source_signature(sources)
+    entry = index.get(sources[0])
+    key = entry[1] if entry and entry[0] == sig else _source_hash(sources)
+    cache_file = os.path.join(GFX_CACHE_DIR, key + ".rgba")
+    try:
+        frames = read_frame_cache(cache_file)
+    except (OSError, ValueError, struct.error):
+        frames = decode_sheet(kind, sources)
+        try:
+            write_frame_cache(cache_file, frames)
+        except OSError:
+            pass
+    index[sources[0]] = [sig, key]
+    return frames
 
-def load_smbx_graphics():
-    if not USE_GRAPHICS:
-        return
-    # This is a placeholder; in a real implementation you would parse tileset.ini
-    # and extract the appropriate frames. For now, we just note that graphics are available.
-    pass
+def install_sheet(kind, name, frames):
+    sprite_frames[(kind, name)] = frames
+    GFX_KINDS[kind][3][name] = frames[0]
+
+def remove_sheet(kind, name):
+    GFX_KINDS[kind][3].pop(name, None)
+    return sprite_frames.pop((kind, name), None) is not None
+
+def read_gfx_index():
+    try:
+        with open(os.path.join(GFX_CACHE_DIR, "index.json")) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
 
-load_smbx_graphics()
+def write_gfx_index(index):
+    try:
+        path = os.path.join(GFX_CACHE_DIR, "index.json")
+        with open(path + ".tmp", 'w') as f:
+            json.dump(index, f)
+        os.replace(path + ".tmp", path)
+    except OSError:
+        pass
+
+# Sheets are decoded on worker threads in priority order: types used by the
+# open level first, then the palette tab being browsed, then everything else.
+# Until a sheet arrives its procedural image is drawn; install() swaps the
+# real frames in on the main thread between frames.
+ASSET_WORKERS = 2
+PRIO_LEVEL, PRIO_PALETTE, PRIO_REST = 0, 1, 2
+
+class AssetLoader:
+    def __init__(self, workers=ASSET_WORKERS):
+        self.jobs = queue.PriorityQueue()
+        self.results = queue.Queue()
+        self.lock = threading.Lock()
+        self.queued = {}        # (kind, name) -> best priority queued so far
+        self.started = set()
+        self.seq = itertools.count()
+        self.index_dirty = False
+        self.index = {}
+        if USE_GRAPHICS:
+            os.makedirs(GFX_CACHE_DIR, exist_ok=True)
+            self.index = read_gfx_index()
+            for _ in range(workers):
+                threading.Thread(target=self._run, daemon=True).start()
+
+    def request(self, kind, name, priority=PRIO_REST):
+        if not USE_GRAPHICS:
+            return
+        key = (kind, name)
+        with self.lock:
+            if key in self.started or self.queued.get(key, PRIO_REST+1) <= priority:
+                return
+            self.queued[key] = priority
+        # An entry with a worse priority may still be queued; it is skipped when popped.
+        self.jobs.put((priority, next(self.seq), kind, name))
+
+    def reload(self, kind, name):
+        with self.lock:
+            self.started.discard((kind, name))
+            self.queued.pop((kind, name), None)
+        self.request(kind, name, PRIO_LEVEL)
+
+    def request_all(self, priority=PRIO_REST):
+        for kind, (_, _, ids, _) in GFX_KINDS.items():
+            for name in ids:
+                self.request(kind, name, priority)
+
+    def _run(self):
+        while True:
+            priority, _, kind, name = self.jobs.get()
+            key = (kind, name)
+            with self.lock:
+                skip = key in self.started or self.queued.get(key) != priority
+                if not skip:
+                    self.started.add(key)
+                    index = dict(self.index)
+            if skip:
+                continue
+            # Any failure is reported through results; an exception escaping
+            # here would end the worker and strand every sheet after it.
+            try:
+                frames, err = load_sheet(kind, name, index), None
+            except Exception as e:
+                frames, err = None, e
+            with self.lock:
+                self.index.update(index)
+            self.results.put((kind, name, frames, err))
+
+    def install(self):
+        # Main thread only: publish finished sheets and drop their placeholders.
+        n = 0
+        while True:
+            try:
+                kind, name, frames, err = self.results.get_nowait()
+            except queue.Empty:
+                break
+            if err:
+                print(f"Graphics: skipping {kind} {name}: {err}")
+            elif frames:
+                install_sheet(kind, name, frames)
+                invalidate_images(kind, name)
+            elif remove_sheet(kind, name):
+                invalidate_images(kind, name)
+            else:
+                continue
+            if kind == 'tile':
+                invalidate_tile_chunks(name)
+            self.index_dirty = True
+            n += 1
+        if self.index_dirty and self.jobs.empty() and self.results.empty():
+            with self.lock:
+                index = dict(self.index)
+            write_gfx_index(index)
+            self.index_dirty = False
+        return n
+
+# Hot reload: the asset folders are re-listed every ASSET_POLL_INTERVAL and
+# compared against the last mtime/size index. Only sheets whose image, mask
+# or config changed are re-decoded; objects pick up the new frames through
+# object_image() without being rebuilt.
+ASSET_POLL_INTERVAL = 1000
+SHEET_PREFIXES = {'block': ('tile', TILE_ID_TO_NAME), 'background': ('bgo', BGO_ID_TO_NAME),
+                  'npc': ('npc', NPC_ID_TO_NAME)}
+
+def sheet_for_path(path):
+    stem, ext = os.path.splitext(os.path.basename(path))
+    prefix, sep, num = stem.partition('-')
+    if not sep or prefix not in SHEET_PREFIXES or ext.lower() not in ('.png', '.gif', '.txt', '.ini'):
+        return None
+    num = num[:-1] if num.endswith('m') else num
+    kind, names = SHEET_PREFIXES[prefix]
+    return (kind, names[int(num)]) if num.isdigit() and int(num) in names else None
+
+class AssetWatcher:
+    def __init__(self, loader):
+        self.loader = loader
+        self.files = self.scan()
+        self.last_poll = pygame.time.get_ticks()
+
+    def scan(self):
+        files = {}
+        for folder, _, _, _ in GFX_KINDS.values():
+            try:
+                entries = os.scandir(folder)
+            except OSError:
+                continue
+            with entries:
+                for entry in entries:
+                    if entry.is_file():
+                        st = entry.stat()
+                        files[entry.path] = (st.st_mtime_ns, st.st_size)
+        return files
+
+    def poll(self, now):
+        if now - self.last_poll < ASSET_POLL_INTERVAL:
+            return set()
+        self.last_poll = now
+        files = self.scan()
+        changed = {p for p in files.keys() | self.files.keys() if files.get(p) != self.files.get(p)}
+        self.files = files
+        sheets = {s for s in map(sheet_for_path, changed) if s}
+        for kind, name in sheets:
+            self.loader.reload(kind, name)
+        return sheets
+
+asset_loader = None
+
+def get_asset_loader():
+    global asset_loader
+    if asset_loader is None:
+        asset_loader = AssetLoader()
+        asset_loader.request_all()
+    return asset_loader
 
 # -------------------------
 # HELPERS
@@ -286,8 +590,21 @@ def draw_icon_event(surf, rect, color=SYS_TEXT):
     pygame.draw.circle(surf,color,(cx+4,cy-4),2)
     pygame.draw.arc(surf,color,(cx-6,cy,12,8),0,math.pi,2)
 
+def draw_icon_rect(surf, rect, color=SYS_TEXT):
+    pygame.draw.rect(surf,color,rect.inflate(-8,-8))
+
+def draw_icon_line(surf, rect, color=SYS_TEXT):
+    r=rect.inflate(-8,-8)
+    pygame.draw.line(surf,color,r.bottomleft,r.topright,2)
+
+def draw_icon_stamp(surf, rect, color=SYS_TEXT):
+    cx,cy=rect.center
+    pygame.draw.rect(surf,color,(cx-6,cy+2,12,4))
+    pygame.draw.rect(surf,color,(cx-2,cy-6,4,8),1)
+
 ICON_FNS = {
     'select':draw_icon_select, 'pencil':draw_icon_pencil, 'eraser':draw_icon_eraser,
+    'rect':draw_icon_rect, 'line':draw_icon_line, 'stamp':draw_icon_stamp,
     'fill':draw_icon_fill, 'new':draw_icon_new, 'open':draw_icon_open, 'save':draw_icon_save,
     'undo':draw_icon_undo, 'redo':draw_icon_redo, 'play':draw_icon_play, 'props':draw_icon_props,
     'grid':draw_icon_grid, 'zoom_in':draw_icon_zoom_in, 'zoom_out':draw_icon_zoom_out,
@@ -559,8 +876,10 @@ class LayerDialog(Dialog):
             cl_r =pygame.Rect(self.x+self.w-90, self.y+self.h-44,70,26)
             if add_r.collidepoint(event.pos):
                 self.section.layers.append(Layer(f"Layer {len(self.section.layers)+1}"))
+                self.section.renumber_layers()
             if del_r.collidepoint(event.pos) and len(self.section.layers)>1:
                 self.section.layers.pop(self.sel)
+                self.section.renumber_layers()
                 self.sel=max(0,self.sel-1)
                 self.section.current_layer_idx=self.sel
             if ren_r.collidepoint(event.pos) and self.section.layers:
@@ -635,6 +954,109 @@ class EventDialog(Dialog):
         draw_edge(self.screen, close_btn, raised=True)
         draw_text(self.screen, "Close", close_btn.center, SYS_TEXT, FONT_SMALL, True)
 
+class FindDialog(Dialog):
+    # Query form for Level.query; result is the criteria dict, or None.
+    KINDS  = [('Any',None),('Tile','tile'),('BGO','bgo'),('NPC','npc')]
+    SCOPES = [('Layer','layer'),('Section','section'),('Level','level')]
+
+    def __init__(self, screen, last=None):
+        super().__init__(screen, "Find Objects", 360, 250)
+        last = last or {}
+        self.fields = {
+            'type':  last.get('obj_type') or '',
+            'event': '' if last.get('event_id') is None else str(last['event_id']),
+            'flags': str(last['flags']) if last.get('flags') else '',
+        }
+        self.kind  = last.get('kind')
+        self.scope = last.get('scope', 'level')
+        self.active_field = 'type'
+        self.cursors = {k:len(v) for k,v in self.fields.items()}
+        self.error = ""
+
+    def _field_rect(self, fy):
+        return pygame.Rect(self.x+130, self.y+fy, 210, 20)
+
+    def _criteria(self):
+        try:
+            event_id = int(self.fields['event']) if self.fields['event'].strip() else None
+            flags = int(self.fields['flags'], 0) if self.fields['flags'].strip() else 0
+        except ValueError:
+            self.error = "Event and flags must be numbers"
+            return None
+        return {'obj_type': self.fields['type'].strip().lower() or None, 'event_id': event_id,
+                'flags': flags, 'kind': self.kind, 'scope': self.scope}
+
+    def _find(self):
+        crit = self._criteria()
+        if crit is not None:
+            self.result = crit; self.done = True
+
+    def handle_event(self, event):
+        labels = [('type','Type name:',36),('event','Event ID (-1 none):',62),('flags','Flag bits:',88)]
+        if event.type==pygame.MOUSEBUTTONDOWN and event.button==1:
+            for key,_,fy in labels:
+                if self._field_rect(fy).collidepoint(event.pos):
+                    self.active_field=key
+            for i,(_,k) in enumerate(self.KINDS):
+                if pygame.Rect(self.x+10+i*84,self.y+134,80,20).collidepoint(event.pos):
+                    self.kind=k
+            for i,(_,sc) in enumerate(self.SCOPES):
+                if pygame.Rect(self.x+10+i*112,self.y+176,108,20).collidepoint(event.pos):
+                    self.scope=sc
+            if pygame.Rect(self.x+self.w-170,self.y+self.h-36,70,26).collidepoint(event.pos):
+                self._find()
+            if pygame.Rect(self.x+self.w-90,self.y+self.h-36,70,26).collidepoint(event.pos):
+                self.done=True
+
+        if event.type==pygame.KEYDOWN:
+            if event.key==pygame.K_RETURN: self._find(); return
+            if event.key==pygame.K_ESCAPE: self.done=True; return
+            if event.key==pygame.K_TAB:
+                keys=[k for k,_,_ in labels]
+                self.active_field=keys[(keys.index(self.active_field)+1)%len(keys)]
+                return
+            k=self.active_field
+            v=self.fields[k]; c=self.cursors[k]
+            if event.key==pygame.K_BACKSPACE and c>0:
+                self.fields[k]=v[:c-1]+v[c:]; self.cursors[k]=c-1
+            elif event.key==pygame.K_LEFT: self.cursors[k]=max(0,c-1)
+            elif event.key==pygame.K_RIGHT: self.cursors[k]=min(len(v),c+1)
+            elif event.unicode and event.unicode.isprintable():
+                self.fields[k]=v[:c]+event.unicode+v[c:]; self.cursors[k]=c+1
+
+    def draw(self):
+        self._draw_frame()
+        labels=[('type','Type name:',36),('event','Event ID (-1 none):',62),('flags','Flag bits:',88)]
+        for key,lbl,fy in labels:
+            draw_text(self.screen,lbl,(self.x+14,self.y+fy+2),SYS_TEXT,FONT_SMALL)
+            ir=self._field_rect(fy)
+            pygame.draw.rect(self.screen,SYS_WINDOW,ir)
+            draw_edge(self.screen,ir,raised=False)
+            v=self.fields[key]
+            draw_text(self.screen,v,(ir.x+4,ir.y+3),SYS_TEXT,FONT_SMALL)
+            if self.active_field==key and pygame.time.get_ticks()%1000<500:
+                cx=ir.x+4+FONT_SMALL.size(v[:self.cursors[key]])[0]
+                pygame.draw.line(self.screen,BLACK,(cx,ir.y+2),(cx,ir.y+17))
+
+        draw_text(self.screen,"Kind:",(self.x+14,self.y+118),SYS_TEXT,FONT_SMALL)
+        draw_text(self.screen,"Search in:",(self.x+14,self.y+160),SYS_TEXT,FONT_SMALL)
+        rows=[(self.KINDS,self.kind,134,84),(self.SCOPES,self.scope,176,112)]
+        for opts,cur,by,step in rows:
+            for i,(lbl,val) in enumerate(opts):
+                r=pygame.Rect(self.x+10+i*step,self.y+by,step-4,20)
+                sel=(val==cur)
+                pygame.draw.rect(self.screen,SYS_HIGHLIGHT if sel else SYS_BTN_FACE,r)
+                draw_edge(self.screen,r,raised=not sel)
+                draw_text(self.screen,lbl,r.center,WHITE if sel else SYS_TEXT,FONT_SMALL,True)
+        if self.error:
+            draw_text(self.screen,self.error,(self.x+14,self.y+self.h-30),RED,FONT_SMALL)
+
+        for lbl,bx in [("Find",self.w-170),("Cancel",self.w-90)]:
+            r=pygame.Rect(self.x+bx,self.y+self.h-36,70,26)
+            pygame.draw.rect(self.screen,SYS_BTN_FACE,r)
+            draw_edge(self.screen,r,raised=True)
+            draw_text(self.screen,lbl,r.center,SYS_TEXT,FONT_SMALL,True)
+
 class WarpDialog(Dialog):
     def __init__(self, screen, level):
         super().__init__(screen, "Warp Editor", 600, 400)
@@ -660,12 +1082,17 @@ class WarpDialog(Dialog):
 # NEW DATA STRUCTURES FOR SMBX
 # -------------------------
 class Event:
+    __slots__ = ('name', 'trigger', 'actions')
+
     def __init__(self, name="New Event", trigger="auto", actions=None):
         self.name = name
         self.trigger = trigger
         self.actions = actions or []
 
 class Warp:
+    __slots__ = ('origin_section', 'origin_x', 'origin_y', 'dest_section', 'dest_x', 'dest_y',
+                 'direction', 'style')
+
     def __init__(self, origin_section=0, origin_x=0, origin_y=0,
                  dest_section=0, dest_x=0, dest_y=0, direction='down', style='pipe'):
         self.origin_section = origin_section
@@ -678,117 +1105,188 @@ class Warp:
         self.style = style
 
 # -------------------------
-# SPRITE CLASSES
+# IMAGE CACHE
+# -------------------------
+# One surface per (kind, type, theme), shared by every object of that type.
+# Procedural images are drawn on first use; real graphics win when loaded.
+image_cache = {}
+
+def render_tile(tile_type):
+    if tile_type in ('water', 'lava'):
+        image = pygame.Surface((GRID_SIZE, GRID_SIZE), pygame.SRCALPHA)
+        image.fill((*get_theme_color(tile_type)[:3], 128))
+    else:
+        image = pygame.Surface((GRID_SIZE, GRID_SIZE))
+        image.fill(get_theme_color(tile_type))
+    if tile_type == 'question':
+        draw_text(image, '?', (GRID_SIZE//2, GRID_SIZE//2), BLACK, FONT_SMALL, True)
+    elif tile_type == 'brick':
+        pygame.draw.line(image, BLACK, (0, GRID_SIZE//2), (GRID_SIZE, GRID_SIZE//2), 2)
+        pygame.draw.line(image, BLACK, (GRID_SIZE//2, 0), (GRID_SIZE//2, GRID_SIZE), 2)
+    elif tile_type == 'coin':
+        pygame.draw.circle(image, YELLOW, (GRID_SIZE//2, GRID_SIZE//2), GRID_SIZE//3)
+    elif tile_type == 'pipe_vertical':
+        pygame.draw.rect(image, (0,160,0), (4,0, GRID_SIZE-8, GRID_SIZE))
+        pygame.draw.rect(image, (0,200,0), (2,0, GRID_SIZE-4, 8))
+    elif tile_type == 'pipe_horizontal':
+        pygame.draw.rect(image, (0,160,0), (0,4, GRID_SIZE, GRID_SIZE-8))
+        pygame.draw.rect(image, (0,200,0), (0,2, 8, GRID_SIZE-4))
+    elif tile_type == 'slope_left':
+        pygame.draw.polygon(image, get_theme_color(tile_type),
+                            [(0,0), (GRID_SIZE,0), (0,GRID_SIZE)])
+    elif tile_type == 'slope_right':
+        pygame.draw.polygon(image, get_theme_color(tile_type),
+                            [(0,0), (GRID_SIZE,0), (GRID_SIZE,GRID_SIZE)])
+    pygame.draw.rect(image, (0,0,0,60), image.get_rect(), 1)
+    return image
+
+def render_bgo(bgo_type):
+    image = pygame.Surface((GRID_SIZE, GRID_SIZE), pygame.SRCALPHA)
+    color = get_theme_color('bgo_'+bgo_type) if not bgo_type.startswith('bgo_') else get_theme_color(bgo_type)
+    pygame.draw.rect(image, color, image.get_rect().inflate(-4,-4))
+    pygame.draw.rect(image, (*color[:3],180), image.get_rect(), 2)
+    return image
+
+def render_npc(npc_type):
+    image = pygame.Surface((GRID_SIZE, GRID_SIZE), pygame.SRCALPHA)
+    color = get_theme_color(npc_type)
+    if npc_type == 'goomba':
+        pygame.draw.ellipse(image, color, (4,4, GRID_SIZE-8, GRID_SIZE-4))
+        pygame.draw.rect(image, color, (0, GRID_SIZE-8, GRID_SIZE, 8))
+    elif npc_type.startswith('koopa'):
+        pygame.draw.rect(image, color, (4,4, GRID_SIZE-8, GRID_SIZE-4))
+    elif npc_type == 'piranha':
+        pygame.draw.rect(image, color, (8,8, GRID_SIZE-16, GRID_SIZE-8))
+        pygame.draw.circle(image, (255,255,255), (GRID_SIZE//2, 12), 4)
+    elif npc_type == 'thwomp':
+        pygame.draw.rect(image, (100,100,100), (0,0, GRID_SIZE, GRID_SIZE))
+        pygame.draw.rect(image, (50,50,50), (4,4, GRID_SIZE-8, GRID_SIZE-8))
+    else:
+        pygame.draw.rect(image, color, (4,4, GRID_SIZE-8, GRID_SIZE-4))
+    return image
+
+IMAGE_SOURCES = {'tile': (tile_images, render_tile),
+                 'bgo':  (bgo_images, render_bgo),
+                 'npc':  (npc_images, render_npc)}
+
+def object_image(kind, obj_type):
+    key = (kind, obj_type, current_theme)
+    image = image_cache.get(key)
+    if image is None:
+        loaded, render = IMAGE_SOURCES[kind]
+        image = loaded.get(obj_type) if USE_GRAPHICS else None
+        if image is None:
+            image = render(obj_type)
+        elif pygame.display.get_surface():
+            image = image.convert_alpha()
+        image_cache[key] = image
+    return image
+
+def invalidate_images(kind=None, obj_type=None):
+    for key in [k for k in image_cache
+                if (kind is None or k[0] == kind) and (obj_type is None or k[1] == obj_type)]:
+        del image_cache[key]
+
+# -------------------------
+# OBJECT CLASSES
 # -------------------------
-class GameObject(pygame.sprite.Sprite):
+# Plain slotted records rather than pygame Sprites: levels hold tens of
+# thousands of these and the Sprite __dict__ plus group bookkeeping was most
+# of their size. Layers keep BGOs/NPCs in an ObjectSet instead of a Group.
+class GameObject:
+    __slots__ = ('rect', 'layer', 'obj_type', 'event_id', 'flags', '__weakref__')
+    kind = 'tile'
+
     def __init__(self, x, y, obj_type, layer=0, event_id=-1, flags=0):
-        super().__init__()
         self.rect = pygame.Rect(x, y, GRID_SIZE, GRID_SIZE)
         self.layer = layer
         self.obj_type = obj_type
         self.event_id = event_id
         self.flags = flags
 
+    # Images are shared per (kind, type, theme) and only rendered the first
+    # time something of that type is drawn, so loading never rasterizes.
+    @property
+    def image(self):
+        return object_image(self.kind, self.obj_type)
+
 class Tile(GameObject):
+    __slots__ = ('tile_type', 'is_solid', 'store', 'slot', '_event_id')
+
     def __init__(self, x, y, tile_type, layer=0, event_id=-1, flags=0):
+        self.store = None       # TileStore this tile is a view into, if any
+        self.slot = -1
         super().__init__(x, y, tile_type, layer, event_id, flags)
         self.tile_type = tile_type
         self.is_solid = self._is_solid()
-        self.update_image()
+
+    @property
+    def event_id(self):
+        return self._event_id
+
+    @event_id.setter
+    def event_id(self, value):
+        self._event_id = value
+        if self.store is not None:
+            self.store.set_event(self.slot, value)
+
+    @property
+    def oid(self):
+        return self.store.ids[self.slot] if self.store is not None else 0
 
     def _is_solid(self):
         non_solid = ['coin', 'water', 'lava']
         return self.tile_type not in non_solid
 
-    def update_image(self):
-        if USE_GRAPHICS and self.tile_type in tile_images:
-            self.image = tile_images[self.tile_type]
-        else:
-            self.image = pygame.Surface((GRID_SIZE, GRID_SIZE))
-            self.image.fill(get_theme_color(self.tile_type))
-            if self.tile_type == 'question':
-                draw_text(self.image, '?', (GRID_SIZE//2, GRID_SIZE//2), BLACK, FONT_SMALL, True)
-            elif self.tile_type == 'brick':
-                pygame.draw.line(self.image, BLACK, (0, GRID_SIZE//2), (GRID_SIZE, GRID_SIZE//2), 2)
-                pygame.draw.line(self.image, BLACK, (GRID_SIZE//2, 0), (GRID_SIZE//2, GRID_SIZE), 2)
-            elif self.tile_type == 'coin':
-                pygame.draw.circle(self.image, YELLOW, (GRID_SIZE//2, GRID_SIZE//2), GRID_SIZE//3)
-            elif self.tile_type == 'pipe_vertical':
-                pygame.draw.rect(self.image, (0,160,0), (4,0, GRID_SIZE-8, GRID_SIZE))
-                pygame.draw.rect(self.image, (0,200,0), (2,0, GRID_SIZE-4, 8))
-            elif self.tile_type == 'pipe_horizontal':
-                pygame.draw.rect(self.image, (0,160,0), (0,4, GRID_SIZE, GRID_SIZE-8))
-                pygame.draw.rect(self.image, (0,200,0), (0,2, 8, GRID_SIZE-4))
-            elif self.tile_type == 'slope_left':
-                pygame.draw.polygon(self.image, get_theme_color(self.tile_type),
-                                    [(0,0), (GRID_SIZE,0), (0,GRID_SIZE)])
-            elif self.tile_type == 'slope_right':
-                pygame.draw.polygon(self.image, get_theme_color(self.tile_type),
-                                    [(0,0), (GRID_SIZE,0), (GRID_SIZE,GRID_SIZE)])
-            elif self.tile_type == 'water':
-                self.image.fill((0,100,255,128), special_flags=pygame.BLEND_ALPHA_SDL2)
-            elif self.tile_type == 'lava':
-                self.image.fill((255,80,0,128), special_flags=pygame.BLEND_ALPHA_SDL2)
-            pygame.draw.rect(self.image, (0,0,0,60), self.image.get_rect(), 1)
-
 class BGO(GameObject):
+    __slots__ = ('bgo_type', 'oid')
+    kind = 'bgo'
+
     def __init__(self, x, y, bgo_type, layer=0, event_id=-1, flags=0):
         super().__init__(x, y, bgo_type, layer, event_id, flags)
         self.bgo_type = bgo_type
-        self.update_image()
-
-    def update_image(self):
-        if USE_GRAPHICS and self.bgo_type in bgo_images:
-            self.image = bgo_images[self.bgo_type]
-        else:
-            self.image = pygame.Surface((GRID_SIZE, GRID_SIZE), pygame.SRCALPHA)
-            color = get_theme_color('bgo_'+self.bgo_type) if not self.bgo_type.startswith('bgo_') else get_theme_color(self.bgo_type)
-            pygame.draw.rect(self.image, color, self.image.get_rect().inflate(-4,-4))
-            pygame.draw.rect(self.image, (*color[:3],180), self.image.get_rect(), 2)
+        self.oid = 0            # registry id, assigned on first use
 
 class NPC(GameObject):
+    __slots__ = ('npc_type', 'direction', 'special_data', 'velocity', 'state', 'frame',
+                 'on_ground', 'alive', 'oid')
+    kind = 'npc'
+
     def __init__(self, x, y, npc_type, layer=0, event_id=-1, flags=0,
                  direction=1, special_data=0):
         super().__init__(x, y, npc_type, layer, event_id, flags)
         self.npc_type = npc_type
         self.direction = direction
         self.special_data = special_data
-        self.velocity = pygame.Vector2(direction * self._base_speed(), 0)
-        self.state = 'normal'
-        self.frame = 0
-        self.update_image()
+        self.velocity = None    # simulation state is set up on the first update()
+        self.alive = True
+        self.oid = 0
+
+    def copy(self):
+        return NPC(self.rect.x, self.rect.y, self.npc_type, self.layer, self.event_id,
+                   self.flags, self.direction, self.special_data)
+
+    def kill(self):
+        self.alive = False
 
     def _base_speed(self):
         return 1
 
-    def update_image(self):
-        if USE_GRAPHICS and self.npc_type in npc_images:
-            self.image = npc_images[self.npc_type]
-        else:
-            self.image = pygame.Surface((GRID_SIZE, GRID_SIZE), pygame.SRCALPHA)
-            color = get_theme_color(self.npc_type)
-            if self.npc_type == 'goomba':
-                pygame.draw.ellipse(self.image, color, (4,4, GRID_SIZE-8, GRID_SIZE-4))
-                pygame.draw.rect(self.image, color, (0, GRID_SIZE-8, GRID_SIZE, 8))
-            elif self.npc_type.startswith('koopa'):
-                pygame.draw.rect(self.image, color, (4,4, GRID_SIZE-8, GRID_SIZE-4))
-            elif self.npc_type == 'piranha':
-                pygame.draw.rect(self.image, color, (8,8, GRID_SIZE-16, GRID_SIZE-8))
-                pygame.draw.circle(self.image, (255,255,255), (GRID_SIZE//2, 12), 4)
-            elif self.npc_type == 'thwomp':
-                pygame.draw.rect(self.image, (100,100,100), (0,0, GRID_SIZE, GRID_SIZE))
-                pygame.draw.rect(self.image, (50,50,50), (4,4, GRID_SIZE-8, GRID_SIZE-8))
-            else:
-                pygame.draw.rect(self.image, color, (4,4, GRID_SIZE-8, GRID_SIZE-4))
+    def start_sim(self):
+        self.velocity = pygame.Vector2(self.direction * self._base_speed(), 0)
+        self.state = 'normal'
+        self.frame = 0
 
-    def update(self, solid_tiles, player, events):
+    def update(self, section, player, events):
+        if self.velocity is None:
+            self.start_sim()
         if not self._is_flying():
             self.velocity.y += GRAVITY
             self.velocity.y = min(self.velocity.y, TERMINAL_VELOCITY)
         self.rect.x += self.velocity.x
-        self._collide(solid_tiles, 'x', events)
+        self._collide(section.solid_tiles_near(self.rect), 'x', events)
         self.rect.y += self.velocity.y
-        self._collide(solid_tiles, 'y', events)
+        self._collide(section.solid_tiles_near(self.rect), 'y', events)
 
     def _is_flying(self):
         flying = ['lakitu', 'podoboo', 'piranha_fire']
@@ -815,9 +1313,11 @@ class NPC(GameObject):
                 elif t.tile_type == 'water':
                     self.velocity.y *= 0.5
 
-class Player(pygame.sprite.Sprite):
+class Player:
+    __slots__ = ('rect', 'image', 'velocity', 'on_ground', 'powerup_state', 'invincible',
+                 'coins', 'score', 'jump_held', 'variable_jump_timer', 'level_start')
+
     def __init__(self, x, y):
-        super().__init__()
         self.rect = pygame.Rect(x, y, GRID_SIZE, GRID_SIZE)
         self.image = pygame.Surface((GRID_SIZE, GRID_SIZE)); self.image.fill(RED)
         self.velocity = pygame.Vector2(0,0)
@@ -830,7 +1330,7 @@ class Player(pygame.sprite.Sprite):
         self.variable_jump_timer = 0
         self.level_start = (x, y)
 
-    def update(self, solid_tiles, npc_group, events):
+    def update(self, section, npcs, events):
         keys = pygame.key.get_pressed()
         self.velocity.x = 0
         if keys[pygame.K_LEFT] or keys[pygame.K_a]:
@@ -853,12 +1353,12 @@ class Player(pygame.sprite.Sprite):
 
         self.velocity.y = min(self.velocity.y + GRAVITY, TERMINAL_VELOCITY)
         self.rect.x += self.velocity.x
-        self._collide(solid_tiles, 'x', events)
+        self._collide(section, 'x', events)
         self.rect.y += self.velocity.y
         self.on_ground = False
-        self._collide(solid_tiles, 'y', events)
+        self._collide(section, 'y', events)
 
-        for npc in pygame.sprite.spritecollide(self, npc_group, False):
+        for npc in [n for n in npcs if n.alive and self.rect.colliderect(n.rect)]:
             if self.velocity.y > 0 and self.rect.bottom <= npc.rect.centery:
                 npc.kill()
                 self.velocity.y = JUMP_STRENGTH * 0.7
@@ -879,8 +1379,8 @@ class Player(pygame.sprite.Sprite):
         if self.invincible > 0:
             self.invincible -= 1
 
-    def _collide(self, tiles, axis, events):
-        for t in tiles:
+    def _collide(self, section, axis, events):
+        for t in section.solid_tiles_near(self.rect):
             if self.rect.colliderect(t.rect):
                 if t.tile_type == 'lava':
                     self.rect.topleft = self.level_start
@@ -891,7 +1391,7 @@ class Player(pygame.sprite.Sprite):
                 elif t.tile_type == 'water':
                     self.velocity.y *= 0.5
                 elif t.tile_type == 'pswitch':
-                    t.kill()
+                    section.hide_tile(t)
                 if t.tile_type == 'slope_left':
                     offset = self.rect.bottom - t.rect.top
                     if offset > 0 and self.velocity.y >= 0:
@@ -933,10 +1433,13 @@ class Camera:
         self.zoom = 1.0
 
     def update(self, target):
+        self.center_on(target.rect.centerx, target.rect.centery)
+
+    def center_on(self, cx, cy):
         x = min(0, max(-(self.width - CANVAS_WIDTH/self.zoom),
-               -target.rect.centerx + (CANVAS_WIDTH//2)/self.zoom))
+               -cx + (CANVAS_WIDTH//2)/self.zoom))
         y = min(0, max(-(self.height - CANVAS_HEIGHT/self.zoom),
-               -target.rect.centery + (CANVAS_HEIGHT//2)/self.zoom))
+               -cy + (CANVAS_HEIGHT//2)/self.zoom))
         self.camera = pygame.Rect(x, y, self.width, self.height)
 
     def move(self, dx, dy):
@@ -945,26 +1448,745 @@ class Camera:
         self.camera.y = max(-(self.height - CANVAS_HEIGHT/self.zoom),
                             min(0, self.camera.y + dy/self.zoom))
 
+# -------------------------
+# QUERY INDEX
+# -------------------------
+# Secondary indexes kept in step with every add/remove/event change, so
+# "all tiles of type X", "everything on event 3" or "everything with flag
+# bit 2" never scan a layer. Tile stores post slots into bitmaps (one bit per
+# slot: a type on a million-tile layer costs 125 KB and intersections are a
+# single big-int AND); object sets post the objects into plain sets. Events
+# are sparse, so they use sets in both.
+_NONZERO_RUN = re.compile(rb'[^\x00]+')
+_BYTE_BITS = [bytes(b >> i & 1 for i in range(8)) for b in range(256)]   # byte -> 8 0/1 bytes
+
+def flag_bits(flags):
+    flags &= 0xFFFFFFFF
+    while flags:
+        low = flags & -flags
+        yield low.bit_length() - 1
+        flags ^= low
+
+class SlotBitmap:
+    __slots__ = ('bits',)
+
+    def __init__(self, bits=None):
+        self.bits = bits if bits is not None else bytearray()
+
+    def add(self, slot):
+        i = slot >> 3
+        if i >= len(self.bits):
+            self.bits.extend(bytes(i + 1 - len(self.bits) + (len(self.bits) >> 1)))
+        self.bits[i] |= 1 << (slot & 7)
+
+    def discard(self, slot):
+        i = slot >> 3
+        if i < len(self.bits):
+            self.bits[i] &= ~(1 << (slot & 7)) & 0xFF
+
+    def __contains__(self, slot):
+        i = slot >> 3
+        return i < len(self.bits) and bool(self.bits[i] >> (slot & 7) & 1)
+
+    def __and__(self, other):
+        n = min(len(self.bits), len(other.bits))
+        both = int.from_bytes(self.bits[:n], 'little') & int.from_bytes(other.bits[:n], 'little')
+        return SlotBitmap(bytearray(both.to_bytes(n, 'little')))
+
+    def count(self):
+        return bin(int.from_bytes(self.bits, 'little')).count('1')
+
+    def slots(self):
+        # Bits are expanded to one byte per slot and picked out by compress(),
+        # over the whole map when it's dense or only its non-zero runs otherwise.
+        bits, expand = self.bits, _BYTE_BITS.__getitem__
+        if len(bits) - bits.count(0) > len(bits) >> 4:
+            return list(itertools.compress(range(len(bits) << 3), b''.join(map(expand, bits))))
+        out = []
+        for m in _NONZERO_RUN.finditer(bits):
+            a, b = m.span()
+            out.extend(itertools.compress(range(a << 3, b << 3), b''.join(map(expand, bits[a:b]))))
+        return out
+
+class PostingIndex:
+    """type -> items, event_id -> items and flag bit -> items for one container.
+
+    make builds the type/flag postings (SlotBitmap for tile slots, set for
+    objects). Items must be discarded with the values they were added with.
+    """
+    __slots__ = ('make', 'types', 'events', 'flags')
+
+    def __init__(self, make=set):
+        self.make = make
+        self.types = {}
+        self.events = {}
+        self.flags = {}
+
+    def posting(self, table, key):
+        post = table.get(key)
+        if post is None:
+            post = table[key] = set() if table is self.events else self.make()
+        return post
+
+    def _drop(self, table, key, item):
+        post = table.get(key)
+        if post is not None:
+            post.discard(item)
+            if isinstance(post, set) and not post:
+                del table[key]
+
+    def add(self, item, type_key, event_id=-1, flags=0):
+        self.posting(self.types, type_key).add(item)
+        if event_id != -1:
+            self.posting(self.events, event_id).add(item)
+        for bit in flag_bits(flags):
+            self.posting(self.flags, bit).add(item)
+
+    def discard(self, item, type_key, event_id=-1, flags=0):
+        self._drop(self.types, type_key, item)
+        if event_id != -1:
+            self._drop(self.events, event_id, item)
+        for bit in flag_bits(flags):
+            self._drop(self.flags, bit, item)
+
+    def match(self, type_key=None, event_id=None, flags=0):
+        # Items posted under every given key; None if nothing was given (the
+        # caller scans instead). event_id -1 means "no event" and isn't posted,
+        # so it doesn't narrow anything here.
+        posts = []
+        if type_key is not None:
+            posts.append(self.types.get(type_key))
+        if event_id is not None and event_id != -1:
+            posts.append(self.events.get(event_id))
+        posts.extend(self.flags.get(bit) for bit in flag_bits(flags))
+        if not posts:
+            return None
+        if any(post is None for post in posts):
+            return []
+        sets = sorted((p for p in posts if isinstance(p, set)), key=len)
+        maps = [p for p in posts if not isinstance(p, set)]
+        if sets:
+            rest = sets[1:] + maps
+            return [item for item in sets[0] if all(item in p for p in rest)]
+        acc = maps[0]
+        for post in maps[1:]:
+            acc = acc & post
+        return acc.slots()
+
+# -------------------------
+# TILE STORE
+# -------------------------
+# Tiles live in parallel array columns indexed by slot, plus a dense
+# cell -> slot grid that grows to cover whatever cells are used (negative
+# ones included). Slots are keyed by exact position: grid-aligned tiles (all
+# the editor places) own their cell in the grid, while off-grid ones from SMBX
+# levels are keyed by (x, y) in a side dict and may share a cell with each
+# other and with a grid tile, as they could in the old tile_map. Tile sprites
+# are only created as views when something asks for one, and stay bound to
+# their slot while alive.
+TILE_CHUNK = 8              # cells per side of a cached render chunk
+TILE_CHUNK_CACHE = 96       # rendered chunks kept per layer
+TILE_GRID_MAX_CELLS = 1 << 24   # dense grid cap; tiles beyond it go to a sparse dict
+NON_SOLID_TILES = {TILE_SMBX_IDS[n] for n in ('coin', 'water', 'lava')}
+
+tile_stores = weakref.WeakSet()
+
+def invalidate_tile_chunks(tile_type):
+    tid = TILE_SMBX_IDS.get(tile_type, 1)
+    for store in list(tile_stores):
+        store.invalidate_type(tid)
+
+class TileStore:
+    def __init__(self, layer_index=0):
+        self.layer_index = layer_index  # Tile.layer for views, kept by Section.renumber_layers
+        self.ox = self.oy = 0           # cell coords of cell_slot[0]
+        self.cols = self.rows = 0
+        self.cell_slot = array('i')
+        self.far = {}                   # (cx, cy) -> slot for cells outside the dense grid
+        self.loose = {}                 # (x, y) -> slot for off-grid tiles
+        self.loose_cells = {}           # (cx, cy) -> off-grid slots whose corner is in it
+        self.xs = array('i')
+        self.ys = array('i')
+        self.type_id = array('H')       # 0 = free slot
+        self.event_id = array('i')
+        self.flags = array('i')
+        self.ids = array('i')           # registry id per slot, 0 = none yet
+        self.free = []
+        self.count = 0
+        self.views = weakref.WeakValueDictionary()
+        self.hidden = set()             # slots hidden during playtest
+        self.postings = PostingIndex(SlotBitmap)
+        self.chunks = OrderedDict()     # (chx, chy) -> Surface, LRU
+        self.chunk_types = {}
+        self.chunk_theme = None
+        tile_stores.add(self)
+
+    # -- cell grid --
+    def _index(self, cx, cy):
+        cx -= self.ox
+        cy -= self.oy
+        if 0 <= cx < self.cols and 0 <= cy < self.rows:
+            return cy * self.cols + cx
+        return -1
+
+    def _grow(self, cx, cy):
+        if self.cols:
+            x0, y0 = min(self.ox, cx), min(self.oy, cy)
+            x1, y1 = max(self.ox + self.cols, cx + 1), max(self.oy + self.rows, cy + 1)
+            # Grow in the direction of the miss with headroom so runs of adds stay amortized.
+            pad_x, pad_y = max(16, self.cols // 2), max(16, self.rows // 2)
+            if x0 < self.ox: x0 -= pad_x
+            if x1 > self.ox + self.cols: x1 += pad_x
+            if y0 < self.oy: y0 -= pad_y
+            if y1 > self.oy + self.rows: y1 += pad_y
+        else:
+            x0, y0, x1, y1 = min(0, cx), min(0, cy), max(cx + 1, 100), max(cy + 1, 30)
+        cols, rows = x1 - x0, y1 - y0
+        if cols * rows > TILE_GRID_MAX_CELLS:
+            return False
+        grid = array('i', [-1]) * (cols * rows)
+        for r in range(self.rows):
+            src = r * self.cols
+            dst = (r + self.oy - y0) * cols + (self.ox - x0)
+            grid[dst:dst+self.cols] = self.cell_slot[src:src+self.cols]
+        self.cell_slot, self.ox, self.oy, self.cols, self.rows = grid, x0, y0, cols, rows
+        for cell in [c for c in self.far if self._index(*c) >= 0]:
+            self.cell_slot[self._index(*cell)] = self.far.pop(cell)
+        return True
+
+    def _get_cell(self, cx, cy):
+        i = self._index(cx, cy)
+        return self.cell_slot[i] if i >= 0 else self.far.get((cx, cy), -1)
+
+    def _set_cell(self, cx, cy, slot):
+        i = self._index(cx, cy)
+        if i < 0 and slot >= 0 and self._grow(cx, cy):
+            i = self._index(cx, cy)
+        if i >= 0:
+            self.cell_slot[i] = slot
+        elif slot >= 0:
+            self.far[(cx, cy)] = slot
+        else:
+            self.far.pop((cx, cy), None)
+
+    # -- exact positions --
+    def on_grid(self, slot):
+        return not (self.xs[slot] % GRID_SIZE or self.ys[slot] % GRID_SIZE)
+
+    def slot_exact(self, x, y):
+        if x % GRID_SIZE or y % GRID_SIZE:
+            return self.loose.get((x, y), -1)
+        return self._get_cell(x // GRID_SIZE, y // GRID_SIZE)
+
+    def _link(self, slot, x, y):
+        if x % GRID_SIZE or y % GRID_SIZE:
+            self.loose[(x, y)] = slot
+            self.loose_cells.setdefault((x // GRID_SIZE, y // GRID_SIZE), []).append(slot)
+        else:
+            self._set_cell(x // GRID_SIZE, y // GRID_SIZE, slot)
+
+    def _unlink(self, slot):
+        x, y = self.xs[slot], self.ys[slot]
+        cell = (x // GRID_SIZE, y // GRID_SIZE)
+        if x % GRID_SIZE or y % GRID_SIZE:
+            if self.loose.get((x, y)) == slot:
+                del self.loose[(x, y)]
+                bucket = self.loose_cells[cell]
+                bucket.remove(slot)
+                if not bucket:
+                    del self.loose_cells[cell]
+        elif self._get_cell(*cell) == slot:
+            self._set_cell(cell[0], cell[1], -1)
+
+    def slot_at(self, x, y):
+        # Grid tile covering the cell of (x, y); off-grid tiles aren't hit.
+        return self._get_cell(x // GRID_SIZE, y // GRID_SIZE)
+
+    def at(self, x, y):
+        slot = self.slot_at(x, y)
+        return self.view(slot) if slot >= 0 else None
+
+    def __contains__(self, tile):
+        return getattr(tile, 'store', None) is self
+
+    def __len__(self):
+        return self.count
+
+    # -- mutation --
+    def add_record(self, x, y, tid, event_id=-1, flags=0):
+        # A tile already at exactly (x, y) is replaced.
+        old = self.slot_exact(x, y)
+        if old >= 0:
+            self.remove_slot(old)
+        if self.free:
+            slot = self.free.pop()
+            self.xs[slot], self.ys[slot], self.type_id[slot] = x, y, tid
+            self.event_id[slot], self.flags[slot] = event_id, flags
+        else:
+            slot = len(self.type_id)
+            self.xs.append(x); self.ys.append(y); self.type_id.append(tid)
+            self.event_id.append(event_id); self.flags.append(flags); self.ids.append(0)
+        self._link(slot, x, y)
+        self.postings.add(slot, tid, event_id, flags)
+        self.count += 1
+        self._touch(x, y)
+        return slot
+
+    def add(self, tile):
+        slot = self.add_record(tile.rect.x, tile.rect.y, TILE_SMBX_IDS.get(tile.tile_type, 1),
+                               tile.event_id, tile.flags)
+        tile.store, tile.slot = self, slot
+        self.views[slot] = tile
+
+    def remove(self, tile):
+        if tile.store is self:
+            self.remove_slot(tile.slot)
+
+    def remove_slot(self, slot):
+        self._unlink(slot)
+        self._free(slot)
+
+    def move_slot(self, slot, x, y):
+        # Moves a tile in place (keeping its slot and id); a tile already at
+        # exactly (x, y) is dropped.
+        self._unlink(slot)
+        self._touch(self.xs[slot], self.ys[slot])
+        old = self.slot_exact(x, y)
+        if old >= 0:
+            self.remove_slot(old)
+        self.xs[slot], self.ys[slot] = x, y
+        self._link(slot, x, y)
+        self._touch(x, y)
+        view = self.views.get(slot)
+        if view is not None:
+            view.rect.topleft = (x, y)
+
+    def _free(self, slot):
+        self.postings.discard(slot, self.type_id[slot], self.event_id[slot], self.flags[slot])
+        self.type_id[slot] = 0
+        self.ids[slot] = 0
+        self.free.append(slot)
+        self.count -= 1
+        self.hidden.discard(slot)
+        view = self.views.pop(slot, None)
+        if view is not None:
+            view.store, view.slot = None, -1
+        self._touch(self.xs[slot], self.ys[slot])
+
+    def set_event(self, slot, event_id):
+        self.set_extras(slot, event_id, self.flags[slot])
+
+    def set_extras(self, slot, event_id, flags):
+        tid = self.type_id[slot]
+        self.postings.discard(slot, tid, self.event_id[slot], self.flags[slot])
+        self.event_id[slot], self.flags[slot] = event_id, flags
+        self.postings.add(slot, tid, event_id, flags)
+
+    def empty(self):
+        for view in list(self.views.values()):
+            view.store, view.slot = None, -1
+        self.__init__(self.layer_index)
+
+    def set_layer_index(self, li):
+        self.layer_index = li
+        for view in self.views.values():
+            view.layer = li
+
+    # -- views / iteration --
+    def view(self, slot):
+        tile = self.views.get(slot)
+        if tile is None:
+            tile = Tile(self.xs[slot], self.ys[slot], TILE_ID_TO_NAME.get(self.type_id[slot], 'ground'),
+                        self.layer_index, self.event_id[slot], self.flags[slot])
+            tile.store, tile.slot = self, slot
+            self.views[slot] = tile
+        return tile
+
+    def live_slots(self):
+        type_id = self.type_id
+        return [s for s in range(len(type_id)) if type_id[s]]
+
+    def __iter__(self):
+        return iter([self.view(s) for s in self.live_slots()])
+
+    def sprites(self):
+        return list(self)
+
+    def records(self):
+        """(x, y, type_id, event_id, flags) for every tile, without building views."""
+        xs, ys, tids, evs, fls = self.xs, self.ys, self.type_id, self.event_id, self.flags
+        return [(xs[s], ys[s], tids[s], evs[s], fls[s]) for s in self.live_slots()]
+
+    def type_names(self):
+        return {TILE_ID_TO_NAME.get(t, 'ground') for t in set(self.type_id) if t}
+
+    def query(self, tid=None, event_id=None, flags=0):
+        # Live slots matching every given criterion (flags: all bits set).
+        slots = self.postings.match(tid, event_id, flags)
+        if slots is None:
+            slots = self.live_slots()
+        if event_id == -1:
+            ev = self.event_id
+            slots = [s for s in slots if ev[s] == -1]
+        return slots
+
+    def slots_in(self, c0, r0, c1, r1):
+        # Slots whose cell lies in [c0, c1) x [r0, r1): off-grid and far ones
+        # first, then the grid in row order.
+        loose = self.loose_cells
+        if (c1 - c0) * (r1 - r0) < len(loose):
+            keys = [(x, y) for y in range(r0, r1) for x in range(c0, c1) if (x, y) in loose]
+        else:
+            keys = [k for k in loose if c0 <= k[0] < c1 and r0 <= k[1] < r1]
+        out = [s for k in keys for s in loose[k]]
+        out.extend(s for (cx, cy), s in self.far.items() if c0 <= cx < c1 and r0 <= cy < r1)
+        c0, c1 = max(c0 - self.ox, 0), min(c1 - self.ox, self.cols)
+        r0, r1 = max(r0 - self.oy, 0), min(r1 - self.oy, self.rows)
+        for r in range(r0, r1):
+            row = r * self.cols
+            out.extend(s for s in self.cell_slot[row+c0:row+c1] if s >= 0)
+        return out
+
+    # -- collision (playtest) --
+    def solid_near(self, rect):
+        slots = self.slots_in(rect.left // GRID_SIZE - 1, rect.top // GRID_SIZE - 1,
+                              rect.right // GRID_SIZE + 2, rect.bottom // GRID_SIZE + 2)
+        return [self.view(s) for s in slots
+                if self.type_id[s] not in NON_SOLID_TILES and s not in self.hidden]
+
+    def hide(self, tile):
+        if tile.store is self:
+            self.hidden.add(tile.slot)
+            self._touch(tile.rect.x, tile.rect.y)
+
+    def clear_hidden(self):
+        for slot in self.hidden:
+            self._touch(self.xs[slot], self.ys[slot])
+        self.hidden.clear()
+
+    # -- span fill --
+    def _row_slots(self, cy, x0, x1):
+        # Slot per cell of row cy in [x0, x1), -1 where empty.
+        slots = array('i', [-1]) * (x1 - x0)
+        r = cy - self.oy
+        if 0 <= r < self.rows:
+            a, b = max(x0, self.ox), min(x1, self.ox + self.cols)
+            if a < b:
+                base = r * self.cols - self.ox
+                slots[a - x0:b - x0] = self.cell_slot[base + a:base + b]
+        for (fx, fy), slot in self.far.items():
+            if fy == cy and x0 <= fx < x1:
+                slots[fx - x0] = slot
+        return slots
+
+    def type_row(self, cy, x0, x1):
+        type_id = self.type_id
+        return [type_id[s] if s >= 0 else 0 for s in self._row_slots(cy, x0, x1)]
+
+    def _row_mask(self, cy, x0, x1, tid):
+        # 1 for each cell of row cy in [x0, x1) holding tid (0 = empty).
+        slots = self._row_slots(cy, x0, x1)
+        type_id = self.type_id
+        if tid == 0:
+            return bytearray(s < 0 for s in slots)
+        return bytearray(s >= 0 and type_id[s] == tid for s in slots)
+
+    def flood_spans(self, cx, cy, bounds, limit, walked=None):
+        """Scanline flood fill from (cx, cy) over cells of the same type.
+
+        Returns an array of (row, c0, c1) spans inside bounds (c0, r0, c1, r1),
+        or None once more than limit cells would be filled; the spans found
+        up to then are left in walked if it is given.
+        """
+        bx0, by0, bx1, by1 = bounds
+        if not (bx0 <= cx < bx1 and by0 <= cy < by1):
+            return array('i')
+        slot = self._get_cell(cx, cy)
+        tid = self.type_id[slot] if slot >= 0 else 0
+        # Row masks double as the visited set: filled cells are zeroed.
+        masks = {}
+
+        def row(y):
+            m = masks.get(y)
+            if m is None:
+                m = masks[y] = self._row_mask(y, bx0, bx1, tid)
+            return m
+
+        spans = array('i')
+        total = 0
+        stack = [(cx, cy)]
+        while stack:
+            x, y = stack.pop()
+            m = row(y)
+            if not m[x - bx0]:
+                continue
+            x0 = x
+            while x0 > bx0 and m[x0 - 1 - bx0]:
+                x0 -= 1
+            x1 = x + 1
+            while x1 < bx1 and m[x1 - bx0]:
+                x1 += 1
+            m[x0 - bx0:x1 - bx0] = bytes(x1 - x0)
+            spans.extend((y, x0, x1))
+            total += x1 - x0
+            if total > limit:
+                if walked is not None:
+                    walked.extend(spans)
+                return None
+            for ny in (y - 1, y + 1):
+                if by0 <= ny < by1:
+                    n = row(ny)
+                    nx = x0
+                    while nx < x1:
+                        if n[nx - bx0]:
+                            stack.append((nx, ny))
+                            while nx < x1 and n[nx - bx0]:
+                                nx += 1
+                        else:
+                            nx += 1
+        return spans
+
+    def span_slots(self, spans):
+        out = []
+        for i in range(0, len(spans), 3):
+            out.extend(s for s in self._row_slots(*spans[i:i+3]) if s >= 0)
+        return out
+
+    def clear_spans(self, spans):
+        """Frees every tile in spans; returns (cx, cy, event_id, flags, id) for non-default ones."""
+        extras = []
+        for i in range(0, len(spans), 3):
+            y, x0, x1 = spans[i:i+3]
+            for x in range(x0, x1):
+                slot = self._get_cell(x, y)
+                if slot < 0:
+                    continue
+                if self.event_id[slot] != -1 or self.flags[slot] or self.ids[slot]:
+                    extras.append((x, y, self.event_id[slot], self.flags[slot], self.ids[slot]))
+                self._set_cell(x, y, -1)
+                self._free(slot)
+        return extras
+
+    def add_spans(self, spans, tid):
+        # Batch insert: columns are extended once, then cells are assigned.
+        self.clear_spans(spans)
+        total = sum(spans[i+2] - spans[i+1] for i in range(0, len(spans), 3))
+        reuse = self.free[-total:] if total else []
+        del self.free[len(self.free) - len(reuse):]
+        fresh = total - len(reuse)
+        start = len(self.type_id)
+        self.xs.extend(array('i', [0]) * fresh)
+        self.ys.extend(array('i', [0]) * fresh)
+        self.type_id.extend(array('H', [tid]) * fresh)
+        self.event_id.extend(array('i', [-1]) * fresh)
+        self.flags.extend(array('i', [0]) * fresh)
+        self.ids.extend(array('i', [0]) * fresh)
+        slots = itertools.chain(reuse, range(start, start + fresh))
+        xs, ys, type_id, event_id, flags = self.xs, self.ys, self.type_id, self.event_id, self.flags
+        post = self.postings.posting(self.postings.types, tid)
+        for i in range(0, len(spans), 3):
+            y, x0, x1 = spans[i:i+3]
+            py = y * GRID_SIZE
+            for x in range(x0, x1):
+                slot = next(slots)
+                xs[slot], ys[slot], type_id[slot] = x * GRID_SIZE, py, tid
+                event_id[slot], flags[slot] = -1, 0
+                post.add(slot)
+                self._set_cell(x, y, slot)
+            self._touch_span(y, x0, x1)
+        self.count += total
+
+    # -- chunked rendering --
+    def _touch_span(self, y, x0, x1):
+        for chx in range(x0 // TILE_CHUNK, (x1 - 1) // TILE_CHUNK + 1):
+            self.chunks.pop((chx, y // TILE_CHUNK), None)
+
+    def _touch(self, x, y):
+        size = TILE_CHUNK * GRID_SIZE
+        for chx in {x // size, (x + GRID_SIZE - 1) // size}:
+            for chy in {y // size, (y + GRID_SIZE - 1) // size}:
+                self.chunks.pop((chx, chy), None)
+
+    def invalidate_type(self, tid):
+        for key, types in list(self.chunk_types.items()):
+            if tid in types:
+                self.chunks.pop(key, None)
+
+    def _render_chunk(self, chx, chy):
+        size = TILE_CHUNK * GRID_SIZE
+        surf = pygame.Surface((size, size), pygame.SRCALPHA)
+        x0, y0 = chx * size, chy * size
+        c0, r0 = chx * TILE_CHUNK, chy * TILE_CHUNK
+        # One cell of margin picks up off-grid tiles that overlap this chunk.
+        slots = self.slots_in(c0 - 1, r0 - 1, c0 + TILE_CHUNK + 1, r0 + TILE_CHUNK + 1)
+        types = set()
+        for s in slots:
+            if s in self.hidden:
+                continue
+            tid = self.type_id[s]
+            types.add(tid)
+            surf.blit(object_image('tile', TILE_ID_TO_NAME.get(tid, 'ground')), (self.xs[s] - x0, self.ys[s] - y0))
+        self.chunk_types[(chx, chy)] = types
+        return surf
+
+    def draw(self, surf, view, ox, oy):
+        if self.chunk_theme != current_theme:
+            self.chunks.clear()
+            self.chunk_theme = current_theme
+        size = TILE_CHUNK * GRID_SIZE
+        for chy in range(view.top // size, view.bottom // size + 1):
+            for chx in range(view.left // size, view.right // size + 1):
+                key = (chx, chy)
+                chunk = self.chunks.get(key)
+                if chunk is None:
+                    chunk = self.chunks[key] = self._render_chunk(chx, chy)
+                    if len(self.chunks) > TILE_CHUNK_CACHE:
+                        self.chunks.popitem(last=False)
+                else:
+                    self.chunks.move_to_end(key)
+                surf.blit(chunk, (chx * size + ox, chy * size + oy))
+
 # -------------------------
 # LAYER / SECTION / LEVEL
 # -------------------------
+class ObjectSet(dict):
+    """Insertion-ordered set of level objects, with the Group methods the editor uses.
+
+    cells maps the grid cell of each object's top-left corner to the objects
+    in it, so hit tests don't scan the layer. Objects must be moved through
+    move() to keep it in sync, and change events through set_event() so the
+    query postings follow.
+    """
+    __slots__ = ('cells', 'postings')
+
+    def __init__(self):
+        super().__init__()
+        self.cells = {}
+        self.postings = PostingIndex()
+
+    @staticmethod
+    def cell_of(x, y):
+        return (x // GRID_SIZE, y // GRID_SIZE)
+
+    def add(self, obj):
+        if obj in self:
+            return
+        self[obj] = None
+        self.cells.setdefault(self.cell_of(obj.rect.x, obj.rect.y), []).append(obj)
+        self.postings.add(obj, obj.obj_type, obj.event_id, obj.flags)
+
+    def remove(self, obj):
+        if obj not in self:
+            return
+        del self[obj]
+        key = self.cell_of(obj.rect.x, obj.rect.y)
+        bucket = self.cells[key]
+        bucket.remove(obj)
+        if not bucket:
+            del self.cells[key]
+        self.postings.discard(obj, obj.obj_type, obj.event_id, obj.flags)
+
+    def move(self, obj, x, y):
+        self.remove(obj)
+        obj.rect.topleft = (x, y)
+        self.add(obj)
+
+    def set_event(self, obj, event_id):
+        if obj in self:
+            self.postings.discard(obj, obj.obj_type, obj.event_id, obj.flags)
+            self.postings.add(obj, obj.obj_type, event_id, obj.flags)
+        obj.event_id = event_id
+
+    def query(self, obj_type=None, event_id=None, flags=0):
+        objs = self.postings.match(obj_type, event_id, flags)
+        if objs is None:
+            objs = list(self)
+        if event_id == -1:
+            objs = [o for o in objs if o.event_id == -1]
+        return objs
+
+    def at(self, x, y):
+        return self.cells.get(self.cell_of(x, y), ())
+
+    def cells_in(self, c0, r0, c1, r1):
+        # Occupied cells in [c0, c1) x [r0, r1); walks the rect or the
+        # occupied cells, whichever is smaller.
+        cells = self.cells
+        if (c1 - c0) * (r1 - r0) < len(cells):
+            return [(x, y) for y in range(r0, r1) for x in range(c0, c1) if (x, y) in cells]
+        return [k for k in cells if c0 <= k[0] < c1 and r0 <= k[1] < r1]
+
+    def in_rect(self, c0, r0, c1, r1):
+        # Objects whose cell lies in [c0, c1) x [r0, r1).
+        cells = self.cells
+        return [obj for k in self.cells_in(c0, r0, c1, r1) for obj in cells[k]]
+
+    def find(self, x, y, obj_type=None):
+        for obj in self.at(x, y):
+            if obj.rect.x == x and obj.rect.y == y and obj_type in (None, obj.obj_type):
+                return obj
+        return None
+
+    def empty(self):
+        self.clear()
+        self.cells.clear()
+        self.postings = PostingIndex()
+
+    def sprites(self):
+        return list(self)
+
 class Layer:
     def __init__(self, name="Layer 1", visible=True, locked=False):
         self.name = name
         self.visible = visible
         self.locked = locked
-        self.tiles = pygame.sprite.Group()
-        self.bgos = pygame.sprite.Group()
-        self.npcs = pygame.sprite.Group()
-        self.tile_map = {}
+        self.tiles = TileStore()
+        self.bgos = ObjectSet()
+        self.npcs = ObjectSet()
 
     def add_tile(self, tile):
         self.tiles.add(tile)
-        self.tile_map[(tile.rect.x, tile.rect.y)] = tile
 
     def remove_tile(self, tile):
         self.tiles.remove(tile)
-        self.tile_map.pop((tile.rect.x, tile.rect.y), None)
+
+    def add(self, obj):
+        if isinstance(obj, Tile):
+            self.add_tile(obj)
+        elif isinstance(obj, BGO):
+            self.bgos.add(obj)
+        elif isinstance(obj, NPC):
+            self.npcs.add(obj)
+
+    def remove(self, obj):
+        if isinstance(obj, Tile):
+            self.remove_tile(obj)
+        elif isinstance(obj, BGO):
+            self.bgos.remove(obj)
+        elif isinstance(obj, NPC):
+            self.npcs.remove(obj)
+
+    def set_event(self, obj, event_id):
+        if isinstance(obj, Tile):
+            obj.event_id = event_id
+        else:
+            (self.npcs if isinstance(obj, NPC) else self.bgos).set_event(obj, event_id)
+
+    def object_at(self, x, y):
+        # Topmost object in the cell: tile, then NPC, then BGO.
+        obj = self.tiles.at(x, y)
+        if obj is None:
+            for group in (self.npcs, self.bgos):
+                hits = group.at(x, y)
+                if hits:
+                    return hits[-1]
+        return obj
+
+    def has_duplicate(self, obj):
+        if isinstance(obj, Tile):
+            return self.tiles.slot_exact(obj.rect.x, obj.rect.y) >= 0
+        group = self.npcs if isinstance(obj, NPC) else self.bgos
+        return group.find(obj.rect.x, obj.rect.y, obj.obj_type) is not None
 
 class Section:
     def __init__(self, width=100, height=30):
@@ -981,12 +2203,128 @@ class Section:
     def current_layer(self):
         return self.layers[self.current_layer_idx]
 
-    def get_solid_tiles(self):
+    def renumber_layers(self):
+        # Objects carry their layer's index; call after adding or removing layers.
+        for li, layer in enumerate(self.layers):
+            layer.tiles.set_layer_index(li)
+            for obj in (*layer.bgos, *layer.npcs):
+                obj.layer = li
+
+    def solid_tiles_near(self, rect):
         return [t for layer in self.layers if layer.visible
-                for t in layer.tiles if t.is_solid]
+                for t in layer.tiles.solid_near(rect)]
+
+    def hide_tile(self, tile):
+        if tile.store is not None:
+            tile.store.hide(tile)
+
+    def clear_hidden(self):
+        for layer in self.layers:
+            layer.tiles.clear_hidden()
+
+class ObjectRegistry:
+    """Stable integer ids for level objects.
+
+    Ids are handed out the first time an object is referenced (selection,
+    undo) and survive removal and re-adding through bind(). Tiles keep theirs
+    in TileStore.ids, BGOs/NPCs in obj.oid. where maps id -> (section, layer,
+    slot) for tiles or (section, layer, obj) otherwise; entries are checked
+    on lookup, so objects dropped behind the registry's back simply vanish.
+    """
+    def __init__(self):
+        self.next_id = 1
+        self.where = {}
+
+    def _new_id(self):
+        oid = self.next_id
+        self.next_id += 1
+        return oid
+
+    def id_of(self, section, layer, obj):
+        oid = obj.oid
+        if not oid:
+            oid = self._new_id()
+            self.bind(oid, section, layer, obj)
+        return oid
+
+    def slot_ids(self, section, layer, slots):
+        store = layer.tiles
+        out = []
+        for slot in slots:
+            oid = store.ids[slot]
+            if not oid:
+                oid = store.ids[slot] = self._new_id()
+                self.where[oid] = (section, layer, slot)
+            out.append(oid)
+        return out
+
+    def ids_in(self, section, layer):
+        out = self.slot_ids(section, layer, layer.tiles.live_slots())
+        out.extend(self.id_of(section, layer, obj) for group in (layer.bgos, layer.npcs) for obj in group)
+        return out
+
+    def ids_in_rect(self, section, layer, c0, r0, c1, r1):
+        # Spatial query over cells [c0, c1) x [r0, r1), without building tile views.
+        out = self.slot_ids(section, layer, layer.tiles.slots_in(c0, r0, c1, r1))
+        out.extend(self.id_of(section, layer, obj)
+                   for group in (layer.bgos, layer.npcs) for obj in group.in_rect(c0, r0, c1, r1))
+        return out
+
+    def bind(self, oid, section, layer, obj):
+        if isinstance(obj, Tile):
+            self.bind_slot(oid, section, layer, obj.slot)
+        else:
+            obj.oid = oid
+            self.where[oid] = (section, layer, obj)
+
+    def bind_slot(self, oid, section, layer, slot):
+        layer.tiles.ids[slot] = oid
+        self.where[oid] = (section, layer, slot)
+
+    def locate(self, oid):
+        entry = self.where.get(oid)
+        if entry is None:
+            return None
+        section, layer, key = entry
+        if isinstance(key, int):
+            store = layer.tiles
+            if key < len(store.ids) and store.ids[key] == oid:
+                return section, layer, store.view(key)
+        elif key.oid == oid and (key in layer.bgos or key in layer.npcs):
+            return entry
+        del self.where[oid]
+        return None
+
+    def get(self, oid):
+        loc = self.locate(oid)
+        return loc[2] if loc else None
+
+    def forget(self, oid):
+        self.where.pop(oid, None)
+
+    def move(self, oid, x, y):
+        loc = self.locate(oid)
+        if loc is None:
+            return False
+        section, layer, obj = loc
+        if isinstance(obj, Tile):
+            layer.tiles.move_slot(obj.slot, x, y)
+        else:
+            (layer.npcs if isinstance(obj, NPC) else layer.bgos).move(obj, x, y)
+        return True
+
+def object_record(obj):
+    """Plain data needed to rebuild obj, minus its layer."""
+    extra = (obj.direction, obj.special_data) if isinstance(obj, NPC) else ()
+    return (type(obj), obj.rect.x, obj.rect.y, obj.obj_type, obj.event_id, obj.flags) + extra
+
+def build_object(record, li):
+    cls, x, y, otype, event_id, flags, *extra = record
+    return cls(x, y, otype, li, event_id, flags, *extra)
 
 class Level:
     def __init__(self):
+        self.objects = ObjectRegistry()
         self.sections = [Section()]
         self.current_section_idx = 0
         self.start_pos = (100,500)
@@ -1003,151 +2341,356 @@ class Level:
     def current_layer(self):
         return self.current_section().current_layer()
 
+    def query(self, obj_type=None, event_id=None, flags=0, kind=None, section=None, layer=None):
+        """Objects matching all given criteria, as (section, layer, keys) groups.
+
+        keys are tile slots or BGOs/NPCs, as in ObjectRegistry.where; grouping
+        keeps a million-hit query from building a million tuples. None means
+        any; event_id -1 matches objects without an event and flags those with
+        all of its bits set. section/layer narrow the scope.
+        """
+        out = []
+        tid = None if obj_type is None else TILE_SMBX_IDS.get(obj_type, 0)
+        for sec in (self.sections if section is None else (section,)):
+            for lay in (sec.layers if layer is None else (layer,)):
+                hits = []
+                if kind in (None, 'tile'):
+                    hits.append(lay.tiles.query(tid, event_id, flags))
+                for k, group in (('bgo', lay.bgos), ('npc', lay.npcs)):
+                    if kind in (None, k):
+                        hits.append(group.query(obj_type, event_id, flags))
+                out.extend((sec, lay, keys) for keys in hits if keys)
+        return out
+
 # -------------------------
 # FILE I/O (SMBX 1.3 binary format)
 # -------------------------
 def read_lvl(filename):
+    # Counts and layer indices are validated by mfbconvert.LvlReader before
+    # any objects are built; a corrupt file raises LevelFormatError.
+    with open(filename, 'rb') as f:
+        r = mfbconvert.LvlReader(f.read())
     level = Level()
-    try:
-        with open(filename, 'rb') as f:
-            magic = f.read(4)
-            if magic != b'LVL\x1a':
-                print("Not a valid SMBX level file")
-                return level
-            version = struct.unpack('<I', f.read(4))[0]
-            level.name = f.read(32).decode('utf-8', errors='ignore').strip('\x00')
-            level.author = f.read(32).decode('utf-8', errors='ignore').strip('\x00')
-            level.time_limit = struct.unpack('<I', f.read(4))[0]
-            level.stars = struct.unpack('<I', f.read(4))[0]
-            flags = struct.unpack('<I', f.read(4))[0]
-            level.no_background = bool(flags & 1)
-            f.read(128-4-4-32-32-4-4-4)
-
-            num_sections = struct.unpack('<I', f.read(4))[0]
-            level.sections = []
-            for s in range(num_sections):
-                section = Section()
-                section.width = struct.unpack('<I', f.read(4))[0]
-                section.height = struct.unpack('<I', f.read(4))[0]
-                bg_r, bg_g, bg_b = struct.unpack('<BBB', f.read(3))
-                section.bg_color = (bg_r, bg_g, bg_b)
-                f.read(1)
-                section.music = struct.unpack('<I', f.read(4))[0]
-
-                num_blocks = struct.unpack('<I', f.read(4))[0]
-                for _ in range(num_blocks):
-                    x, y, type_id, layer, event_id, flags = struct.unpack('<IIIIII', f.read(24))
-                    if type_id in TILE_ID_TO_NAME:
-                        tile = Tile(x, y, TILE_ID_TO_NAME[type_id], layer, event_id, flags)
-                        while len(section.layers) <= layer:
-                            section.layers.append(Layer(f"Layer {len(section.layers)+1}"))
-                        section.layers[layer].add_tile(tile)
-
-                num_bgos = struct.unpack('<I', f.read(4))[0]
-                for _ in range(num_bgos):
-                    x, y, type_id, layer, flags = struct.unpack('<IIIII', f.read(20))
-                    if type_id in BGO_ID_TO_NAME:
-                        bgo = BGO(x, y, BGO_ID_TO_NAME[type_id], layer, flags=flags)
-                        while len(section.layers) <= layer:
-                            section.layers.append(Layer(f"Layer {len(section.layers)+1}"))
-                        section.layers[layer].bgos.add(bgo)
-
-                num_npcs = struct.unpack('<I', f.read(4))[0]
-                for _ in range(num_npcs):
-                    x, y, type_id, layer, event_id, flags, direction, special = struct.unpack('<IIIIIIII', f.read(32))
-                    if type_id in NPC_ID_TO_NAME:
-                        npc = NPC(x, y, NPC_ID_TO_NAME[type_id], layer, event_id, flags,
-                                  direction=1 if direction else -1, special_data=special)
-                        while len(section.layers) <= layer:
-                            section.layers.append(Layer(f"Layer {len(section.layers)+1}"))
-                        section.layers[layer].npcs.add(npc)
-
-                num_warps = struct.unpack('<I', f.read(4))[0]
-                for _ in range(num_warps):
-                    f.read(64)
-
-                num_events = struct.unpack('<I', f.read(4))[0]
-                for _ in range(num_events):
-                    name_len = struct.unpack('<B', f.read(1))[0]
-                    name = f.read(name_len).decode('utf-8')
-                    trigger = struct.unpack('<I', f.read(4))[0]
-                    action_count = struct.unpack('<I', f.read(4))[0]
-                    for _ in range(action_count):
-                        f.read(12)
-                    section.events.append(Event(name, str(trigger), []))
-
-                level.sections.append(section)
-    except Exception as e:
-        print("Load error:", e)
+    level.sections = []
+    for _ in range(r.header(level)):
+        section = Section()
+        section.width, section.height, bg_r, bg_g, bg_b, section.music = r.unpack('<IIBBBxI', 'section header')
+        section.bg_color = (bg_r, bg_g, bg_b)
+        blocks = r.table(r.count(24, 'block'), 6, 'block')
+        bgos = r.table(r.count(20, 'bgo'), 5, 'bgo')
+        npcs = r.table(r.count(32, 'npc'), 8, 'npc')
+        top = max(max(blocks[3::6], default=0), max(bgos[3::5], default=0), max(npcs[3::8], default=0))
+        section.layers = [Layer(f"Layer {i+1}") for i in range(top+1)]
+        section.renumber_layers()
+        layers = section.layers
+        for i in range(0, len(blocks), 6):
+            x, y, type_id, layer, event_id, flags = blocks[i:i+6]
+            if type_id in TILE_ID_TO_NAME:
+                layers[layer].tiles.add_record(x, y, type_id, event_id, flags)
+        for i in range(0, len(bgos), 5):
+            x, y, type_id, layer, flags = bgos[i:i+5]
+            if type_id in BGO_ID_TO_NAME:
+                layers[layer].bgos.add(BGO(x, y, BGO_ID_TO_NAME[type_id], layer, flags=flags))
+        for i in range(0, len(npcs), 8):
+            x, y, type_id, layer, event_id, flags, direction, special = npcs[i:i+8]
+            if type_id in NPC_ID_TO_NAME:
+                layers[layer].npcs.add(NPC(x, y, NPC_ID_TO_NAME[type_id], layer, event_id, flags,
+                                           direction=1 if direction else -1, special_data=special))
+        r.raw(64*r.count(64, 'warp'), 'warp')
+        section.events = [Event(name, str(trigger), []) for name, trigger in r.events()]
+        level.sections.append(section)
+    return level
+
+def level_from_data(data):
+    # mfbconvert.LevelData (any editor's format) -> editor Level.
+    level = Level()
+    level.name, level.author = data.name, data.author
+    level.time_limit, level.stars, level.no_background = data.time_limit, data.stars, data.no_background
+    level.sections = []
+    for sd in data.sections:
+        section = Section()
+        section.width, section.height = sd.width, sd.height
+        section.bg_color, section.music = tuple(sd.bg_color), sd.music
+        section.layers = [Layer(name) for name in sd.layers]
+        section.renumber_layers()
+        for x, y, name, li, ev, fl in sd.blocks:
+            if name in TILE_SMBX_IDS:
+                section.layers[li].tiles.add_record(x, y, TILE_SMBX_IDS[name], ev, fl)
+        for x, y, name, li, fl in sd.bgos:
+            if name in BGO_SMBX_IDS:
+                section.layers[li].bgos.add(BGO(x, y, name, li, flags=fl))
+        for x, y, name, li, ev, fl, d, sp in sd.npcs:
+            if name in NPC_SMBX_IDS:
+                section.layers[li].npcs.add(NPC(x, y, name, li, ev, fl, direction=d, special_data=sp))
+        section.events = [Event(name, "0", []) for name in sd.events]
+        level.sections.append(section)
     return level
 
+def open_level(filename):
+    """Open a level from any of the editors. Returns (format name, Level)."""
+    with open(filename, 'rb') as f:
+        head = f.read(mfbconvert.SNIFF_BYTES)
+    if mfbconvert.sniff_lvl(head, os.path.getsize(filename)):
+        # Native format: keeps event triggers that the neutral model drops.
+        return 'lvl', read_lvl(filename)
+    fmt, data, size = mfbconvert.load_level_file(filename)
+    return fmt, level_from_data(data)
+
+def snapshot_level(level):
+    # Cheap main-thread copy of everything write_lvl needs: one array('i')
+    # per object table, so the encoder can run on another thread while the
+    # editor keeps mutating the sprite groups.
+    sections = []
+    for section in level.sections:
+        blocks, bgos, npcs = array('i'), array('i'), array('i')
+        for li, layer in enumerate(section.layers):
+            for x, y, tid, ev, fl in layer.tiles.records():
+                blocks.extend((x, y, tid, li, ev, fl))
+            for b in layer.bgos:
+                bgos.extend((b.rect.x, b.rect.y, BGO_SMBX_IDS.get(b.bgo_type, 5), li, b.flags))
+            for n in layer.npcs:
+                npcs.extend((n.rect.x, n.rect.y, NPC_SMBX_IDS.get(n.npc_type, 1), li,
+                             n.event_id, n.flags, 1 if n.direction > 0 else 0, n.special_data))
+        sections.append((section.width, section.height, tuple(section.bg_color[:3]),
+                         section.music, blocks, bgos, npcs, len(section.warps),
+                         [e.name for e in section.events]))
+    return (level.name, level.author, level.time_limit, level.stars,
+            level.no_background, sections)
+
+def _le_bytes(arr):
+    if sys.byteorder != 'little':
+        arr = array(arr.typecode, arr)
+        arr.byteswap()
+    return arr.tobytes()
+
+def encode_lvl(snapshot):
+    name, author, time_limit, stars, no_background, sections = snapshot
+    out = [b'LVL\x1a', struct.pack('<I', 1)]
+    out.append((name.encode('utf-8')[:31] + b'\x00').ljust(32, b'\x00'))
+    out.append((author.encode('utf-8')[:31] + b'\x00').ljust(32, b'\x00'))
+    out.append(struct.pack('<III', time_limit, stars, 1 if no_background else 0))
+    header = b''.join(out)
+    out = [header.ljust(128, b'\x00'), struct.pack('<I', len(sections))]
+    for width, height, bg, music, blocks, bgos, npcs, num_warps, events in sections:
+        out.append(struct.pack('<IIBBBxI', width, height, bg[0], bg[1], bg[2], music))
+        out.append(struct.pack('<I', len(blocks)//6)); out.append(_le_bytes(blocks))
+        out.append(struct.pack('<I', len(bgos)//5));   out.append(_le_bytes(bgos))
+        out.append(struct.pack('<I', len(npcs)//8));   out.append(_le_bytes(npcs))
+        out.append(struct.pack('<I', num_warps));      out.append(b'\x00' * (64*num_warps))
+        out.append(struct.pack('<I', len(events)))
+        for ev_name in events:
+            name_bytes = ev_name.encode('utf-8')[:255]
+            out.append(struct.pack('<B', len(name_bytes)) + name_bytes + struct.pack('<II', 0, 0))
+    return b''.join(out)
+
+def write_file_durable(filename, data):
+    # Write to a temp file, fsync, then atomically replace the target so a
+    # crash mid-write never leaves a truncated level behind.
+    d = os.path.dirname(filename)
+    if d:
+        os.makedirs(d, exist_ok=True)
+    tmp = filename + ".tmp"
+    with open(tmp, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, filename)
+    return len(data)
+
 def write_lvl(filename, level):
-    with open(filename, 'wb') as f:
-        f.write(b'LVL\x1a')
-        f.write(struct.pack('<I', 1))
-        name_bytes = level.name.encode('utf-8')[:31] + b'\x00'
-        f.write(name_bytes.ljust(32, b'\x00'))
-        author_bytes = level.author.encode('utf-8')[:31] + b'\x00'
-        f.write(author_bytes.ljust(32, b'\x00'))
-        f.write(struct.pack('<I', level.time_limit))
-        f.write(struct.pack('<I', level.stars))
-        flags = (1 if level.no_background else 0)
-        f.write(struct.pack('<I', flags))
-        f.write(b'\x00' * (128 - f.tell()))
-
-        f.write(struct.pack('<I', len(level.sections)))
-        for section in level.sections:
-            f.write(struct.pack('<I', section.width))
-            f.write(struct.pack('<I', section.height))
-            f.write(struct.pack('<BBB', *section.bg_color[:3]))
-            f.write(b'\x00')
-            f.write(struct.pack('<I', section.music))
-
-            blocks = []
-            for li, layer in enumerate(section.layers):
-                for t in layer.tiles:
-                    type_id = TILE_SMBX_IDS.get(t.tile_type, 1)
-                    event_id = t.event_id if hasattr(t, 'event_id') else -1
-                    flags = t.flags if hasattr(t, 'flags') else 0
-                    blocks.append((t.rect.x, t.rect.y, type_id, li, event_id, flags))
-            f.write(struct.pack('<I', len(blocks)))
-            for b in blocks:
-                f.write(struct.pack('<IIIIII', *b))
-
-            bgos = []
-            for li, layer in enumerate(section.layers):
-                for b in layer.bgos:
-                    type_id = BGO_SMBX_IDS.get(b.bgo_type, 5)
-                    flags = b.flags if hasattr(b, 'flags') else 0
-                    bgos.append((b.rect.x, b.rect.y, type_id, li, flags))
-            f.write(struct.pack('<I', len(bgos)))
-            for bg in bgos:
-                f.write(struct.pack('<IIIII', *bg))
-
-            npcs = []
-            for li, layer in enumerate(section.layers):
-                for n in layer.npcs:
-                    type_id = NPC_SMBX_IDS.get(n.npc_type, 1)
-                    event_id = n.event_id if hasattr(n, 'event_id') else -1
-                    flags = n.flags if hasattr(n, 'flags') else 0
-                    direction = 1 if n.direction > 0 else 0
-                    special = n.special_data if hasattr(n, 'special_data') else 0
-                    npcs.append((n.rect.x, n.rect.y, type_id, li, event_id, flags, direction, special))
-            f.write(struct.pack('<I', len(npcs)))
-            for n in npcs:
-                f.write(struct.pack('<IIIIIIII', *n))
-
-            f.write(struct.pack('<I', len(section.warps)))
-            for warp in section.warps:
-                f.write(b'\x00' * 64)
-
-            f.write(struct.pack('<I', len(section.events)))
-            for event in section.events:
-                name_bytes = event.name.encode('utf-8')
-                f.write(struct.pack('<B', len(name_bytes)))
-                f.write(name_bytes)
-                f.write(struct.pack('<I', 0))
-                f.write(struct.pack('<I', 0))
+    write_file_durable(filename, encode_lvl(snapshot_level(level)))
+
+def save_snapshot(filename, snapshot):
+    return write_file_durable(filename, encode_lvl(snapshot))
+
+# -------------------------
+# EDIT JOURNAL (append-only, next to the .lvl)
+# -------------------------
+# Header: magic, version, size and crc32 of the base .lvl it applies to.
+# Records: op, kind, section, layer, x, y, type_id, event_id, flags,
+# direction, special. OP_COMMIT marks the end of a save; anything after the
+# last commit is an unsaved edit that survived a crash.
+JOURNAL_MAGIC  = b'MFBJ'
+JOURNAL_HEADER = struct.Struct('<4sIII')
+JOURNAL_REC    = struct.Struct('<BBHHiiiiiii')
+OP_ADD, OP_REMOVE, OP_COMMIT = 1, 2, 3
+KIND_TILE, KIND_BGO, KIND_NPC = 0, 1, 2
+
+def journal_path(level_file):
+    return level_file + ".jnl"
+
+def journal_header(base_bytes):
+    return JOURNAL_HEADER.pack(JOURNAL_MAGIC, 1, len(base_bytes), zlib.crc32(base_bytes))
+
+def pack_journal_record(op, si, li, obj):
+    if isinstance(obj, Tile):
+        return JOURNAL_REC.pack(op, KIND_TILE, si, li, obj.rect.x, obj.rect.y,
+                                TILE_SMBX_IDS.get(obj.tile_type, 1), obj.event_id, obj.flags, 0, 0)
+    if isinstance(obj, BGO):
+        return JOURNAL_REC.pack(op, KIND_BGO, si, li, obj.rect.x, obj.rect.y,
+                                BGO_SMBX_IDS.get(obj.bgo_type, 5), obj.event_id, obj.flags, 0, 0)
+    return JOURNAL_REC.pack(op, KIND_NPC, si, li, obj.rect.x, obj.rect.y,
+                            NPC_SMBX_IDS.get(obj.npc_type, 1), obj.event_id, obj.flags,
+                            obj.direction, obj.special_data)
+
+def pack_tile_records(op, si, li, store, slots):
+    # Straight from the store columns; no tile views are built.
+    xs, ys, tids, evs, fls = store.xs, store.ys, store.type_id, store.event_id, store.flags
+    return b''.join(JOURNAL_REC.pack(op, KIND_TILE, si, li, xs[s], ys[s], tids[s], evs[s], fls[s], 0, 0)
+                    for s in slots)
+
+class EditJournal:
+    """Buffers packed edit records on the UI thread until the writer flushes them."""
+    def __init__(self, level_file, fresh=False):
+        self.path = journal_path(level_file)
+        self.pending = bytearray()
+        # Record bytes appended since the last compaction, earlier sessions
+        # included; fresh is for a journal that a compaction is about to reset.
+        self.on_disk = 0
+        if not fresh:
+            try:
+                self.on_disk = max(0, os.path.getsize(self.path) - JOURNAL_HEADER.size)
+            except OSError:
+                pass
+        self.stale = False    # set by edits the journal cannot express
+
+    def record(self, op, si, li, obj):
+        if not self.stale:
+            self.pending += pack_journal_record(op, si, li, obj)
+
+    def record_tiles(self, op, si, li, store, slots):
+        if self.stale:
+            return
+        if self.on_disk + len(self.pending) + len(slots) * JOURNAL_REC.size > JOURNAL_COMPACT_BYTES:
+            # The next save would compact anyway; don't buffer megabytes first.
+            self.stale = True
+            return
+        self.pending += pack_tile_records(op, si, li, store, slots)
+
+    def take(self, commit=False):
+        if commit:
+            self.pending += JOURNAL_REC.pack(OP_COMMIT, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0)
+        data = bytes(self.pending)
+        self.pending.clear()
+        self.on_disk += len(data)
+        return data
+
+def append_journal(path, data):
+    with open(path, 'ab') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    return len(data)
+
+def compact_level(filename, snapshot):
+    # Base first, journal second: a crash in between leaves a journal whose
+    # header no longer matches the base, which read_journal ignores.
+    data = encode_lvl(snapshot)
+    write_file_durable(filename, data)
+    write_file_durable(journal_path(filename), journal_header(data))
+    return len(data)
+
+def read_journal(level_file):
+    """Return (committed, uncommitted) record lists, or None if there is no usable journal."""
+    try:
+        with open(level_file, 'rb') as f:
+            base = f.read()
+        with open(journal_path(level_file), 'rb') as f:
+            data = f.read()
+    except OSError:
+        return None
+    if len(data) < JOURNAL_HEADER.size:
+        return None
+    magic, version, size, crc = JOURNAL_HEADER.unpack_from(data)
+    if magic != JOURNAL_MAGIC or size != len(base) or crc != zlib.crc32(base):
+        return None
+    committed, tail = [], []
+    end = len(data) - (len(data) - JOURNAL_HEADER.size) % JOURNAL_REC.size
+    for rec in JOURNAL_REC.iter_unpack(data[JOURNAL_HEADER.size:end]):
+        if rec[0] == OP_COMMIT:
+            committed.extend(tail)
+            tail = []
+        else:
+            tail.append(rec)
+    return committed, tail
+
+def replay_journal(level, records):
+    # Records carry no checksum, so anything a corrupt one could trip over
+    # (unknown op or kind, a layer past MAX_LAYERS) is skipped.
+    names = {KIND_TILE: TILE_ID_TO_NAME, KIND_BGO: BGO_ID_TO_NAME, KIND_NPC: NPC_ID_TO_NAME}
+    for op, kind, si, li, x, y, type_id, event_id, flags, direction, special in records:
+        if (op not in (OP_ADD, OP_REMOVE) or kind not in names or si >= len(level.sections)
+                or li >= MAX_LAYERS or type_id not in names[kind]):
+            continue
+        section = level.sections[si]
+        if len(section.layers) <= li:
+            while len(section.layers) <= li:
+                section.layers.append(Layer(f"Layer {len(section.layers)+1}"))
+            section.renumber_layers()
+        layer = section.layers[li]
+        name = names[kind][type_id]
+        if op == OP_ADD:
+            if kind == KIND_TILE:
+                layer.tiles.add_record(x, y, type_id, event_id, flags)
+            elif kind == KIND_BGO:
+                layer.bgos.add(BGO(x, y, name, li, event_id, flags))
+            else:
+                layer.npcs.add(NPC(x, y, name, li, event_id, flags, direction, special))
+        elif kind == KIND_TILE:
+            slot = layer.tiles.slot_exact(x, y)
+            if slot >= 0:
+                layer.tiles.remove_slot(slot)
+        else:
+            group = layer.bgos if kind == KIND_BGO else layer.npcs
+            obj = group.find(x, y, name)
+            if obj is not None:
+                group.remove(obj)
+    return level
+
+# -------------------------
+# BACKGROUND FILE WRITER / AUTOSAVE
+# -------------------------
+class BackgroundWriter:
+    """Runs file jobs one at a time on a daemon thread, in submission order."""
+    def __init__(self):
+        self.jobs = queue.Queue()
+        self.results = queue.Queue()
+        self.thread = threading.Thread(target=self._run, name="mfb-writer", daemon=True)
+        self.thread.start()
+
+    def submit(self, tag, fn, *args):
+        self.jobs.put((tag, fn, args))
+
+    def _run(self):
+        while True:
+            tag, fn, args = self.jobs.get()
+            try:
+                self.results.put((tag, fn(*args), None))
+            except Exception as e:
+                self.results.put((tag, None, e))
+            finally:
+                self.jobs.task_done()
+
+    def poll(self):
+        done = []
+        while True:
+            try:
+                done.append(self.results.get_nowait())
+            except queue.Empty:
+                return done
+
+    def wait(self):
+        self.jobs.join()
+
+def recovery_path(level_file, slot):
+    # Slots live in an autosave folder beside the level, so two levels that
+    # share a basename (or a change of cwd) never overwrite each other's
+    # recovery files. Untitled levels fall back to AUTOSAVE_DIR under the cwd.
+    if not level_file:
+        return os.path.join(AUTOSAVE_DIR, f"untitled.autosave{slot}.lvl")
+    folder, name = os.path.split(os.path.abspath(level_file))
+    base = os.path.splitext(name)[0]
+    return os.path.join(folder, AUTOSAVE_DIR, f"{base}.autosave{slot}.lvl")
 
 # -------------------------
 # MENU SYSTEM
@@ -1410,6 +2953,826 @@ class Sidebar:
                     return True
         return False
 
+# -------------------------
+# UNDO HISTORY
+# -------------------------
+# Commands hold ids and column-packed records, never objects, so an undo
+# entry neither keeps sprites alive nor goes stale when objects are re-added.
+# A mouse-down..mouse-up stroke is one open command that placements append
+# to. The history evicts its oldest entries past UNDO_BUDGET bytes.
+class ObjectBatch:
+    """(id, object_record) pairs packed into columns."""
+    __slots__ = ('ids', 'xs', 'ys', 'events', 'flags', 'types', 'classes', 'extra')
+
+    def __init__(self):
+        self.ids = array('i')
+        self.xs = array('i')
+        self.ys = array('i')
+        self.events = array('i')
+        self.flags = array('i')
+        self.types = []
+        self.classes = []
+        self.extra = {}         # row -> NPC (direction, special_data)
+
+    def append(self, oid, record):
+        cls, x, y, otype, event_id, flags, *extra = record
+        if extra:
+            self.extra[len(self.ids)] = tuple(extra)
+        self.ids.append(oid); self.xs.append(x); self.ys.append(y)
+        self.events.append(event_id); self.flags.append(flags)
+        self.types.append(otype); self.classes.append(cls)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        for i, oid in enumerate(self.ids):
+            yield oid, (self.classes[i], self.xs[i], self.ys[i], self.types[i],
+                        self.events[i], self.flags[i]) + self.extra.get(i, ())
+
+    def nbytes(self):
+        # Arrays plus one pointer per row for types/classes; names are interned.
+        return 20 * len(self.ids) + 16 * len(self.types) + 64 * len(self.extra)
+
+class Command:
+    label = "Edit"
+
+    def undo(self, editor): pass
+    def redo(self, editor): pass
+    def nbytes(self): return 64
+    def __len__(self): return 1
+
+class CompositeCommand(Command):
+    def __init__(self, commands, label="Edit"):
+        self.commands = commands
+        self.label = label
+
+    def __len__(self):
+        return sum(len(c) for c in self.commands)
+
+    def nbytes(self):
+        return 64 + sum(c.nbytes() for c in self.commands)
+
+    def undo(self, editor):
+        for cmd in reversed(self.commands):
+            cmd.undo(editor)
+
+    def redo(self, editor):
+        for cmd in self.commands:
+            cmd.redo(editor)
+
+class PlaceCommand(Command):
+    label = "Place"
+
+    def __init__(self, section, layer):
+        self.section = section
+        self.layer = layer
+        self.items = ObjectBatch()
+
+    def __len__(self):
+        return len(self.items)
+
+    def nbytes(self):
+        return 64 + self.items.nbytes()
+
+    def _add(self, editor):
+        for oid, record in self.items:
+            editor._restore_id(oid, self.section, self.layer, record)
+
+    def _remove(self, editor):
+        for oid in reversed(self.items.ids):
+            editor._delete_id(oid)
+
+    undo, redo = _remove, _add
+
+class EraseCommand(PlaceCommand):
+    label = "Erase"
+    undo, redo = PlaceCommand._add, PlaceCommand._remove
+
+class TileSpanCommand(Command):
+    """Tile cells rewritten span-wise. spans covers every touched cell,
+    before/after map tile type -> the spans holding it, and extras keep only
+    the tiles whose event/flags/id weren't defaults."""
+    label = "Edit"
+
+    def __init__(self, section, layer, spans, before, after, old_extras, label=None):
+        self.section, self.layer = section, layer
+        self.spans = spans
+        self.before, self.after = before, after
+        self.old_extras = old_extras
+        self.new_extras = []
+        self.cells = sum(spans[i+2] - spans[i+1] for i in range(0, len(spans), 3))
+        if label:
+            self.label = label
+
+    def __len__(self):
+        return self.cells
+
+    def nbytes(self):
+        spans = len(self.spans) + sum(map(len, self.before.values())) + sum(map(len, self.after.values()))
+        return 64 + 4 * spans + 72 * (len(self.old_extras) + len(self.new_extras))
+
+    def undo(self, editor):
+        self.new_extras = editor.write_spans(self.section, self.layer, self.spans, self.before, self.old_extras)
+
+    def redo(self, editor):
+        editor.write_spans(self.section, self.layer, self.spans, self.after, self.new_extras)
+
+class FillCommand(TileSpanCommand):
+    label = "Fill"
+
+    def __init__(self, section, layer, spans, tid, old_tid, old_extras):
+        super().__init__(section, layer, spans, {old_tid: spans} if old_tid else {},
+                         {tid: spans}, old_extras)
+
+class MoveCommand(Command):
+    label = "Move"
+
+    def __init__(self, ids, dx, dy):
+        self.ids = array('i', ids)
+        self.dx, self.dy = dx, dy
+
+    def __len__(self):
+        return len(self.ids)
+
+    def nbytes(self):
+        return 64 + 4 * len(self.ids)
+
+    def _shift(self, editor, dx, dy):
+        reg = editor.level.objects
+        for oid in self.ids:
+            loc = reg.locate(oid)
+            if loc is not None:
+                section, layer, obj = loc
+                editor._journal(OP_REMOVE, section, layer, obj)
+                reg.move(oid, obj.rect.x + dx, obj.rect.y + dy)
+                editor._journal(OP_ADD, section, layer, obj)
+
+    def undo(self, editor): self._shift(editor, -self.dx, -self.dy)
+    def redo(self, editor): self._shift(editor, self.dx, self.dy)
+
+class PropertyCommand(Command):
+    label = "Change"
+
+    def __init__(self, oid, attr, old, new):
+        self.oid, self.attr, self.old, self.new = oid, attr, old, new
+
+    def _set(self, editor, value):
+        loc = editor.level.objects.locate(self.oid)
+        if loc is None:
+            return
+        _, layer, obj = loc
+        if self.attr == 'event_id':
+            layer.set_event(obj, value)
+        else:
+            setattr(obj, self.attr, value)
+
+    def undo(self, editor): self._set(editor, self.old)
+    def redo(self, editor): self._set(editor, self.new)
+
+UNDO_BUDGET = 16 * 1024 * 1024  # bytes of undo payload kept
+FILL_MAX_CELLS = 200000         # flood fills larger than this are refused
+
+class UndoHistory:
+    def __init__(self, budget=UNDO_BUDGET):
+        self.budget = budget
+        self.undo_stack = deque()
+        self.redo_stack = []
+        self.used = 0
+        self.open = None        # stroke in progress
+
+    def __bool__(self):
+        return bool(self.undo_stack or self.open)
+
+    def push(self, cmd):
+        for old in self.redo_stack:
+            self.used -= old.nbytes()
+        self.redo_stack.clear()
+        self.undo_stack.append(cmd)
+        self.used += cmd.nbytes()
+        # Oldest first, but never the entry just pushed.
+        while self.used > self.budget and len(self.undo_stack) > 1:
+            self.used -= self.undo_stack.popleft().nbytes()
+
+    def begin(self, cmd):
+        self.end()
+        self.open = cmd
+
+    def end(self):
+        cmd, self.open = self.open, None
+        if cmd is not None and len(cmd):
+            self.push(cmd)
+            return True
+        return False
+
+    def undo(self, editor):
+        self.end()
+        if not self.undo_stack:
+            return None
+        cmd = self.undo_stack.pop()
+        cmd.undo(editor)
+        self.redo_stack.append(cmd)
+        return cmd
+
+    def redo(self, editor):
+        self.end()
+        if not self.redo_stack:
+            return None
+        cmd = self.redo_stack.pop()
+        cmd.redo(editor)
+        self.undo_stack.append(cmd)
+        return cmd
+
+    def clear(self):
+        self.undo_stack.clear()
+        self.redo_stack.clear()
+        self.used = 0
+        self.open = None
+
+# -------------------------
+# BULK UNDO (chunk diffs)
+# -------------------------
+# Clear-all and resize crops are undone from snapshots
+# of only the DIFF_CHUNK x DIFF_CHUNK cell chunks that changed, zlib-packed,
+# instead of one record per object. Rows keep registry ids, so objects come
+# back under the ids other undo entries and the selection refer to.
+DIFF_CHUNK = 16
+DIFF_ROW = 9                # kind, x, y, type_id, event_id, flags, direction, special, id
+CELL_RECT_ALL = (-2**31, -2**31, 2**31, 2**31)
+
+def capture_chunks(section, rects=None):
+    """(layer index, chx, chy) -> packed rows for objects in cell rects
+    (x0, y0, x1, y1) that share no chunk, or in the whole section."""
+    span = GRID_SIZE * DIFF_CHUNK
+    rows = {}
+
+    def put(li, row):
+        key = (li, row[1] // span, row[2] // span)
+        buf = rows.get(key)
+        if buf is None:
+            buf = rows[key] = array('i')
+        buf.extend(row)
+
+    for li, layer in enumerate(section.layers):
+        store = layer.tiles
+        for rect in rects or [CELL_RECT_ALL]:
+            for s in store.slots_in(*rect):
+                put(li, (KIND_TILE, store.xs[s], store.ys[s], store.type_id[s],
+                         store.event_id[s], store.flags[s], 0, 0, store.ids[s]))
+        for kind, group, ids in ((KIND_BGO, layer.bgos, BGO_SMBX_IDS), (KIND_NPC, layer.npcs, NPC_SMBX_IDS)):
+            cells = sorted(group.cells) if rects is None else sorted(c for r in rects for c in group.cells_in(*r))
+            for cell in cells:
+                for o in group.cells[cell]:
+                    npc = kind == KIND_NPC
+                    put(li, (kind, o.rect.x, o.rect.y, ids.get(o.obj_type, 1), o.event_id, o.flags,
+                             o.direction if npc else 0, o.special_data if npc else 0, o.oid))
+    return {key: buf.tobytes() for key, buf in rows.items()}
+
+def apply_chunks(section, registry, chunks):
+    # Replaces the contents of each chunk with its packed rows.
+    names = {KIND_TILE: TILE_ID_TO_NAME, KIND_BGO: BGO_ID_TO_NAME, KIND_NPC: NPC_ID_TO_NAME}
+    for (li, chx, chy), blob in chunks:
+        if li >= len(section.layers):
+            continue
+        layer = section.layers[li]
+        c0, r0 = chx * DIFF_CHUNK, chy * DIFF_CHUNK
+        c1, r1 = c0 + DIFF_CHUNK, r0 + DIFF_CHUNK
+        for slot in layer.tiles.slots_in(c0, r0, c1, r1):
+            layer.tiles.remove_slot(slot)
+        for group in (layer.bgos, layer.npcs):
+            for cell in [c for c in group.cells if c0 <= c[0] < c1 and r0 <= c[1] < r1]:
+                for obj in list(group.cells[cell]):
+                    group.remove(obj)
+        rows = array('i')
+        rows.frombytes(zlib.decompress(blob))
+        for i in range(0, len(rows), DIFF_ROW):
+            kind, x, y, tid, event_id, flags, direction, special, oid = rows[i:i+DIFF_ROW]
+            if kind == KIND_TILE:
+                slot = layer.tiles.add_record(x, y, tid, event_id, flags)
+                if oid:
+                    registry.bind_slot(oid, section, layer, slot)
+                continue
+            name = names[kind].get(tid)
+            if name is None:
+                continue
+            if kind == KIND_BGO:
+                obj = BGO(x, y, name, li, event_id, flags)
+                layer.bgos.add(obj)
+            else:
+                obj = NPC(x, y, name, li, event_id, flags, direction, special)
+                layer.npcs.add(obj)
+            if oid:
+                registry.bind(oid, section, layer, obj)
+
+class ChunkDiffCommand(Command):
+    def __init__(self, section, keys, before, after, label="Edit"):
+        self.section = section
+        self.keys = keys
+        self.before = before
+        self.after = after
+        self.label = label
+
+    def __len__(self):
+        return len(self.keys)
+
+    def nbytes(self):
+        return 64 + 24 * len(self.keys) + sum(map(len, self.before)) + sum(map(len, self.after))
+
+    def undo(self, editor):
+        apply_chunks(self.section, editor.level.objects, zip(self.keys, self.before))
+        editor.mark_dirty(structural=True)
+
+    def redo(self, editor):
+        apply_chunks(self.section, editor.level.objects, zip(self.keys, self.after))
+        editor.mark_dirty(structural=True)
+
+class BulkEdit:
+    """Snapshot a section (or cell rects of it) now, diff it in finish().
+
+    Rects are widened to whole chunks, since restoring a chunk replaces all
+    of it; they must not share a chunk once widened.
+    """
+    def __init__(self, section, rects=None):
+        if rects is not None:
+            rects = [(x0 // DIFF_CHUNK * DIFF_CHUNK, y0 // DIFF_CHUNK * DIFF_CHUNK,
+                      -(-x1 // DIFF_CHUNK) * DIFF_CHUNK, -(-y1 // DIFF_CHUNK) * DIFF_CHUNK)
+                     for x0, y0, x1, y1 in rects]
+        self.section = section
+        self.rects = rects
+        self.before = capture_chunks(section, rects)
+
+    def finish(self, label):
+        after = capture_chunks(self.section, self.rects)
+        keys = [k for k in sorted(self.before.keys() | after.keys())
+                if self.before.get(k) != after.get(k)]
+        if not keys:
+            return None
+        return ChunkDiffCommand(self.section, keys,
+                                [zlib.compress(self.before.get(k, b'')) for k in keys],
+                                [zlib.compress(after.get(k, b'')) for k in keys], label)
+
+class SectionCommand(Command):
+    label = "Properties"
+
+    def __init__(self, section, old, new):
+        self.section, self.old, self.new = section, old, new
+
+    def _set(self, editor, values):
+        for attr, value in values.items():
+            setattr(self.section, attr, value)
+        editor.camera.width, editor.camera.height = self.section.width, self.section.height
+        editor.mark_dirty(structural=True)
+
+    def undo(self, editor): self._set(editor, self.old)
+    def redo(self, editor): self._set(editor, self.new)
+
+# -------------------------
+# TRANSACTIONS
+# -------------------------
+def cell_spans(cells):
+    """(row, c0, c1) spans covering a collection of (cx, cy) cells."""
+    spans = array('i')
+    run = None
+    for cx, cy in sorted(cells, key=lambda c: (c[1], c[0])):
+        if run and run[0] == cy and run[2] == cx:
+            run[2] += 1
+            continue
+        if run:
+            spans.extend(run)
+        run = [cy, cx, cx + 1]
+    if run:
+        spans.extend(run)
+    return spans
+
+def rect_cells(a, b):
+    x0, x1 = sorted((a[0], b[0]))
+    y0, y1 = sorted((a[1], b[1]))
+    return [(x, y) for y in range(y0, y1 + 1) for x in range(x0, x1 + 1)]
+
+def line_cells(x0, y0, x1, y1):
+    # Bresenham, both ends included.
+    cells = []
+    dx, dy = abs(x1 - x0), -abs(y1 - y0)
+    sx, sy = (1 if x1 >= x0 else -1), (1 if y1 >= y0 else -1)
+    err = dx + dy
+    while True:
+        cells.append((x0, y0))
+        if x0 == x1 and y0 == y1:
+            return cells
+        e2 = 2 * err
+        if e2 >= dy:
+            err += dy
+            x0 += sx
+        if e2 <= dx:
+            err += dx
+            y0 += sy
+
+class Transaction:
+    """Edits gathered between Editor.begin() and Editor.commit().
+
+    Tile writes are last-one-wins per cell (tid 0 erases) and land through
+    Editor.write_spans, so the grid, chunk cache and undo are touched once
+    per layer and every tile going or coming is journaled. BGOs and NPCs are
+    added/removed one by one. commit() turns the lot into a single undo
+    entry without staling the journal.
+    """
+    def __init__(self, section, label="Edit"):
+        self.section = section
+        self.label = label
+        self.tiles = {}     # layer -> {(cx, cy): tid}
+        self.extras = {}    # layer -> {(cx, cy): (event_id, flags, id)} for non-default tiles
+        self.adds = []      # (layer, obj)
+        self.removes = []   # object ids
+        self.moves = []     # MoveCommands for BGOs/NPCs
+
+    def __len__(self):
+        return (sum(map(len, self.tiles.values())) + len(self.adds) + len(self.removes)
+                + sum(map(len, self.moves)))
+
+    def set_tile(self, layer, cx, cy, tid, event_id=-1, flags=0, oid=0):
+        self.tiles.setdefault(layer, {})[(cx, cy)] = tid
+        if event_id != -1 or flags or oid:
+            self.extras.setdefault(layer, {})[(cx, cy)] = (event_id, flags, oid)
+        elif layer in self.extras:
+            self.extras[layer].pop((cx, cy), None)
+
+    def set_tiles(self, layer, cells, tid):
+        cells = list(cells)
+        self.tiles.setdefault(layer, {}).update(dict.fromkeys(cells, tid))
+        extras = self.extras.get(layer)
+        if extras:
+            for cell in cells:
+                extras.pop(cell, None)
+
+    def add(self, layer, obj):
+        self.adds.append((layer, obj))
+
+    def remove(self, oid):
+        self.removes.append(oid)
+
+    def move(self, oids, dx, dy):
+        # BGOs/NPCs and off-grid tiles; grid tiles move as a clear plus a
+        # set_tile carrying their id.
+        self.moves.append(MoveCommand(oids, dx, dy))
+
+    def _apply_tiles(self, editor, layer, cells):
+        store = layer.tiles
+        extras = self.extras.get(layer, {})
+        before, after = {}, {}
+        for cell, tid in cells.items():
+            slot = store._get_cell(*cell)
+            old = store.type_id[slot] if slot >= 0 else 0
+            event_id, flags, oid = extras.get(cell, (-1, 0, 0))
+            if (old != tid or tid and (store.event_id[slot] != event_id or store.flags[slot] != flags
+                                       or oid and store.ids[slot] != oid)):
+                if old:
+                    before.setdefault(old, []).append(cell)
+                after.setdefault(tid, []).append(cell)
+        if not after:
+            return None
+        spans = cell_spans(c for group in after.values() for c in group)
+        before = {tid: cell_spans(group) for tid, group in before.items()}
+        after = {tid: cell_spans(group) for tid, group in after.items() if tid}
+        old_extras = editor.write_spans(self.section, layer, spans, after,
+                                        [cell + extra for cell, extra in extras.items()])
+        return TileSpanCommand(self.section, layer, spans, before, after, old_extras)
+
+    def apply(self, editor):
+        cmds = []
+        erase = {}
+        for oid in self.removes:
+            loc = editor.level.objects.locate(oid)
+            if loc is None:
+                continue
+            section, layer, _ = loc
+            cmd = erase.get(layer)
+            if cmd is None:
+                cmd = erase[layer] = EraseCommand(section, layer)
+            cmd.items.append(oid, editor._delete_id(oid))
+        cmds.extend(erase.values())
+        for layer, cells in self.tiles.items():
+            cmd = self._apply_tiles(editor, layer, cells)
+            if cmd:
+                cmds.append(cmd)
+        for cmd in self.moves:
+            cmd.redo(editor)
+            cmds.append(cmd)
+        place = {}
+        for layer, obj in self.adds:
+            if layer.has_duplicate(obj):
+                continue
+            editor._add_object(layer, obj, self.section)
+            cmd = place.get(layer)
+            if cmd is None:
+                cmd = place[layer] = PlaceCommand(self.section, layer)
+            cmd.items.append(editor.level.objects.id_of(self.section, layer, obj), object_record(obj))
+        cmds.extend(place.values())
+        if not cmds:
+            return None
+        return CompositeCommand(cmds, self.label)
+
+# -------------------------
+# AUTO-TILING
+# -------------------------
+# Opt-in (Tools > Auto-Tile). Each family lists the variants the rule may
+# pick and members that only count as neighbours; the rule maps the N/E/S/W
+# same-family bitmask to a variant.
+AUTOTILE_N, AUTOTILE_E, AUTOTILE_S, AUTOTILE_W = 1, 2, 4, 8
+AUTOTILE_BULK = 1024    # edits this large are resolved over their bounding box in one pass
+
+AUTOTILE_FAMILIES = {
+    'pipe': (('pipe_vertical', 'pipe_horizontal'), (),
+             lambda m: 'pipe_horizontal' if m & (AUTOTILE_E | AUTOTILE_W) and not m & (AUTOTILE_N | AUTOTILE_S)
+                       else 'pipe_vertical'),
+    'terrain': (('ground', 'grass'), ('slope_left', 'slope_right'),
+                lambda m: 'ground' if m & AUTOTILE_N else 'grass'),
+}
+
+class AutoTiler:
+    def __init__(self, families=AUTOTILE_FAMILIES):
+        self.family = {}        # tid -> family index, for every member
+        self.variants = set()   # tids the rules may rewrite
+        self.tables = []        # family index -> 16 tids, indexed by mask
+        for i, (variants, fixed, rule) in enumerate(families.values()):
+            for name in variants + fixed:
+                self.family[TILE_SMBX_IDS[name]] = i
+            self.variants.update(TILE_SMBX_IDS[name] for name in variants)
+            self.tables.append(tuple(TILE_SMBX_IDS[rule(m)] for m in range(16)))
+        # Lookup tables for _resolve_rect, indexed by tid; the last entry
+        # stands in for any tid past the largest member.
+        size = max(self.family) + 2
+        self.family_lut = np.full(size, -1, dtype=np.int32)
+        self.family_lut[list(self.family)] = list(self.family.values())
+        self.variant_lut = np.zeros(size, dtype=bool)
+        self.variant_lut[list(self.variants)] = True
+        self.table_lut = np.array(self.tables, dtype=np.int32)
+
+    def pick(self, tid, n, e, s, w):
+        f = self.family[tid]
+        fam = self.family
+        m = ((fam.get(n) == f) * AUTOTILE_N | (fam.get(e) == f) * AUTOTILE_E
+             | (fam.get(s) == f) * AUTOTILE_S | (fam.get(w) == f) * AUTOTILE_W)
+        return self.tables[f][m]
+
+    def resolve(self, store, pending):
+        """{cell: tid} variant changes implied by pending {cell: tid} writes.
+
+        Small edits recompute the 3x3 neighbourhood of each written cell;
+        bulk ones read their bounding box once and resolve it as one array.
+        """
+        if not pending:
+            return {}
+        if len(pending) >= AUTOTILE_BULK:
+            xs = [c[0] for c in pending]
+            ys = [c[1] for c in pending]
+            x0, y0, x1, y1 = min(xs) - 1, min(ys) - 1, max(xs) + 2, max(ys) + 2
+            if (x1 - x0) * (y1 - y0) <= 4 * len(pending):
+                return self._resolve_rect(store, pending, x0, y0, x1, y1)
+        get = pending.get
+
+        def tid_at(cx, cy):
+            tid = get((cx, cy))
+            if tid is None:
+                slot = store._get_cell(cx, cy)
+                tid = store.type_id[slot] if slot >= 0 else 0
+            return tid
+
+        cells = {(cx + dx, cy + dy) for cx, cy in pending for dx in (-1, 0, 1) for dy in (-1, 0, 1)}
+        out = {}
+        for cx, cy in cells:
+            tid = tid_at(cx, cy)
+            if tid in self.variants:
+                want = self.pick(tid, tid_at(cx, cy - 1), tid_at(cx + 1, cy), tid_at(cx, cy + 1), tid_at(cx - 1, cy))
+                if want != tid:
+                    out[(cx, cy)] = want
+        return out
+
+    def _resolve_rect(self, store, pending, x0, y0, x1, y1):
+        # Same rule as pick(), over the whole rect at once. The grid carries a
+        # one-cell border so the rect's edge cells see outside.
+        grid = np.array([store.type_row(cy, x0 - 1, x1 + 1) for cy in range(y0 - 1, y1 + 1)],
+                        dtype=np.int64)
+        for (cx, cy), tid in pending.items():
+            grid[cy - y0 + 1, cx - x0 + 1] = tid
+        idx = np.clip(grid, 0, len(self.family_lut) - 1)
+        fam = self.family_lut[idx]
+        f = fam[1:-1, 1:-1]
+        mask = ((fam[:-2, 1:-1] == f) * AUTOTILE_N | (fam[1:-1, 2:] == f) * AUTOTILE_E
+                | (fam[2:, 1:-1] == f) * AUTOTILE_S | (fam[1:-1, :-2] == f) * AUTOTILE_W)
+        want = self.table_lut[np.maximum(f, 0), mask]
+        changed = self.variant_lut[idx[1:-1, 1:-1]] & (want != grid[1:-1, 1:-1])
+        rs, cs = np.nonzero(changed)
+        return dict(zip(zip((cs + x0).tolist(), (rs + y0).tolist()), want[changed].tolist()))
+
+# -------------------------
+# CLIPBOARD
+# -------------------------
+CLIPBOARD_FILE = "clipboard.mfk"
+CLIP_MAGIC = b'MFBK'
+CLIP_VERSION = 2            # 2 adds KIND_TILE object rows; 1 is still read
+CLIP_HEAD = '<4sHIIIII'     # magic, version, w, h, tile layers, object rows, extra rows; zlib body follows
+CLIP_OBJ_ROW = 9            # layer, kind, dx, dy, type_id, event_id, flags, direction, special
+CLIP_EXTRA_ROW = 5          # layer, cx, cy, event_id, flags
+CLIP_MAX_CELLS = 1 << 22    # bounding box limit for the tile grids
+
+class ClipboardBlock:
+    """Copied objects relative to the block's top-left cell.
+
+    Grid tiles are a w*h type-id grid per layer index (0 = empty) plus sparse
+    rows for tiles with an event or flags; off-grid tiles, BGOs and NPCs are
+    rows with pixel offsets, so they keep their exact position. Type ids are the SMBX ones, which
+    makes the serialized form portable between editors.
+    """
+    def __init__(self, w=0, h=0):
+        self.w, self.h = w, h
+        self.tiles = {}
+        self.extras = array('i')
+        self.objects = array('i')
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    @classmethod
+    def from_objects(cls, items):
+        """Block for (layer index, object) pairs, or None if its bounding box is too big."""
+        if not items:
+            return None
+        x0 = min(o.rect.x for _, o in items) // GRID_SIZE
+        y0 = min(o.rect.y for _, o in items) // GRID_SIZE
+        w = max(o.rect.x for _, o in items) // GRID_SIZE - x0 + 1
+        h = max(o.rect.y for _, o in items) // GRID_SIZE - y0 + 1
+        if w * h > CLIP_MAX_CELLS:
+            return None
+        block = cls(w, h)
+        px, py = x0 * GRID_SIZE, y0 * GRID_SIZE
+        for li, o in items:
+            if isinstance(o, Tile) and (o.rect.x % GRID_SIZE or o.rect.y % GRID_SIZE):
+                block.objects.extend((li, KIND_TILE, o.rect.x - px, o.rect.y - py, TILE_SMBX_IDS.get(o.tile_type, 1),
+                                      o.event_id, o.flags, 0, 0))
+            elif isinstance(o, Tile):
+                grid = block.tiles.get(li)
+                if grid is None:
+                    grid = block.tiles[li] = array('H', [0]) * (w * h)
+                cx, cy = o.rect.x // GRID_SIZE - x0, o.rect.y // GRID_SIZE - y0
+                grid[cy * w + cx] = TILE_SMBX_IDS.get(o.tile_type, 1)
+                if o.event_id != -1 or o.flags:
+                    block.extras.extend((li, cx, cy, o.event_id, o.flags))
+            elif isinstance(o, NPC):
+                block.objects.extend((li, KIND_NPC, o.rect.x - px, o.rect.y - py, NPC_SMBX_IDS.get(o.obj_type, 1),
+                                      o.event_id, o.flags, o.direction, o.special_data))
+            else:
+                block.objects.extend((li, KIND_BGO, o.rect.x - px, o.rect.y - py, BGO_SMBX_IDS.get(o.obj_type, 1),
+                                      o.event_id, o.flags, 0, 0))
+            block.count += 1
+        return block
+
+    def paste(self, tx, registry, cx, cy, mode='overwrite', target=None, clip=None):
+        """Queues the block on tx with its top-left at cell (cx, cy).
+
+        merge leaves occupied cells alone; overwrite replaces tiles and any
+        BGO/NPC of the same kind in the cell. target puts everything on one
+        layer; clip (x1, y1) drops cells past that corner.
+        """
+        merge = mode == 'merge'
+        layers = tx.section.layers
+        x1, y1 = clip or (cx + self.w - 1, cy + self.h - 1)
+        cols, rows = min(self.w, x1 - cx + 1), min(self.h, y1 - cy + 1)
+
+        def layer_of(li):
+            return target or (layers[li] if li < len(layers) else layers[0])
+
+        for li, grid in self.tiles.items():
+            layer = layer_of(li)
+            store = layer.tiles
+            for r in range(rows):
+                base, y = r * self.w, cy + r
+                for c, tid in enumerate(grid[base:base + cols]):
+                    if tid and not (merge and store._get_cell(cx + c, y) >= 0):
+                        tx.set_tile(layer, cx + c, y, tid)
+        for i in range(0, len(self.extras), CLIP_EXTRA_ROW):
+            li, ex, ey, event_id, flags = self.extras[i:i+CLIP_EXTRA_ROW]
+            layer = layer_of(li)
+            tid = tx.tiles.get(layer, {}).get((cx + ex, cy + ey)) if ex < cols and ey < rows else None
+            if tid:
+                tx.set_tile(layer, cx + ex, cy + ey, tid, event_id, flags)
+        names = {KIND_TILE: TILE_ID_TO_NAME, KIND_BGO: BGO_ID_TO_NAME, KIND_NPC: NPC_ID_TO_NAME}
+        for i in range(0, len(self.objects), CLIP_OBJ_ROW):
+            li, kind, dx, dy, tid, event_id, flags, direction, special = self.objects[i:i+CLIP_OBJ_ROW]
+            name = names[kind].get(tid)
+            if name is None or dx // GRID_SIZE >= cols or dy // GRID_SIZE >= rows:
+                continue
+            layer = layer_of(li)
+            x, y = cx * GRID_SIZE + dx, cy * GRID_SIZE + dy
+            if kind == KIND_TILE:
+                slot = layer.tiles.slot_exact(x, y)
+                if slot >= 0:
+                    if merge:
+                        continue
+                    tx.remove(registry.slot_ids(tx.section, layer, [slot])[0])
+                tx.add(layer, Tile(x, y, name, layers.index(layer), event_id, flags))
+                continue
+            group = layer.npcs if kind == KIND_NPC else layer.bgos
+            existing = group.at(x, y)
+            if existing:
+                if merge:
+                    continue
+                for obj in existing:
+                    tx.remove(registry.id_of(tx.section, layer, obj))
+            li = layers.index(layer)
+            if kind == KIND_NPC:
+                tx.add(layer, NPC(x, y, name, li, event_id, flags, direction, special))
+            else:
+                tx.add(layer, BGO(x, y, name, li, event_id, flags))
+
+    def to_bytes(self):
+        body = array('i')
+        for li, grid in sorted(self.tiles.items()):
+            body.append(li)
+            body.frombytes(grid.tobytes() + b'\0\0' * (len(grid) & 1))
+        body.extend(self.objects)
+        body.extend(self.extras)
+        head = struct.pack(CLIP_HEAD, CLIP_MAGIC, CLIP_VERSION, self.w, self.h, len(self.tiles),
+                           len(self.objects) // CLIP_OBJ_ROW, len(self.extras) // CLIP_EXTRA_ROW)
+        return head + zlib.compress(body.tobytes())
+
+    @classmethod
+    def from_bytes(cls, data):
+        size = struct.calcsize(CLIP_HEAD)
+        if len(data) < size:
+            raise LevelFormatError("clipboard file is truncated")
+        magic, version, w, h, nlayers, nobj, nextra = struct.unpack_from(CLIP_HEAD, data)
+        if magic != CLIP_MAGIC or not 1 <= version <= CLIP_VERSION:
+            raise LevelFormatError("not a clipboard file")
+        if w * h > CLIP_MAX_CELLS:
+            raise LevelFormatError("clipboard block is too large")
+        try:
+            body = zlib.decompress(data[size:])
+        except zlib.error as e:
+            raise LevelFormatError(f"clipboard data is corrupt: {e}")
+        words = (w * h + 1) // 2
+        if len(body) != 4 * (nlayers * (1 + words) + nobj * CLIP_OBJ_ROW + nextra * CLIP_EXTRA_ROW):
+            raise LevelFormatError("clipboard data has the wrong length")
+        block = cls(w, h)
+        rows = array('i')
+        rows.frombytes(body)
+        pos = 0
+        for _ in range(nlayers):
+            if not 0 <= rows[pos] < MAX_LAYERS:
+                raise LevelFormatError(f"clipboard layer index {rows[pos]} outside 0..{MAX_LAYERS-1}")
+            grid = array('H')
+            grid.frombytes(rows[pos+1:pos+1+words].tobytes()[:2 * w * h])
+            unknown = set(grid) - TILE_ID_TO_NAME.keys() - {0}
+            if unknown:
+                raise LevelFormatError(f"clipboard has unknown tile type {min(unknown)}")
+            block.tiles[rows[pos]] = grid
+            block.count += w * h - grid.count(0)
+            pos += 1 + words
+        block.objects = rows[pos:pos + nobj * CLIP_OBJ_ROW]
+        block.extras = rows[pos + nobj * CLIP_OBJ_ROW:]
+        # paste() indexes by kind and layer, so bad rows are refused here
+        # rather than crashing the editor on Ctrl+V.
+        names = {KIND_BGO: BGO_ID_TO_NAME, KIND_NPC: NPC_ID_TO_NAME}
+        if version >= 2:
+            names[KIND_TILE] = TILE_ID_TO_NAME
+        for i in range(0, len(block.objects), CLIP_OBJ_ROW):
+            li, kind, dx, dy, tid = block.objects[i:i+5]
+            if kind not in names:
+                raise LevelFormatError(f"clipboard object has unknown kind {kind}")
+            if not 0 <= li < MAX_LAYERS or dx < 0 or dy < 0:
+                raise LevelFormatError("clipboard object is out of range")
+            if tid not in names[kind]:
+                raise LevelFormatError(f"clipboard object has unknown type {tid}")
+        for i in range(0, len(block.extras), CLIP_EXTRA_ROW):
+            li, ex, ey = block.extras[i:i+3]
+            if not (0 <= li < MAX_LAYERS and 0 <= ex < w and 0 <= ey < h):
+                raise LevelFormatError("clipboard tile extra is out of range")
+        block.count += nobj
+        return block
+
+# -------------------------
+# SELECTION
+# -------------------------
+class Selection(dict):
+    """Selected object ids in the order they were picked (values unused)."""
+    __slots__ = ()
+
+    def add(self, oid):
+        self[oid] = None
+
+    def discard(self, oid):
+        self.pop(oid, None)
+
+    def toggle(self, oid):
+        if oid in self:
+            del self[oid]
+        else:
+            self[oid] = None
+
+    def replace(self, oids):
+        self.clear()
+        self.update(dict.fromkeys(oids))
+
 # -------------------------
 # EDITOR
 # -------------------------
@@ -1420,19 +3783,45 @@ class Editor:
         self.camera = Camera(level.current_section().width, level.current_section().height)
         self.playtest_mode = False
         self.player = None
-        self.undo_stack = []
-        self.redo_stack = []
+        self.play_npcs = []
+        self.history = UndoHistory()
+        self.fill_preview = None
+        self.fill_strip = None      # translucent row blitted by draw_fill_preview
+        self.tx = None
+        self.autotile = False
+        self.autotiler = AutoTiler()
+        self.shape_start = None     # cell where a rect/line/stamp drag began
         self.sidebar = Sidebar()
         self.drag_draw = False
         self.drag_erase = False
+        self.drag_cell = self.drag_target = None
         self.current_file = None
-        self.selection = []
-        self.clipboard = []
+        self.selection = Selection()
+        self.marquee_start = None   # world point where a select drag began
+        self.clipboard = None
+        self.find_query = None      # last Find criteria
+        self.find_results = []      # (section, layer, keys) groups from Level.query
+        self.find_count = 0
+        self.find_pos = -1
+        self.find_stamp = None      # (level, edit_rev) the results were taken at
+        self.find_ms = 0.0
         self.tool = 'pencil'
         self.grid_enabled = True
         self.mouse_pos = (0,0)
         self.tooltip_text = ""
         self.status_msg = ""
+        self.writer = BackgroundWriter()
+        self.edit_rev = 0
+        self.saved_rev = 0
+        self.autosave_rev = 0
+        self.autosave_slot = 0
+        self.autosave_inflight = False
+        self.last_autosave = pygame.time.get_ticks()
+        self.journal = None
+        self.last_journal_flush = self.last_autosave
+        self.assets = get_asset_loader()
+        self.watcher = AssetWatcher(self.assets) if USE_GRAPHICS else None
+        self.prioritize_assets()
         self._build_menu()
         self._build_toolbar()
 
@@ -1455,10 +3844,18 @@ class Editor:
             MI("Cut",            self.cut_selection,   "Ctrl+X"),
             MI("Copy",           self.copy_selection,  "Ctrl+C"),
             MI("Paste",          self.paste_clipboard, "Ctrl+V"),
+            MI("Paste (Merge)",  self.paste_merge,     "Ctrl+Shift+V"),
             MI("Delete",         self.delete_selected, "Del"),
             MI("", separator=True),
+            MI("Copy to File...",   self.cmd_export_clipboard, ""),
+            MI("Paste from File...",self.cmd_import_clipboard, ""),
+            MI("", separator=True),
             MI("Select All",     self.select_all,      "Ctrl+A"),
             MI("Deselect All",   self.deselect_all,    "Esc"),
+            MI("", separator=True),
+            MI("Find...",        self.cmd_find,        "Ctrl+F"),
+            MI("Find Next",      self.find_next,       "F3"),
+            MI("Find Previous",  self.find_prev,       "Shift+F3"),
         ]
         view_items = [
             MI("Zoom In",        self.cmd_zoom_in,     "Ctrl+="),
@@ -1489,6 +3886,11 @@ class Editor:
             MI("Pencil",  self.set_tool_pencil, "P"),
             MI("Eraser",  self.set_tool_erase,  "E"),
             MI("Fill",    self.set_tool_fill,   "F"),
+            MI("Rectangle", self.set_tool_rect, "R"),
+            MI("Line",    self.set_tool_line,   "L"),
+            MI("Stamp",   self.set_tool_stamp,  "M"),
+            MI("", separator=True),
+            MI("Auto-Tile", self.cmd_toggle_autotile, "", checkable=True),
             MI("", separator=True),
             MI("Event Trigger", self.set_tool_event, "T"),
         ]
@@ -1524,6 +3926,9 @@ class Editor:
             ("pencil",  self.set_tool_pencil,"Pencil Tool [P]"),
             ("eraser",  self.set_tool_erase, "Eraser Tool [E]"),
             ("fill",    self.set_tool_fill,  "Fill Tool [F]"),
+            ("rect",    self.set_tool_rect,  "Rectangle Tool [R]"),
+            ("line",    self.set_tool_line,  "Line Tool [L]"),
+            ("stamp",   self.set_tool_stamp, "Stamp Tool (pastes the clipboard as a pattern) [M]"),
             None,
             ("grid",    self.cmd_toggle_grid,"Toggle Grid [G]", True),
             ("zoom_in", self.cmd_zoom_in,   "Zoom In (Ctrl+=)"),
@@ -1555,10 +3960,11 @@ class Editor:
         if res == "Yes":
             self.level = Level()
             self.current_file = None
+            self.journal = None
             self.camera = Camera(self.level.current_section().width, self.level.current_section().height)
-            self.undo_stack.clear()
-            self.redo_stack.clear()
+            self.history.clear()
             self.selection.clear()
+            self.saved_rev = self.autosave_rev = self.edit_rev
             self.status("New level created.")
 
     def cmd_open(self):
@@ -1566,10 +3972,23 @@ class Editor:
         fn = dlg.run()
         if fn:
             if os.path.exists(fn):
-                self.level = read_lvl(fn)
-                self.current_file = fn
+                try:
+                    fmt, level = open_level(fn)
+                except (LevelFormatError, OSError) as e:
+                    MessageBox(self.screen, "Error", f"Cannot open {fn}:\n{e}").run()
+                    return
+                self.level = level
+                # Undo entries and the selection hold ids from the old level's registry.
+                self.history.clear()
+                self.selection.clear()
+                self.prioritize_assets()
+                # Only native files are saved back in place; imports go through Save As.
+                self.current_file = fn if fmt == 'lvl' else None
+                if self.current_file:
+                    self.open_journal(fn)
                 self.camera = Camera(self.level.current_section().width, self.level.current_section().height)
-                self.status(f"Opened: {fn}")
+                self.saved_rev = self.autosave_rev = self.edit_rev
+                self.status(f"Opened: {fn} ({fmt})")
             else:
                 MessageBox(self.screen, "Error", f"File not found:\n{fn}").run()
 
@@ -1577,16 +3996,162 @@ class Editor:
         if not self.current_file:
             self.cmd_save_as()
             return
-        write_lvl(self.current_file, self.level)
-        self.status(f"Saved: {self.current_file}")
+        self.save_to(self.current_file)
 
     def cmd_save_as(self):
         dlg = InputDialog(self.screen, "Save As", "Enter filename:", self.current_file or "level.lvl")
         fn = dlg.run()
         if fn:
             self.current_file = fn
-            write_lvl(fn, self.level)
-            self.status(f"Saved as: {fn}")
+            self.save_to(fn)
+
+    def save_to(self, fn):
+        # Only the snapshot (or the journal tail) is built on the UI thread;
+        # encoding and fsync happen on the writer thread.
+        j = self.journal
+        if j and j.path == journal_path(fn) and not j.stale and j.on_disk < JOURNAL_COMPACT_BYTES:
+            self.writer.submit(('save', fn, self.edit_rev), append_journal, j.path, j.take(commit=True))
+        else:
+            self.journal = EditJournal(fn, fresh=True)
+            self.writer.submit(('save', fn, self.edit_rev), compact_level, fn, snapshot_level(self.level))
+        self.status(f"Saving: {fn}...")
+
+    def open_journal(self, fn):
+        found = read_journal(fn)
+        self.journal = EditJournal(fn)
+        if found is None:
+            # No journal, or one written against a different base: start clean.
+            self.journal.stale = True
+            return
+        committed, tail = found
+        replay_journal(self.level, committed)
+        if tail:
+            res = MessageBox(self.screen, "Recover", f"{len(tail)} unsaved edit(s) were found\n"
+                             "from a previous session. Recover them?", ("Yes","No")).run()
+            if res == "Yes":
+                replay_journal(self.level, tail)
+                self.mark_dirty()
+        # Drop the uncommitted tail from disk on the next save.
+        self.journal.stale = self.journal.stale or bool(tail)
+
+    def mark_dirty(self, structural=False):
+        self.edit_rev += 1
+        if structural and self.journal:
+            self.journal.stale = True
+
+    def _layer_index(self, layer, section=None):
+        section = section or self.level.current_section()
+        for li, l in enumerate(section.layers):
+            if l is layer:
+                return li
+        return 0
+
+    def _section_index(self, section):
+        for si, s in enumerate(self.level.sections):
+            if s is section:
+                return si
+        return self.level.current_section_idx
+
+    def _journal(self, op, section, layer, obj):
+        if self.journal:
+            section = section or self.level.current_section()
+            self.journal.record(op, self._section_index(section), self._layer_index(layer, section), obj)
+
+    def _add_object(self, layer, obj, section=None):
+        layer.add(obj)
+        self._journal(OP_ADD, section, layer, obj)
+
+    def _remove_object(self, layer, obj, section=None):
+        self._journal(OP_REMOVE, section, layer, obj)
+        layer.remove(obj)
+
+    def write_spans(self, section, layer, spans, types, extras=()):
+        """Clears spans, lays types {tid: spans} over them and restores extras
+        (cx, cy, event_id, flags, id). The tiles going and coming are both
+        journaled. Returns the extras of the cleared tiles."""
+        store = layer.tiles
+        si, li = self._section_index(section), self._layer_index(layer, section)
+        if self.journal:
+            self.journal.record_tiles(OP_REMOVE, si, li, store, store.span_slots(spans))
+        old = store.clear_spans(spans)
+        for tid, tid_spans in types.items():
+            store.add_spans(tid_spans, tid)
+        for cx, cy, event_id, flags, oid in extras:
+            slot = store._get_cell(cx, cy)
+            if slot >= 0:
+                store.set_extras(slot, event_id, flags)
+                if oid:
+                    self.level.objects.bind_slot(oid, section, layer, slot)
+        if self.journal:
+            self.journal.record_tiles(OP_ADD, si, li, store, store.span_slots(spans))
+        self.mark_dirty()
+        return old
+
+    # Undo, redo and the selection refer to objects by registry id; these
+    # resolve an id back to wherever the object lives now.
+    def _object_id(self, layer, obj):
+        return self.level.objects.id_of(self.level.current_section(), layer, obj)
+
+    def _delete_id(self, oid):
+        loc = self.level.objects.locate(oid)
+        if loc is None:
+            return None
+        section, layer, obj = loc
+        record = object_record(obj)
+        self._remove_object(layer, obj, section)
+        return record
+
+    def _restore_id(self, oid, section, layer, record):
+        obj = build_object(record, self._layer_index(layer, section))
+        self._add_object(layer, obj, section)
+        self.level.objects.bind(oid, section, layer, obj)
+
+
+    def prioritize_assets(self):
+        kinds = {"Tiles": 'tile', "BGOs": 'bgo', "NPCs": 'npc'}
+        for section in self.level.sections:
+            for layer in section.layers:
+                for name in layer.tiles.type_names():
+                    self.assets.request('tile', name, PRIO_LEVEL)
+                for obj in (*layer.bgos, *layer.npcs):
+                    self.assets.request(obj.kind, obj.obj_type, PRIO_LEVEL)
+        kind = kinds.get(self.sidebar.current_category)
+        if kind:
+            for name in self.sidebar.items[self.sidebar.current_category]:
+                self.assets.request(kind, name, PRIO_PALETTE)
+
+    def tick_autosave(self):
+        for tag, result, err in self.writer.poll():
+            kind = tag[0]
+            if kind == 'autosave':
+                self.autosave_inflight = False
+                if err:
+                    self.status(f"Autosave failed: {err}")
+            elif kind == 'journal':
+                if err and self.journal:
+                    self.journal.stale = True
+            elif kind == 'save':
+                if err:
+                    MessageBox(self.screen, "Error", f"Could not save {tag[1]}:\n{err}").run()
+                else:
+                    self.saved_rev = max(self.saved_rev, tag[2])
+                    self.status(f"Saved: {tag[1]}")
+        now = pygame.time.get_ticks()
+        j = self.journal
+        if j and j.pending and not j.stale and now - self.last_journal_flush >= JOURNAL_FLUSH_INTERVAL:
+            # Uncommitted records: replayable after a crash, but only applied
+            # on open if the user asks for them.
+            self.writer.submit(('journal', j.path), append_journal, j.path, j.take())
+            self.last_journal_flush = now
+        if (self.autosave_inflight or self.edit_rev == self.autosave_rev
+                or self.edit_rev == self.saved_rev or now - self.last_autosave < AUTOSAVE_INTERVAL):
+            return
+        path = recovery_path(self.current_file, self.autosave_slot)
+        self.writer.submit(('autosave', path), save_snapshot, path, snapshot_level(self.level))
+        self.autosave_slot = (self.autosave_slot + 1) % AUTOSAVE_SLOTS
+        self.autosave_rev = self.edit_rev
+        self.autosave_inflight = True
+        self.last_autosave = now
 
     def cmd_export_json(self):
         fn = (self.current_file or "level").replace(".lvl","")+".json"
@@ -1606,6 +4171,7 @@ class Editor:
     def cmd_exit(self):
         res = MessageBox(self.screen,"Exit","Exit Mario Fan Builder?",("Yes","No")).run()
         if res=="Yes":
+            self.writer.wait()
             pygame.quit()
             sys.exit()
 
@@ -1636,36 +4202,61 @@ class Editor:
     def cmd_set_theme(self,theme):
         global current_theme
         current_theme = theme
-        section = self.level.current_section()
-        for layer in section.layers:
-            for t in layer.tiles:
-                t.update_image()
-            for b in layer.bgos:
-                b.update_image()
-            for n in layer.npcs:
-                n.update_image()
         self.status(f"Theme: {theme}")
 
     def cmd_properties(self):
-        PropertiesDialog(self.screen, self.level).run()
-        self.camera = Camera(self.level.current_section().width, self.level.current_section().height)
         section = self.level.current_section()
+        old = {'width': section.width, 'height': section.height}
+        if PropertiesDialog(self.screen, self.level).run() == 'ok':
+            new = {'width': section.width, 'height': section.height}
+            if new != old:
+                cmds = [SectionCommand(section, old, new)]
+                if new['width'] < old['width'] or new['height'] < old['height']:
+                    crop = self.crop_section(section)
+                    if crop:
+                        cmds.append(crop)
+                self.push_undo(CompositeCommand(cmds, "Resize"))
+            self.mark_dirty(structural=True)
+        self.camera = Camera(self.level.current_section().width, self.level.current_section().height)
+
+    def crop_section(self, section):
+        # Drops everything that no longer fits; returns the diff to undo it.
+        # Only the chunks right of and below the new size are looked at: one
+        # rect for the columns past the width, one for the rows past the
+        # height left of it, split on a chunk edge so they share no chunk.
+        w, h = section.width, section.height
+        c = w // GRID_SIZE // DIFF_CHUNK * DIFF_CHUNK
+        r = h // GRID_SIZE // DIFF_CHUNK * DIFF_CHUNK
+        lo, hi = CELL_RECT_ALL[0], CELL_RECT_ALL[2]
+        rects = [(c, lo, hi, hi), (lo, r, c, hi)]
+        bulk = BulkEdit(section, rects)
         for layer in section.layers:
-            for t in layer.tiles:
-                t.update_image()
+            store = layer.tiles
+            for rect in rects:
+                for slot in store.slots_in(*rect):
+                    if store.xs[slot] >= w or store.ys[slot] >= h:
+                        store.remove_slot(slot)
+                for group in (layer.bgos, layer.npcs):
+                    for obj in [o for o in group.in_rect(*rect) if o.rect.x >= w or o.rect.y >= h]:
+                        group.remove(obj)
+        return bulk.finish("Crop")
 
     def cmd_add_layer(self):
         section = self.level.current_section()
         section.layers.append(Layer(f"Layer {len(section.layers)+1}"))
+        section.renumber_layers()
+        self.mark_dirty(structural=True)
         self.status(f"Added layer {len(section.layers)}")
 
     def cmd_layer_manager(self):
         LayerDialog(self.screen, self.level.current_section()).run()
+        self.mark_dirty(structural=True)
 
     def cmd_set_start(self):
         wx, wy = self.get_mouse_world()
         gx, gy = self.world_to_grid(wx, wy)
         self.level.start_pos = (gx, gy)
+        self.mark_dirty(structural=True)
         if self.player:
             self.player.level_start = (gx, gy)
         self.status(f"Start pos set: {gx},{gy}")
@@ -1678,19 +4269,22 @@ class Editor:
             colors = [(92,148,252), (0,0,40), (0,0,0), (255,140,60), (30,20,10), (0,80,160)]
             if 0 <= idx < len(colors):
                 self.level.current_section().bg_color = colors[idx]
+                self.mark_dirty(structural=True)
 
     def cmd_clear_all(self):
-        res = MessageBox(self.screen, "Clear All", "Clear ALL objects from level?\nThis cannot be undone!", ("Yes","No")).run()
+        res = MessageBox(self.screen, "Clear All", "Clear ALL objects from this section?", ("Yes","No")).run()
         if res == "Yes":
             section = self.level.current_section()
+            bulk = BulkEdit(section)
             for layer in section.layers:
                 layer.tiles.empty()
                 layer.bgos.empty()
                 layer.npcs.empty()
-                layer.tile_map.clear()
-            self.undo_stack.clear()
-            self.redo_stack.clear()
+            cmd = bulk.finish("Clear All")
+            if cmd:
+                self.push_undo(cmd)
             self.selection.clear()
+            self.mark_dirty(structural=True)
             self.status("Level cleared.")
 
     def cmd_reset_player(self):
@@ -1704,10 +4298,12 @@ class Editor:
             "EDITOR:\n"
             "  Left Click - Place / Select\n"
             "  Right Click - Erase\n"
-            "  Arrow Keys - Scroll\n"
+            "  R/L/M - Rectangle/Line/Stamp (drag)\n"
+            "  Arrow Keys - Scroll (Shift: move selection)\n"
             "  Ctrl+Z/Y - Undo/Redo\n"
             "  Ctrl+C/V/X - Copy/Paste/Cut\n"
             "  Ctrl+A - Select All\n"
+            "  Ctrl+F / F3 - Find / Find Next\n"
             "  G - Toggle Grid\n"
             "  Ctrl+=/-  Zoom In/Out\n"
             "  F5 - Playtest\n\n"
@@ -1731,22 +4327,125 @@ class Editor:
     def cmd_warp_editor(self):
         WarpDialog(self.screen, self.level).run()
 
+    def cmd_find(self):
+        crit = FindDialog(self.screen, self.find_query).run()
+        if crit is None:
+            return
+        self.find_query = crit
+        self.find_pos = -1
+        self.run_find()
+        if self.find_count:
+            self.find_next()
+        else:
+            self.status("Find: no matches")
+
+    def run_find(self):
+        crit = dict(self.find_query)
+        scope = crit.pop('scope')
+        if scope != 'level':
+            crit['section'] = self.level.current_section()
+        if scope == 'layer':
+            crit['layer'] = self.level.current_layer()
+        t = time.perf_counter()
+        self.find_results = self.level.query(**crit)
+        self.find_count = sum(len(keys) for _, _, keys in self.find_results)
+        self.find_stamp = (self.level, self.edit_rev)
+        self.find_ms = (time.perf_counter() - t) * 1000
+
+    def find_next(self, step=1):
+        if self.find_query is None:
+            self.cmd_find()
+            return
+        if self.find_stamp != (self.level, self.edit_rev):
+            # Edited since the last search: the results may point at freed slots.
+            self.run_find()
+        if not self.find_count:
+            self.status("Find: no matches")
+            return
+        self.find_pos = i = (self.find_pos + step) % self.find_count
+        for section, layer, keys in self.find_results:
+            if i < len(keys):
+                key = keys[i]
+                break
+            i -= len(keys)
+        if isinstance(key, int):
+            x, y = layer.tiles.xs[key], layer.tiles.ys[key]
+            oid = self.level.objects.slot_ids(section, layer, [key])[0]
+        else:
+            x, y = key.rect.topleft
+            oid = self.level.objects.id_of(section, layer, key)
+        si = self.level.sections.index(section)
+        if si != self.level.current_section_idx:
+            self.level.current_section_idx = si
+            zoom = self.camera.zoom
+            self.camera = Camera(section.width, section.height)
+            self.camera.zoom = zoom
+        section.current_layer_idx = section.layers.index(layer)
+        self.camera.center_on(x + GRID_SIZE // 2, y + GRID_SIZE // 2)
+        self.selection.replace([oid])
+        self.status(f"Find: {self.find_pos + 1} of {self.find_count} "
+                    f"(section {si + 1}, {layer.name}) - {self.find_ms:.1f} ms")
+
+    def find_prev(self):
+        self.find_next(-1)
+
     def select_all(self):
-        self.selection.clear()
-        layer = self.level.current_layer()
-        self.selection.extend(layer.tiles.sprites())
-        self.selection.extend(layer.bgos.sprites())
-        self.selection.extend(layer.npcs.sprites())
+        self.selection.replace(self.level.objects.ids_in(self.level.current_section(), self.level.current_layer()))
         self.status(f"Selected {len(self.selection)} objects")
 
     def deselect_all(self):
         self.selection.clear()
 
     def delete_selected(self):
-        for obj in self.selection:
-            self._delete_object(obj)
+        cmd = self.erase_ids(self.selection, "Delete")
         self.selection.clear()
-        self.status("Deleted selected objects")
+        self.status(f"Deleted {len(cmd) if cmd else 0} object(s)")
+
+    def erase_ids(self, oids, label="Erase"):
+        # One transaction: grid tiles are cleared span-wise; off-grid tiles,
+        # BGOs and NPCs are removed by id.
+        reg = self.level.objects
+        tx = self.begin(label)
+        for oid in oids:
+            entry = reg.where.get(oid)
+            if entry is None or reg.locate(oid) is None:
+                continue
+            _, layer, key = entry
+            if isinstance(key, int) and layer.tiles.on_grid(key):
+                store = layer.tiles
+                tx.set_tile(layer, store.xs[key] // GRID_SIZE, store.ys[key] // GRID_SIZE, 0)
+            else:
+                tx.remove(oid)
+        return self.commit()
+
+    def move_selection(self, dx, dy):
+        # Shift+Arrow: the whole selection moves dx, dy cells as one undo entry.
+        # Grid tiles are cleared first and re-set with their ids, so selected
+        # tiles moving onto each other's cells don't drop one another.
+        # Off-grid tiles move by id along with BGOs/NPCs.
+        reg = self.level.objects
+        tx = self.begin("Move")
+        tiles, others = [], []
+        for oid in self.selection:
+            entry = reg.where.get(oid)
+            if entry is None or reg.locate(oid) is None or entry[1].locked:
+                continue
+            _, layer, key = entry
+            if isinstance(key, int) and layer.tiles.on_grid(key):
+                store = layer.tiles
+                tiles.append((layer, store.xs[key] // GRID_SIZE, store.ys[key] // GRID_SIZE,
+                              store.type_id[key], store.event_id[key], store.flags[key], oid))
+            else:
+                others.append(oid)
+        for layer, cx, cy, *_ in tiles:
+            tx.set_tile(layer, cx, cy, 0)
+        for layer, cx, cy, tid, event_id, flags, oid in tiles:
+            tx.set_tile(layer, cx + dx, cy + dy, tid, event_id, flags, oid)
+        if others:
+            tx.move(others, dx * GRID_SIZE, dy * GRID_SIZE)
+        cmd = self.commit()
+        if cmd:
+            self.status(f"Moved {len(tiles) + len(others)} object(s)")
 
     # ---- TOOLS ----
     def set_tool_select(self):
@@ -1765,6 +4464,18 @@ class Editor:
         self.tool = 'fill'
         self.status("Tool: Fill")
 
+    def set_tool_rect(self):
+        self.tool = 'rect'
+        self.status("Tool: Rectangle")
+
+    def set_tool_line(self):
+        self.tool = 'line'
+        self.status("Tool: Line")
+
+    def set_tool_stamp(self):
+        self.tool = 'stamp'
+        self.status("Tool: Stamp (drag to repeat the clipboard)")
+
     def set_tool_event(self):
         self.tool = 'event'
         self.status("Tool: Event Picker (click object to assign event)")
@@ -1774,12 +4485,17 @@ class Editor:
             self.menubar.open_idx = -1
         self.playtest_mode = not self.playtest_mode
         if self.playtest_mode:
+            # Playtest runs on copies so stomped or lava-killed NPCs stay in the level.
+            section = self.level.current_section()
+            self.play_npcs = [n.copy() for layer in section.layers if layer.visible for n in layer.npcs]
             self.player = Player(*self.level.start_pos)
             self.player.level_start = self.level.start_pos
             self.camera.update(self.player)
             self.status("PLAYTEST - Esc to return")
         else:
             self.player = None
+            self.play_npcs = []
+            self.level.current_section().clear_hidden()
             self.status("Editor mode")
         for btn in self.toolbar_btns:
             if btn.icon_key=='play':
@@ -1789,27 +4505,32 @@ class Editor:
         self.status_msg = msg
 
     # ---- UNDO/REDO ----
-    def push_undo(self, action):
-        self.undo_stack.append(action)
-        self.redo_stack.clear()
+    def push_undo(self, cmd):
+        self.history.push(cmd)
+        self.mark_dirty()
+
+    def begin_stroke(self, label):
+        # Batches committed until end_stroke() join one undo entry.
+        self.history.begin(CompositeCommand([], label))
+
+    def end_stroke(self):
+        self.history.end()
 
     def undo(self):
-        if not self.undo_stack:
+        cmd = self.history.undo(self)
+        if cmd is None:
             self.status("Nothing to undo")
             return
-        action = self.undo_stack.pop()
-        action['undo']()
-        self.redo_stack.append(action)
-        self.status("Undo")
+        self.mark_dirty()
+        self.status(f"Undo {cmd.label} ({len(cmd)})")
 
     def redo(self):
-        if not self.redo_stack:
+        cmd = self.history.redo(self)
+        if cmd is None:
             self.status("Nothing to redo")
             return
-        action = self.redo_stack.pop()
-        action['redo']()
-        self.undo_stack.append(action)
-        self.status("Redo")
+        self.mark_dirty()
+        self.status(f"Redo {cmd.label} ({len(cmd)})")
 
     # ---- COORD HELPERS ----
     def world_to_grid(self, wx, wy):
@@ -1825,168 +4546,350 @@ class Editor:
                (sy - CANVAS_Y)/self.camera.zoom - self.camera.camera.y
 
     # ---- OBJECT PLACEMENT ----
-    def place_object(self, gx, gy):
+    def paint_cells(self, cells, erase=False):
+        # One batch per frame of a pencil/eraser drag.
         layer = self.level.current_layer()
         if layer.locked:
             return
-        key = (gx, gy)
-        if self.sidebar.current_category == "NPCs":
-            npc = NPC(gx, gy, self.sidebar.selected_item, layer=layer)
-            layer.npcs.add(npc)
-            self.push_undo({'undo': lambda l=layer, n=npc: l.npcs.remove(n),
-                            'redo': lambda l=layer, n=npc: l.npcs.add(n)})
-        elif self.sidebar.current_category == "BGOs":
-            bgo = BGO(gx, gy, self.sidebar.selected_item, layer=layer)
-            layer.bgos.add(bgo)
-            self.push_undo({'undo': lambda l=layer, b=bgo: l.bgos.remove(b),
-                            'redo': lambda l=layer, b=bgo: l.bgos.add(b)})
+        tx = self.begin("Erase" if erase else "Draw")
+        if erase:
+            for cx, cy in cells:
+                obj = layer.object_at(cx * GRID_SIZE, cy * GRID_SIZE)
+                if isinstance(obj, Tile):
+                    tx.set_tile(layer, cx, cy, 0)
+                elif obj:
+                    tx.remove(self._object_id(layer, obj))
         else:
-            if key in layer.tile_map:
-                return
-            tile = Tile(gx, gy, self.sidebar.selected_item, layer=layer)
-            layer.add_tile(tile)
-            self.push_undo({'undo': lambda l=layer, t=tile: l.remove_tile(t),
-                            'redo': lambda l=layer, t=tile: l.add_tile(t)})
+            self.tx_place(tx, layer, cells)
+        self.commit()
+
+    def start_drag(self, cell, erase):
+        self.drag_draw, self.drag_erase = not erase, erase
+        self.drag_cell = self.drag_target = cell
+        self.begin_stroke("Erase" if erase else "Draw")
+        self.paint_cells([cell], erase)
+
+    def flush_drag(self):
+        # Motion events only move drag_target; the cells between the last
+        # painted cell and it are filled in here, once per frame.
+        if not (self.drag_draw or self.drag_erase) or self.drag_target == self.drag_cell:
+            return
+        cells = line_cells(*self.drag_cell, *self.drag_target)[1:]
+        self.drag_cell = self.drag_target
+        self.paint_cells(cells, self.drag_erase)
+
+    # ---- TRANSACTIONS ----
+    def begin(self, label="Edit"):
+        self.tx = Transaction(self.level.current_section(), label)
+        return self.tx
+
+    def commit(self):
+        tx, self.tx = self.tx, None
+        if tx and self.autotile:
+            self.autotile_tx(tx)
+        cmd = tx.apply(self) if tx else None
+        if cmd:
+            if self.history.open is not None:
+                self.history.open.commands.append(cmd)
+            else:
+                self.push_undo(cmd)
+            self.mark_dirty()
+        return cmd
+
+    def autotile_tx(self, tx):
+        # Variant fixes join the same transaction, so they undo with the edit.
+        # Untouched neighbours keep their event, flags and id.
+        for layer, cells in list(tx.tiles.items()):
+            store = layer.tiles
+            for cell, tid in self.autotiler.resolve(store, cells).items():
+                if cell in cells:
+                    cells[cell] = tid
+                    continue
+                slot = store._get_cell(*cell)
+                tx.set_tile(layer, cell[0], cell[1], tid, store.event_id[slot], store.flags[slot], store.ids[slot])
+
+    def cmd_toggle_autotile(self):
+        self.autotile = not self.autotile
+        self.status(f"Auto-tile: {'on' if self.autotile else 'off'}")
+
+    def tx_place(self, tx, layer, cells):
+        # Queues the sidebar's current item on every cell.
+        name = self.sidebar.selected_item
+        category = self.sidebar.current_category
+        if category == "Tiles":
+            tx.set_tiles(layer, cells, TILE_SMBX_IDS.get(name, 1))
+            return
+        cls = NPC if category == "NPCs" else BGO
+        li = self._layer_index(layer)
+        for cx, cy in cells:
+            tx.add(layer, cls(cx * GRID_SIZE, cy * GRID_SIZE, name, li))
+
+    def stamp_pattern(self, tx, layer, start, end):
+        # The clipboard repeated over the dragged rect (or placed once for a click).
+        block = self.clipboard
+        if not block:
+            self.status("Stamp: copy something first")
+            return
+        x0, x1 = sorted((start[0], end[0]))
+        y0, y1 = sorted((start[1], end[1]))
+        x1, y1 = max(x1, x0 + block.w - 1), max(y1, y0 + block.h - 1)
+        for oy in range(y0, y1 + 1, block.h):
+            for ox in range(x0, x1 + 1, block.w):
+                block.paste(tx, self.level.objects, ox, oy, target=layer, clip=(x1, y1))
+
+    def mouse_cell(self):
+        wx, wy = self.get_mouse_world()
+        return int(wx) // GRID_SIZE, int(wy) // GRID_SIZE
 
-    def erase_object(self, gx, gy):
+    def apply_shape(self, start, end):
         layer = self.level.current_layer()
         if layer.locked:
             return
-        key = (gx, gy)
-        if key in layer.tile_map:
-            tile = layer.tile_map[key]
-            layer.remove_tile(tile)
-            self.push_undo({'undo': lambda l=layer, t=tile: l.add_tile(t),
-                            'redo': lambda l=layer, k=key: l.remove_tile(l.tile_map[k]) if k in l.tile_map else None})
+        tx = self.begin({'rect': "Rectangle", 'line': "Line", 'stamp': "Stamp"}[self.tool])
+        if self.tool == 'stamp':
+            self.stamp_pattern(tx, layer, start, end)
+        elif self.tool == 'rect':
+            self.tx_place(tx, layer, rect_cells(start, end))
+        else:
+            self.tx_place(tx, layer, line_cells(*start, *end))
+        cmd = self.commit()
+        if cmd:
+            self.status(f"{cmd.label}: {len(cmd)} object(s)")
+
+    def draw_shape_preview(self, surf, ox, oy):
+        if self.shape_start is None:
             return
-        for group, kind in [(layer.npcs,'npc'), (layer.bgos,'bgo')]:
-            for obj in list(group):
-                if obj.rect.x == gx and obj.rect.y == gy:
-                    group.remove(obj)
-                    self.push_undo({'undo': lambda g=group, o=obj: g.add(o),
-                                    'redo': lambda g=group, o=obj: g.remove(o)})
-                    return
+        start, end = self.shape_start, self.mouse_cell()
+        if self.tool == 'line':
+            for cx, cy in line_cells(*start, *end):
+                pygame.draw.rect(surf, WHITE, (cx * GRID_SIZE + ox, cy * GRID_SIZE + oy, GRID_SIZE, GRID_SIZE), 1)
+            return
+        x0, x1 = sorted((start[0], end[0]))
+        y0, y1 = sorted((start[1], end[1]))
+        pygame.draw.rect(surf, WHITE, (x0 * GRID_SIZE + ox, y0 * GRID_SIZE + oy,
+                                       (x1 - x0 + 1) * GRID_SIZE, (y1 - y0 + 1) * GRID_SIZE), 2)
+
+    def fill_bounds(self):
+        section = self.level.current_section()
+        return (0, 0, section.width // GRID_SIZE, section.height // GRID_SIZE)
 
     def fill_area(self, sx, sy):
         layer = self.level.current_layer()
         if layer.locked:
             return
-        target = self.sidebar.selected_item
-        start = (sx, sy)
-        old_type = layer.tile_map[start].tile_type if start in layer.tile_map else None
-        if old_type == target:
+        if self.sidebar.current_category != "Tiles":
+            self.status("Fill only places tiles")
+            return
+        tid = TILE_SMBX_IDS.get(self.sidebar.selected_item, 1)
+        store = layer.tiles
+        slot = store.slot_at(sx, sy)
+        old_tid = store.type_id[slot] if slot >= 0 else 0
+        if old_tid == tid:
+            return
+        spans = store.flood_spans(sx // GRID_SIZE, sy // GRID_SIZE, self.fill_bounds(), FILL_MAX_CELLS)
+        if spans is None:
+            self.status(f"Fill area is larger than {FILL_MAX_CELLS} cells")
+            return
+        if not spans:
             return
-        queue = deque([start])
-        visited = set()
-        new_tiles = []
-        while queue:
-            x, y = queue.popleft()
-            if (x, y) in visited:
+        if self.autotile:
+            # Through a transaction so the fill and its edges are resolved together.
+            tx = self.begin("Fill")
+            tx.set_tiles(layer, ((x, spans[i]) for i in range(0, len(spans), 3)
+                                 for x in range(spans[i+1], spans[i+2])), tid)
+            cmd = self.commit()
+            self.status(f"Filled {len(cmd) if cmd else 0} cells")
+            return
+        section = self.level.current_section()
+        extras = self.write_spans(section, layer, spans, {tid: spans})
+        cmd = FillCommand(section, layer, spans, tid, old_tid, extras)
+        self.push_undo(cmd)
+        self.status(f"Filled {len(cmd)} cells")
+
+    def update_fill_preview(self):
+        # Recomputed only when the hovered cell leaves the cached region or
+        # the level changes; any start cell inside a region gives the same spans.
+        # A region over FILL_MAX_CELLS caches the part walked before giving up,
+        # so hovering around inside it doesn't re-run the flood.
+        if self.tool != 'fill' or self.playtest_mode or self.sidebar.current_category != "Tiles":
+            self.fill_preview = None
+            return
+        mx, my = self.mouse_pos
+        if not (mx > SIDEBAR_WIDTH and my > CANVAS_Y):
+            self.fill_preview = None
+            return
+        wx, wy = self.canvas_to_world(mx, my)
+        cx, cy = int(wx) // GRID_SIZE, int(wy) // GRID_SIZE
+        layer = self.level.current_layer()
+        p = self.fill_preview
+        if p and p['layer'] is layer and p['rev'] == self.edit_rev:
+            if (cx, cy) == p['start'] or any(x0 <= cx < x1 for x0, x1 in p['rows'].get(cy, ())):
+                p['hover'] = (cx, cy)
+                return
+        walked = array('i')
+        spans = layer.tiles.flood_spans(cx, cy, self.fill_bounds(), FILL_MAX_CELLS, walked)
+        found = walked if spans is None else spans
+        rows = {}
+        for i in range(0, len(found), 3):
+            rows.setdefault(found[i], []).append((found[i+1], found[i+2]))
+        self.fill_preview = {'layer': layer, 'rev': self.edit_rev, 'start': (cx, cy),
+                             'hover': (cx, cy), 'spans': spans, 'rows': rows}
+
+    def draw_fill_preview(self, surf, view, ox, oy):
+        p = self.fill_preview
+        if not p:
+            return
+        if p['spans'] is None:
+            cx, cy = p['hover']
+            pygame.draw.rect(surf, RED, (cx * GRID_SIZE + ox, cy * GRID_SIZE + oy, GRID_SIZE, GRID_SIZE), 2)
+            return
+        strip = self.fill_strip
+        if strip is None or strip.get_width() < view.width:
+            strip = self.fill_strip = pygame.Surface((view.width, GRID_SIZE), pygame.SRCALPHA)
+            strip.fill((255, 255, 255, 90))
+        for y, spans in p['rows'].items():
+            py = y * GRID_SIZE
+            if not view.top - GRID_SIZE < py < view.bottom:
                 continue
-            visited.add((x, y))
-            if old_type is None:
-                if (x, y) in layer.tile_map:
-                    continue
-            else:
-                if (x, y) not in layer.tile_map or layer.tile_map[(x, y)].tile_type != old_type:
-                    continue
-            if (x, y) in layer.tile_map:
-                layer.remove_tile(layer.tile_map[(x, y)])
-            t = Tile(x, y, target, layer=layer)
-            layer.add_tile(t)
-            new_tiles.append(t)
-            sec = self.level.current_section()
-            for dx, dy in [(GRID_SIZE,0), (-GRID_SIZE,0), (0,GRID_SIZE), (0,-GRID_SIZE)]:
-                nx, ny = x+dx, y+dy
-                if 0 <= nx < sec.width and 0 <= ny < sec.height:
-                    queue.append((nx, ny))
-        if new_tiles:
-            self.push_undo({'undo': lambda l=layer, nt=new_tiles: [l.remove_tile(t) for t in nt],
-                            'redo': lambda l=layer, nt=new_tiles: [l.add_tile(t) for t in nt]})
+            for x0, x1 in spans:
+                left, right = max(x0 * GRID_SIZE, view.left), min(x1 * GRID_SIZE, view.right)
+                if left < right:
+                    surf.blit(strip, (left + ox, py + oy), (0, 0, right - left, GRID_SIZE))
 
     def handle_select(self, gx, gy, event):
+        # Clicking an object picks it (Shift toggles); clicking empty space
+        # starts a marquee.
         layer = self.level.current_layer()
-        obj = None
-        if (gx, gy) in layer.tile_map:
-            obj = layer.tile_map[(gx, gy)]
-        else:
-            for n in layer.npcs:
-                if n.rect.x == gx and n.rect.y == gy:
-                    obj = n
-                    break
-            if not obj:
-                for b in layer.bgos:
-                    if b.rect.x == gx and b.rect.y == gy:
-                        obj = b
-                        break
+        obj = layer.object_at(gx, gy)
+        shift = pygame.key.get_mods() & pygame.KMOD_SHIFT
         if obj:
-            mods = pygame.key.get_mods()
-            if mods & pygame.KMOD_SHIFT:
-                if obj in self.selection:
-                    self.selection.remove(obj)
-                else:
-                    self.selection.append(obj)
+            oid = self._object_id(layer, obj)
+            if shift:
+                self.selection.toggle(oid)
             else:
-                self.selection = [obj]
+                self.selection.replace([oid])
+        else:
+            if not shift:
+                self.selection.clear()
+            self.marquee_start = self.get_mouse_world()
+
+    def marquee_cells(self):
+        # Cell rect [c0, c1) x [r0, r1) of every cell the marquee touches.
+        (ax, ay), (bx, by) = self.marquee_start, self.get_mouse_world()
+        return (int(min(ax, bx)) // GRID_SIZE, int(min(ay, by)) // GRID_SIZE,
+                int(max(ax, bx)) // GRID_SIZE + 1, int(max(ay, by)) // GRID_SIZE + 1)
+
+    def finish_marquee(self):
+        rect = self.marquee_cells()
+        self.marquee_start = None
+        ids = self.level.objects.ids_in_rect(self.level.current_section(), self.level.current_layer(), *rect)
+        self.selection.update(dict.fromkeys(ids))
+        self.status(f"Selected {len(self.selection)} objects")
+
+    def draw_selection(self, surf, view, ox, oy):
+        # Outlines only for selected objects in view; the selection itself may be huge.
+        if self.marquee_start:
+            c0, r0, c1, r1 = self.marquee_cells()
+            pygame.draw.rect(surf, WHITE, (c0 * GRID_SIZE + ox, r0 * GRID_SIZE + oy,
+                                           (c1 - c0) * GRID_SIZE, (r1 - r0) * GRID_SIZE), 1)
+        sel = self.selection
+        if not sel:
+            return
+        c0, r0 = view.left // GRID_SIZE - 1, view.top // GRID_SIZE - 1
+        c1, r1 = view.right // GRID_SIZE + 1, view.bottom // GRID_SIZE + 1
+        for layer in self.level.current_section().layers:
+            store = layer.tiles
+            rects = [pygame.Rect(store.xs[s], store.ys[s], GRID_SIZE, GRID_SIZE)
+                     for s in store.slots_in(c0, r0, c1, r1) if store.ids[s] in sel]
+            rects.extend(o.rect for group in (layer.bgos, layer.npcs)
+                         for o in group.in_rect(c0, r0, c1, r1) if o.oid in sel)
+            for r in rects:
+                p = r.move(ox, oy)
+                pygame.draw.rect(surf, YELLOW, p, 2)
+                pygame.draw.rect(surf, WHITE, p.inflate(2,2), 1)
 
     def handle_event_pick(self, gx, gy):
         layer = self.level.current_layer()
-        obj = None
-        if (gx, gy) in layer.tile_map:
-            obj = layer.tile_map[(gx, gy)]
-        else:
-            for n in layer.npcs:
-                if n.rect.x == gx and n.rect.y == gy:
-                    obj = n
-                    break
-            if not obj:
-                for b in layer.bgos:
-                    if b.rect.x == gx and b.rect.y == gy:
-                        obj = b
-                        break
+        obj = layer.object_at(gx, gy)
         if obj:
             dlg = InputDialog(self.screen, "Assign Event", "Event ID (or -1 for none):", str(obj.event_id))
             res = dlg.run()
             if res is not None:
                 try:
-                    obj.event_id = int(res)
-                except:
-                    pass
+                    value = int(res)
+                except ValueError:
+                    return
+                oid = self._object_id(layer, obj)
+                self.history.push(PropertyCommand(oid, 'event_id', obj.event_id, value))
+                layer.set_event(obj, value)
+                self.mark_dirty(structural=True)
+
+    def selected_objects(self):
+        # (layer index, object) for every selected id that still exists.
+        out = []
+        for oid in self.selection:
+            loc = self.level.objects.locate(oid)
+            if loc is not None:
+                section, layer, obj = loc
+                out.append((self._layer_index(layer, section), obj))
+        return out
 
     def copy_selection(self):
-        self.clipboard = [(o.rect.x, o.rect.y, o.obj_type, o.layer) for o in self.selection]
-        self.status(f"Copied {len(self.clipboard)} object(s)")
+        # True if the clipboard now holds the selection.
+        items = self.selected_objects()
+        if not items:
+            return False
+        block = ClipboardBlock.from_objects(items)
+        if block is None:
+            self.status("Selection is too spread out to copy")
+            return False
+        self.clipboard = block
+        self.status(f"Copied {len(block)} object(s)")
+        return True
 
     def cut_selection(self):
-        self.copy_selection()
-        for o in self.selection:
-            self._delete_object(o)
+        # Nothing is erased unless the copy went through.
+        if not self.copy_selection():
+            return
+        self.erase_ids(self.selection, "Cut")
         self.selection.clear()
 
-    def paste_clipboard(self):
+    def paste_clipboard(self, mode='overwrite'):
         if not self.clipboard:
             return
-        wx, wy = self.get_mouse_world()
-        bx, by = self.world_to_grid(wx, wy)
-        ox, oy = self.clipboard[0][0], self.clipboard[0][1]
-        for x, y, otype, li in self.clipboard:
-            nx, ny = bx + (x-ox), by + (y-oy)
-            if otype in TILE_SMBX_IDS:
-                self.level.current_section().layers[li].add_tile(Tile(nx, ny, otype, li))
-            elif otype in BGO_SMBX_IDS:
-                self.level.current_section().layers[li].bgos.add(BGO(nx, ny, otype, li))
-            elif otype in NPC_SMBX_IDS:
-                self.level.current_section().layers[li].npcs.add(NPC(nx, ny, otype, li))
-        self.status(f"Pasted {len(self.clipboard)} object(s)")
-
-    def _delete_object(self, obj):
-        layer = self.level.current_section().layers[obj.layer if isinstance(obj.layer, int) else 0]
-        if isinstance(obj, Tile):
-            layer.remove_tile(obj)
-        elif isinstance(obj, BGO):
-            layer.bgos.remove(obj)
-        elif isinstance(obj, NPC):
-            layer.npcs.remove(obj)
+        cx, cy = self.mouse_cell()
+        tx = self.begin("Paste")
+        self.clipboard.paste(tx, self.level.objects, cx, cy, mode)
+        cmd = self.commit()
+        self.status(f"Pasted {len(cmd) if cmd else 0} object(s)" + (" (merge)" if mode == 'merge' else ""))
+
+    def paste_merge(self):
+        self.paste_clipboard('merge')
+
+    def cmd_export_clipboard(self):
+        if not self.clipboard:
+            self.status("Clipboard is empty")
+            return
+        fn = InputDialog(self.screen, "Copy to File", "Enter filename:", CLIPBOARD_FILE).run()
+        if fn:
+            try:
+                with open(fn, 'wb') as f:
+                    f.write(self.clipboard.to_bytes())
+            except OSError as e:
+                MessageBox(self.screen, "Error", f"Cannot write {fn}:\n{e}").run()
+                return
+            self.status(f"Clipboard written to {fn}")
+
+    def cmd_import_clipboard(self):
+        fn = InputDialog(self.screen, "Paste from File", "Enter filename:", CLIPBOARD_FILE).run()
+        if fn:
+            try:
+                with open(fn, 'rb') as f:
+                    self.clipboard = ClipboardBlock.from_bytes(f.read())
+            except (LevelFormatError, OSError) as e:
+                MessageBox(self.screen, "Error", f"Cannot read {fn}:\n{e}").run()
+                return
+            self.status(f"Loaded {len(self.clipboard)} object(s) - Ctrl+V to paste")
 
     # ---- EVENT HANDLING ----
     def handle_event(self, event):
@@ -2025,18 +4928,24 @@ class Editor:
                     self.set_tool_erase()
                 if event.key == pygame.K_f:
                     self.set_tool_fill()
+                if event.key == pygame.K_r:
+                    self.set_tool_rect()
+                if event.key == pygame.K_l:
+                    self.set_tool_line()
+                if event.key == pygame.K_m:
+                    self.set_tool_stamp()
                 if event.key == pygame.K_t:
                     self.set_tool_event()
                 if event.key == pygame.K_g:
                     self.cmd_toggle_grid()
-                if event.key == pygame.K_LEFT:
-                    self.camera.move(GRID_SIZE, 0)
-                if event.key == pygame.K_RIGHT:
-                    self.camera.move(-GRID_SIZE, 0)
-                if event.key == pygame.K_UP:
-                    self.camera.move(0, GRID_SIZE)
-                if event.key == pygame.K_DOWN:
-                    self.camera.move(0, -GRID_SIZE)
+                arrows = {pygame.K_LEFT: (-1, 0), pygame.K_RIGHT: (1, 0),
+                          pygame.K_UP: (0, -1), pygame.K_DOWN: (0, 1)}
+                if event.key in arrows:
+                    dx, dy = arrows[event.key]
+                    if mods & pygame.KMOD_SHIFT and self.selection:
+                        self.move_selection(dx, dy)
+                    else:
+                        self.camera.move(-dx * GRID_SIZE, -dy * GRID_SIZE)
                 if event.key == pygame.K_F4:
                     self.cmd_properties()
                 if event.key == pygame.K_F5:
@@ -2047,6 +4956,11 @@ class Editor:
                     self.cmd_warp_editor()
                 if event.key == pygame.K_F1:
                     self.cmd_help()
+                if event.key == pygame.K_F3:
+                    if mods & pygame.KMOD_SHIFT:
+                        self.find_prev()
+                    else:
+                        self.find_next()
                 if event.key == pygame.K_DELETE:
                     self.delete_selected()
             if ctrl:
@@ -2063,11 +4977,16 @@ class Editor:
                 if event.key == pygame.K_c:
                     self.copy_selection()
                 if event.key == pygame.K_v:
-                    self.paste_clipboard()
+                    if mods & pygame.KMOD_SHIFT:
+                        self.paste_merge()
+                    else:
+                        self.paste_clipboard()
                 if event.key == pygame.K_x:
                     self.cut_selection()
                 if event.key == pygame.K_a:
                     self.select_all()
+                if event.key == pygame.K_f:
+                    self.cmd_find()
                 if event.key == pygame.K_EQUALS or event.key == pygame.K_PLUS:
                     self.cmd_zoom_in()
                 if event.key == pygame.K_MINUS:
@@ -2078,26 +4997,26 @@ class Editor:
         if event.type == pygame.MOUSEBUTTONDOWN:
             if self.sidebar.rect.collidepoint(event.pos) and event.button == 1:
                 self.sidebar.handle_click(event.pos, self.level)
+                self.prioritize_assets()
             elif (event.pos[1] > CANVAS_Y and event.pos[0] > SIDEBAR_WIDTH
                   and not self.playtest_mode and self.menubar.open_idx < 0):
                 wx, wy = self.canvas_to_world(event.pos[0], event.pos[1])
                 gx, gy = self.world_to_grid(wx, wy)
                 if event.button == 1:
                     if self.tool == 'pencil':
-                        self.drag_draw = True
-                        self.place_object(gx, gy)
+                        self.start_drag((gx // GRID_SIZE, gy // GRID_SIZE), False)
                     elif self.tool == 'erase':
-                        self.drag_erase = True
-                        self.erase_object(gx, gy)
+                        self.start_drag((gx // GRID_SIZE, gy // GRID_SIZE), True)
                     elif self.tool == 'select':
                         self.handle_select(gx, gy, event)
                     elif self.tool == 'fill':
                         self.fill_area(gx, gy)
+                    elif self.tool in ('rect', 'line', 'stamp'):
+                        self.shape_start = (gx // GRID_SIZE, gy // GRID_SIZE)
                     elif self.tool == 'event':
                         self.handle_event_pick(gx, gy)
                 elif event.button == 3:
-                    self.drag_erase = True
-                    self.erase_object(gx, gy)
+                    self.start_drag((gx // GRID_SIZE, gy // GRID_SIZE), True)
                 elif event.button == 4:
                     self.cmd_zoom_in()
                 elif event.button == 5:
@@ -2106,34 +5025,46 @@ class Editor:
         if event.type == pygame.MOUSEMOTION and not self.playtest_mode:
             if self.drag_draw or self.drag_erase:
                 wx, wy = self.canvas_to_world(event.pos[0], event.pos[1])
-                gx, gy = self.world_to_grid(wx, wy)
-                if self.drag_draw:
-                    self.place_object(gx, gy)
-                elif self.drag_erase:
-                    self.erase_object(gx, gy)
+                self.drag_target = (int(wx) // GRID_SIZE, int(wy) // GRID_SIZE)
 
         if event.type == pygame.MOUSEBUTTONUP:
+            if event.button == 1 and self.marquee_start:
+                self.finish_marquee()
+            if event.button == 1 and self.shape_start:
+                start, self.shape_start = self.shape_start, None
+                self.apply_shape(start, self.mouse_cell())
             if event.button in (1, 3):
+                self.flush_drag()
                 self.drag_draw = False
                 self.drag_erase = False
+                self.end_stroke()
 
         return True
 
     # ---- UPDATE ----
     def update(self):
+        if self.watcher:
+            self.watcher.poll(pygame.time.get_ticks())
+        self.assets.install()
+        self.tick_autosave()
+        self.flush_drag()
+        self.update_fill_preview()
         if self.playtest_mode and self.player:
             section = self.level.current_section()
-            solid = section.get_solid_tiles()
-            npcs = pygame.sprite.Group()
-            for layer in section.layers:
-                if layer.visible:
-                    npcs.add(layer.npcs.sprites())
-            self.player.update(solid, npcs, section.events)
-            for npc in npcs:
-                npc.update(solid, self.player, section.events)
+            self.player.update(section, self.play_npcs, section.events)
+            for npc in self.play_npcs:
+                if npc.alive:
+                    npc.update(section, self.player, section.events)
+            self.play_npcs = [n for n in self.play_npcs if n.alive]
             self.camera.update(self.player)
 
     # ---- DRAW ----
+    def view_rect(self):
+        cam = self.camera.camera
+        return pygame.Rect(int(-cam.x), int(-cam.y),
+                           int(CANVAS_WIDTH/self.camera.zoom) + GRID_SIZE,
+                           int(CANVAS_HEIGHT/self.camera.zoom) + GRID_SIZE)
+
     def draw(self, surf):
         surf.fill(SYS_BTN_FACE)
 
@@ -2170,27 +5101,32 @@ class Editor:
                 if canvas_rect.top < py < canvas_rect.bottom:
                     pygame.draw.line(surf, SMBX_GRID, (canvas_rect.x, py), (canvas_rect.right, py))
 
-        # Sprites
+        # Sprites (only what intersects the view gets an image)
         section = self.level.current_section()
+        ox, oy = self.camera.camera.x + SIDEBAR_WIDTH, self.camera.camera.y + CANVAS_Y
+        view = self.view_rect()
         for layer in section.layers:
             if not layer.visible:
                 continue
             for bgo in layer.bgos:
-                p = bgo.rect.move(self.camera.camera.x + SIDEBAR_WIDTH, self.camera.camera.y + CANVAS_Y)
-                surf.blit(bgo.image, p)
-            for tile in layer.tiles:
-                p = tile.rect.move(self.camera.camera.x + SIDEBAR_WIDTH, self.camera.camera.y + CANVAS_Y)
-                surf.blit(tile.image, p)
+                if view.colliderect(bgo.rect):
+                    surf.blit(bgo.image, bgo.rect.move(ox, oy))
+            layer.tiles.draw(surf, view, ox, oy)
+            if self.playtest_mode:
+                continue
             for npc in layer.npcs:
-                p = npc.rect.move(self.camera.camera.x + SIDEBAR_WIDTH, self.camera.camera.y + CANVAS_Y)
-                surf.blit(npc.image, p)
+                if view.colliderect(npc.rect):
+                    surf.blit(npc.image, npc.rect.move(ox, oy))
+        for npc in self.play_npcs:
+            if view.colliderect(npc.rect):
+                surf.blit(npc.image, npc.rect.move(ox, oy))
+
+        self.draw_fill_preview(surf, view, ox, oy)
+        self.draw_shape_preview(surf, ox, oy)
 
         # Selection outlines
         if not self.playtest_mode:
-            for obj in self.selection:
-                p = obj.rect.move(self.camera.camera.x + SIDEBAR_WIDTH, self.camera.camera.y + CANVAS_Y)
-                pygame.draw.rect(surf, YELLOW, p, 2)
-                pygame.draw.rect(surf, WHITE, p.inflate(2,2), 1)
+            self.draw_selection(surf, view, ox, oy)
 
         # Start position marker
         sp = pygame.Rect(self.level.start_pos[0] + self.camera.camera.x + SIDEBAR_WIDTH,
@@ -2297,12 +5233,84 @@ def main_menu(screen):
         pygame.display.flip()
         clock.tick(60)
 
+# -------------------------
+# MEMORY BENCHMARK (--bench-memory)
+# -------------------------
+def bench_memory(n=20000):
+    import tracemalloc
+
+    class SpriteObject(pygame.sprite.Sprite):
+        # The pre-slots model: a Sprite with a __dict__ per object.
+        def __init__(self, x, y, obj_type):
+            super().__init__()
+            self.rect = pygame.Rect(x, y, GRID_SIZE, GRID_SIZE)
+            self.layer, self.obj_type, self.event_id, self.flags = 0, obj_type, -1, 0
+
+    class SpriteTile(SpriteObject):
+        def __init__(self, x, y):
+            super().__init__(x, y, 'ground')
+            self.tile_type, self.is_solid = 'ground', True
+
+    class SpriteNPC(SpriteObject):
+        def __init__(self, x, y):
+            super().__init__(x, y, 'goomba')
+            self.npc_type, self.direction, self.special_data = 'goomba', 1, 0
+            self.velocity = pygame.Vector2(1, 0)
+            self.state, self.frame = 'normal', 0
+
+    class DictEvent:
+        def __init__(self):
+            self.name, self.trigger, self.actions = "New Event", "auto", []
+
+    # Every row places n objects on the same dense 200-wide block of cells.
+    def per_object(make):
+        tracemalloc.start()
+        keep = [make((i % 200)*GRID_SIZE, (i // 200)*GRID_SIZE) for i in range(n)]
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        return size / len(keep)
+
+    def store_tiles(n):
+        store = TileStore()
+        tracemalloc.start()
+        for i in range(n):
+            store.add_record((i % 200)*GRID_SIZE, (i // 200)*GRID_SIZE, 1)
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        return size / n
+
+    rows = [("Tile", per_object(SpriteTile), per_object(lambda x, y: Tile(x, y, 'ground'))),
+            ("BGO", per_object(lambda x, y: SpriteObject(x, y, 'cloud')),
+                    per_object(lambda x, y: BGO(x, y, 'cloud'))),
+            ("NPC", per_object(SpriteNPC), per_object(lambda x, y: NPC(x, y, 'goomba'))),
+            ("Event", per_object(lambda x, y: DictEvent()), per_object(lambda x, y: Event()))]
+    print(f"bytes per object over {n} objects (Python heap only, excludes Surfaces)")
+    print(f"{'':8}{'before':>10}{'slotted':>10}")
+    for name, before, after in rows:
+        print(f"{name:8}{before:>10.0f}{after:>10.0f}")
+    print(f"{'TileStore slot':<18}{store_tiles(n):>10.0f}")
+
 # -------------------------
 # MAIN
 # -------------------------
+def coalesce_motion(events):
+    # Back-to-back MOUSEMOTION events collapse to the last one; drag painting
+    # interpolates the skipped cells itself.
+    out = []
+    for event in events:
+        if event.type == pygame.MOUSEMOTION and out and out[-1].type == pygame.MOUSEMOTION:
+            out[-1] = event
+        else:
+            out.append(event)
+    return out
+
 def main():
+    if "--bench-memory" in sys.argv:
+        bench_memory()
+        return
     screen = pygame.display.set_mode((WINDOW_WIDTH, WINDOW_HEIGHT))
     clock = pygame.time.Clock()
+    get_asset_loader()      # start decoding while the main menu is up
     while True:
         result = main_menu(screen)
         if result == "QUIT":
@@ -2312,14 +5320,23 @@ def main():
         if result == "LOAD":
             dlg = InputDialog(screen, "Open Level", "Enter filename:", "level.lvl")
             fn = dlg.run()
-            if fn and os.path.exists(fn):
-                level = read_lvl(fn)
+            try:
+                fmt, level = open_level(fn) if fn and os.path.exists(fn) else (None, level)
+            except (LevelFormatError, OSError) as e:
+                MessageBox(screen, "Error", f"Cannot open {fn}:\n{e}").run()
+                fmt = None
+            if fmt != 'lvl':
+                fn = None
         editor = Editor(level, screen)
+        if result == "LOAD" and fn:
+            editor.current_file = fn
+            editor.open_journal(fn)
         running = True
         while running:
-            for event in pygame.event.get():
+            for event in coalesce_motion(pygame.event.get()):
                 res = editor.handle_event(event)
                 if res is False:
+                    editor.writer.wait()
                     pygame.quit()
                     sys.exit()
                 if res == "MENU":
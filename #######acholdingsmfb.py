@@ -1,7 +1,11 @@
 import pygame
 import sys
 import os
+import io
 import json
+import struct
+
+import numpy as np
 
 # Constants
 WINDOW_WIDTH = 1024
@@ -13,6 +17,9 @@ TILE_SIZE = 32
 GRID_WIDTH = 100
 GRID_HEIGHT = 30
 
+LEVEL_FILE = "level.mfc"
+LEGACY_LEVEL_FILES = ("level.rle", "level.json")
+
 # GUI dimensions
 MENU_HEIGHT = 30
 TOOLBAR_WIDTH = 80
@@ -96,26 +103,277 @@ TILE_CATEGORIES = {
 # ----------------------------------------------------------------------
 # Level class
 # ----------------------------------------------------------------------
+# Auto-tiling: a pipe piece takes its corner from which of its N/E/S/W
+# neighbours are pipe too (no pipe above = top, none to the west = left).
+AUTOTILE_N, AUTOTILE_E, AUTOTILE_S, AUTOTILE_W = 1, 2, 4, 8
+PIPE_TILES = np.array([TILE_PIPE_TOP_LEFT, TILE_PIPE_TOP_RIGHT,
+                       TILE_PIPE_BOTTOM_LEFT, TILE_PIPE_BOTTOM_RIGHT], dtype=np.uint8)
+PIPE_LUT = np.array([PIPE_TILES[(2 if m & AUTOTILE_N else 0) + (1 if m & AUTOTILE_W else 0)]
+                     for m in range(16)], dtype=np.uint8)
+
+CHUNK_SIZE = 32
+CHUNK_MAGIC = b'MFBC'
+CHUNK_HEAD = struct.Struct('<4sHIII')   # magic, chunk size, width, height, chunk count
+CHUNK_POS = struct.Struct('<ii')
+RLE_MAGIC = b'MFBR'
+RLE_HEAD = struct.Struct('<4sIII')      # magic, width, height, run count
+NPY_MAGIC = b'\x93NUMPY'
+
 class Level:
+    # Sparse grid: (cx, cy) -> CHUNK_SIZE x CHUNK_SIZE uint8 chunk. Chunks are
+    # allocated on the first non-empty write and dropped once they are empty
+    # again, so coordinates are unbounded in every direction. width/height
+    # only give a new level its initial scroll area.
     def __init__(self, width=GRID_WIDTH, height=GRID_HEIGHT):
         self.width = width
         self.height = height
-        self.tiles = [[TILE_EMPTY for _ in range(width)] for _ in range(height)]
+        self.chunks = {}
+        self._bounds = None         # occupied box, None until (re)scanned
+        self._chunk_bounds = {}     # chunk key -> occupied box inside it
+
+    @staticmethod
+    def from_array(tiles, x=0, y=0):
+        level = Level(tiles.shape[1], tiles.shape[0])
+        level.paste(np.asarray(tiles, dtype=np.uint8), x, y)
+        return level
 
     def get_tile(self, x, y):
-        if 0 <= x < self.width and 0 <= y < self.height:
-            return self.tiles[y][x]
-        return None
+        chunk = self.chunks.get((x // CHUNK_SIZE, y // CHUNK_SIZE))
+        if chunk is None:
+            return TILE_EMPTY
+        return int(chunk[y % CHUNK_SIZE, x % CHUNK_SIZE])
 
     def set_tile(self, x, y, tile_type):
-        if 0 <= x < self.width and 0 <= y < self.height:
-            self.tiles[y][x] = tile_type
+        key = (x // CHUNK_SIZE, y // CHUNK_SIZE)
+        chunk = self.chunks.get(key)
+        if chunk is None:
+            if tile_type == TILE_EMPTY:
+                return
+            chunk = self.chunks[key] = np.zeros((CHUNK_SIZE, CHUNK_SIZE), dtype=np.uint8)
+        erased = tile_type == TILE_EMPTY and chunk[y % CHUNK_SIZE, x % CHUNK_SIZE] != TILE_EMPTY
+        chunk[y % CHUNK_SIZE, x % CHUNK_SIZE] = tile_type
+        if tile_type == TILE_EMPTY and not chunk.any():
+            del self.chunks[key]
+        self._changed(key, None if tile_type == TILE_EMPTY else (x, y, x + 1, y + 1), erased)
+
+    def set_cells(self, xs, ys, tile_type):
+        # Batch set_tile over coordinate arrays: one write per touched chunk.
+        xs, ys = np.asarray(xs), np.asarray(ys)
+        if not xs.size:
+            return
+        keys = np.stack((xs // CHUNK_SIZE, ys // CHUNK_SIZE), axis=1)
+        for cx, cy in np.unique(keys, axis=0).tolist():
+            m = (keys[:, 0] == cx) & (keys[:, 1] == cy)
+            chunk = self.chunks.get((cx, cy))
+            if chunk is None:
+                if tile_type == TILE_EMPTY:
+                    continue
+                chunk = self.chunks[(cx, cy)] = np.zeros((CHUNK_SIZE, CHUNK_SIZE), dtype=np.uint8)
+            rows, cols = ys[m] % CHUNK_SIZE, xs[m] % CHUNK_SIZE
+            erased = tile_type == TILE_EMPTY and bool(chunk[rows, cols].any())
+            chunk[rows, cols] = tile_type
+            if tile_type == TILE_EMPTY and not chunk.any():
+                del self.chunks[(cx, cy)]
+            grown = None
+            if tile_type != TILE_EMPTY:
+                grown = (int(xs[m].min()), int(ys[m].min()), int(xs[m].max()) + 1, int(ys[m].max()) + 1)
+            self._changed((cx, cy), grown, erased)
+
+    def _changed(self, key, grown, erased):
+        # Chunk key was written: grown is the box of non-empty cells written
+        # (None if there were none), erased whether any tile was cleared.
+        # Writes grow the cached box in place; clearing only forces a rescan
+        # when it happens in a chunk holding one of the box's edges, since
+        # no other chunk can move them.
+        self._chunk_bounds.pop(key, None)
+        b = self._bounds
+        if b is None:
+            return
+        if erased:
+            left, top = key[0] * CHUNK_SIZE, key[1] * CHUNK_SIZE
+            if (left <= b[0] < left + CHUNK_SIZE or left < b[2] <= left + CHUNK_SIZE
+                    or top <= b[1] < top + CHUNK_SIZE or top < b[3] <= top + CHUNK_SIZE):
+                self._bounds = None
+                return
+        if grown is not None:
+            self._bounds = (min(b[0], grown[0]), min(b[1], grown[1]),
+                            max(b[2], grown[2]), max(b[3], grown[3]))
+
+    def _chunk_box(self, key, chunk):
+        box = self._chunk_bounds.get(key)
+        if box is None:
+            rows = np.flatnonzero(chunk.any(axis=1))
+            cols = np.flatnonzero(chunk.any(axis=0))
+            left, top = key[0] * CHUNK_SIZE, key[1] * CHUNK_SIZE
+            box = self._chunk_bounds[key] = (left + int(cols[0]), top + int(rows[0]),
+                                             left + int(cols[-1]) + 1, top + int(rows[-1]) + 1)
+        return box
+
+    def bounds(self):
+        # Occupied bounding box (x0, y0, x1, y1), exclusive; None when empty.
+        # A rescan only looks inside the chunks written since their last one.
+        if not self.chunks:
+            self._bounds = None
+            return None
+        if self._bounds is None:
+            boxes = [self._chunk_box(key, chunk) for key, chunk in self.chunks.items()]
+            self._bounds = (min(b[0] for b in boxes), min(b[1] for b in boxes),
+                            max(b[2] for b in boxes), max(b[3] for b in boxes))
+        return self._bounds
+
+    def extent(self):
+        # Occupied box grown to at least the initial width x height area.
+        b = self.bounds()
+        if b is None:
+            return (0, 0, self.width, self.height)
+        return (min(b[0], 0), min(b[1], 0), max(b[2], self.width), max(b[3], self.height))
+
+    # --- Region operations ---
+    def _spans(self, x, y, w, h):
+        # (chunk key, slice into the chunk, slice into a w x h block) per chunk.
+        if w <= 0 or h <= 0:
+            return
+        for cy in range(y // CHUNK_SIZE, (y + h - 1) // CHUNK_SIZE + 1):
+            top = cy * CHUNK_SIZE
+            y0, y1 = max(y, top), min(y + h, top + CHUNK_SIZE)
+            for cx in range(x // CHUNK_SIZE, (x + w - 1) // CHUNK_SIZE + 1):
+                left = cx * CHUNK_SIZE
+                x0, x1 = max(x, left), min(x + w, left + CHUNK_SIZE)
+                yield ((cx, cy), np.s_[y0 - top:y1 - top, x0 - left:x1 - left],
+                       np.s_[y0 - y:y1 - y, x0 - x:x1 - x])
+
+    def _write(self, x, y, w, h, src):
+        # src is a tile type or an h x w block.
+        scalar = np.isscalar(src)
+        for key, cs, bs in self._spans(x, y, w, h):
+            part = src if scalar else src[bs]
+            chunk = self.chunks.get(key)
+            if chunk is None:
+                if not np.any(part):
+                    continue
+                chunk = self.chunks[key] = np.zeros((CHUNK_SIZE, CHUNK_SIZE), dtype=np.uint8)
+            old = chunk[cs]
+            left, top = key[0] * CHUNK_SIZE + cs[1].start, key[1] * CHUNK_SIZE + cs[0].start
+            if scalar:
+                erased = part == TILE_EMPTY and bool(old.any())
+                grown = None if part == TILE_EMPTY else (left, top, left + old.shape[1], top + old.shape[0])
+            else:
+                erased = bool(old[part == TILE_EMPTY].any())
+                rows = np.flatnonzero(part.any(axis=1))
+                cols = np.flatnonzero(part.any(axis=0))
+                grown = None
+                if rows.size:
+                    grown = (left + int(cols[0]), top + int(rows[0]),
+                             left + int(cols[-1]) + 1, top + int(rows[-1]) + 1)
+            chunk[cs] = part
+            if not chunk.any():
+                del self.chunks[key]
+            self._changed(key, grown, erased)
+
+    def read_rect(self, x, y, w, h):
+        block = np.zeros((max(h, 0), max(w, 0)), dtype=np.uint8)
+        for key, cs, bs in self._spans(x, y, w, h):
+            chunk = self.chunks.get(key)
+            if chunk is not None:
+                block[bs] = chunk[cs]
+        return block
+
+    def fill_rect(self, x, y, w, h, tile_type):
+        self._write(x, y, w, h, tile_type)
+
+    def copy_rect(self, x, y, w, h):
+        return self.read_rect(x, y, w, h)
+
+    def paste(self, block, x, y):
+        h, w = block.shape
+        self._write(x, y, w, h, block)
+
+    def flip_rect(self, x, y, w, h, horizontal=True):
+        block = self.read_rect(x, y, w, h)
+        self.paste(block[:, ::-1] if horizontal else block[::-1, :], x, y)
+
+    def replace(self, old, new, rect=None):
+        # Without a rect this covers the occupied bounding box.
+        if rect is None:
+            b = self.bounds()
+            if b is None:
+                return 0
+            rect = (b[0], b[1], b[2] - b[0], b[3] - b[1])
+        block = self.read_rect(*rect)
+        mask = block == old
+        block[mask] = new
+        self.paste(block, rect[0], rect[1])
+        return int(np.count_nonzero(mask))
+
+    def autotile_rect(self, x, y, w, h):
+        # Re-picks the pipe pieces inside the rect in one pass; a one-cell
+        # border is read so cells on the edge see their outside neighbours.
+        block = self.read_rect(x - 1, y - 1, w + 2, h + 2)
+        pipe = np.isin(block, PIPE_TILES).astype(np.uint8)
+        if not pipe[1:-1, 1:-1].any():
+            return 0
+        mask = (pipe[:-2, 1:-1] * AUTOTILE_N | pipe[1:-1, 2:] * AUTOTILE_E
+                | pipe[2:, 1:-1] * AUTOTILE_S | pipe[1:-1, :-2] * AUTOTILE_W)
+        core = block[1:-1, 1:-1]
+        want = np.where(pipe[1:-1, 1:-1] == 1, PIPE_LUT[mask], core)
+        changed = int(np.count_nonzero(want != core))
+        if changed:
+            self.paste(want, x, y)
+        return changed
+
+    # --- File I/O ---
+    def encode_chunks(self):
+        out = [CHUNK_HEAD.pack(CHUNK_MAGIC, CHUNK_SIZE, self.width, self.height, len(self.chunks))]
+        for (cx, cy), chunk in sorted(self.chunks.items()):
+            out.append(CHUNK_POS.pack(cx, cy))
+            out.append(chunk.tobytes())
+        return b''.join(out)
+
+    @staticmethod
+    def decode_chunks(data):
+        magic, size, width, height, count = CHUNK_HEAD.unpack_from(data)
+        record = CHUNK_POS.size + size * size
+        if magic != CHUNK_MAGIC or size == 0 or len(data) != CHUNK_HEAD.size + count * record:
+            raise ValueError("corrupt chunk level")
+        level = Level(width, height)
+        for i in range(count):
+            off = CHUNK_HEAD.size + i * record
+            cx, cy = CHUNK_POS.unpack_from(data, off)
+            chunk = np.frombuffer(data, np.uint8, size * size, off + CHUNK_POS.size)
+            level.paste(chunk.reshape(size, size), cx * size, cy * size)
+        return level
+
+    @staticmethod
+    def decode_rle(data):
+        magic, width, height, runs = RLE_HEAD.unpack_from(data)
+        if magic != RLE_MAGIC or len(data) != RLE_HEAD.size + runs * 5:
+            raise ValueError("corrupt RLE level")
+        lengths = np.frombuffer(data, '<u4', runs, RLE_HEAD.size)
+        values = np.frombuffer(data, np.uint8, runs, RLE_HEAD.size + runs * 4)
+        if int(lengths.sum(dtype=np.uint64)) != width * height:
+            raise ValueError("RLE runs do not cover the level")
+        return Level.from_array(np.repeat(values, lengths).reshape(height, width))
 
     def save(self, filename):
-        data = {'width': self.width, 'height': self.height, 'tiles': self.tiles}
+        # .npy and .json store a dense grid from (0, 0); anything else is
+        # the chunk format, which holds only non-empty chunks.
         try:
-            with open(filename, 'w') as f:
-                json.dump(data, f)
+            ext = os.path.splitext(filename)[1].lower()
+            if ext in ('.npy', '.json'):
+                x0, y0, x1, y1 = self.extent()
+                if x0 < 0 or y0 < 0:
+                    raise ValueError(f"{ext} cannot hold negative coordinates")
+                tiles = self.read_rect(0, 0, x1, y1)
+                if ext == '.npy':
+                    with open(filename, 'wb') as f:
+                        np.save(f, tiles)
+                else:
+                    data = {'width': x1, 'height': y1, 'tiles': tiles.tolist()}
+                    with open(filename, 'w') as f:
+                        json.dump(data, f)
+            else:
+                with open(filename, 'wb') as f:
+                    f.write(self.encode_chunks())
             return True
         except Exception as e:
             print(f"Error saving level: {e}")
@@ -124,15 +382,51 @@ class Level:
     @staticmethod
     def load(filename):
         try:
-            with open(filename, 'r') as f:
-                data = json.load(f)
-            level = Level(data['width'], data['height'])
-            level.tiles = data['tiles']
-            return level
+            with open(filename, 'rb') as f:
+                data = f.read()
+            if data.startswith(CHUNK_MAGIC):
+                return Level.decode_chunks(data)
+            if data.startswith(RLE_MAGIC):
+                return Level.decode_rle(data)
+            if data.startswith(NPY_MAGIC):
+                tiles = np.load(io.BytesIO(data), allow_pickle=False)
+            else:
+                data = json.loads(data)
+                tiles = np.array(data['tiles'], dtype=np.uint8)
+                if tiles.shape != (data['height'], data['width']):
+                    raise ValueError("tile rows do not match width/height")
+            if tiles.ndim != 2:
+                raise ValueError("level grid must be 2D")
+            return Level.from_array(tiles)
         except Exception as e:
             print(f"Error loading level: {e}")
             return None
 
+def line_cells(x0, y0, x1, y1):
+    # Bresenham, both ends included; returns x and y arrays.
+    xs, ys = [], []
+    dx, dy = abs(x1 - x0), -abs(y1 - y0)
+    sx, sy = (1 if x1 >= x0 else -1), (1 if y1 >= y0 else -1)
+    err = dx + dy
+    while True:
+        xs.append(x0)
+        ys.append(y0)
+        if x0 == x1 and y0 == y1:
+            return np.array(xs), np.array(ys)
+        e2 = 2 * err
+        if e2 >= dy:
+            err += dy
+            x0 += sx
+        if e2 <= dx:
+            err += dx
+            y0 += sy
+
+def level_path():
+    # The newest of the chunk save and the older formats, so a level.json
+    # written by mfbconvert after the last save still gets picked up.
+    paths = [p for p in (LEVEL_FILE,) + LEGACY_LEVEL_FILES if os.path.exists(p)]
+    return max(paths, key=os.path.getmtime) if paths else LEVEL_FILE
+
 # ----------------------------------------------------------------------
 # GUI Components
 # ----------------------------------------------------------------------
@@ -333,6 +627,46 @@ class StatusBar:
         text_surf = self.font.render(self.text, True, COLOR_TEXT)
         screen.blit(text_surf, (self.rect.x + 5, self.rect.y + 5))
 
+# ----------------------------------------------------------------------
+# Tile renderer
+# ----------------------------------------------------------------------
+GRID_KEY = (255, 0, 255)
+
+class TileRenderer:
+    # One pixel per cell: the visible window goes through a colour LUT into
+    # a VIEW_WIDTH x VIEW_HEIGHT surface, which is then scaled up by TILE_SIZE.
+    def __init__(self):
+        self.lut = np.full((256, 3), 255, dtype=np.uint8)
+        for tile_type, color in TILE_COLORS.items():
+            self.lut[tile_type] = color
+        self.rgb = np.empty((VIEW_WIDTH, VIEW_HEIGHT, 3), dtype=np.uint8)
+        self.small = pygame.Surface((VIEW_WIDTH, VIEW_HEIGHT))
+        self.scaled = pygame.Surface((VIEW_WIDTH * TILE_SIZE, VIEW_HEIGHT * TILE_SIZE))
+        self.grid = self.build_grid()
+
+    def build_grid(self):
+        w = WINDOW_WIDTH - TOOLBAR_WIDTH - PALETTE_WIDTH
+        h = WINDOW_HEIGHT - MENU_HEIGHT - STATUS_HEIGHT
+        grid = pygame.Surface((w, h))
+        grid.fill(GRID_KEY)
+        grid.set_colorkey(GRID_KEY)
+        for y in range(VIEW_HEIGHT):
+            for x in range(VIEW_WIDTH):
+                pygame.draw.rect(grid, (100,100,100), (x * TILE_SIZE, y * TILE_SIZE, TILE_SIZE, TILE_SIZE), 1)
+        for y in range(VIEW_HEIGHT+1):
+            pygame.draw.line(grid, (80,80,80), (0, y*TILE_SIZE), (w, y*TILE_SIZE), 1)
+        for x in range(VIEW_WIDTH+1):
+            pygame.draw.line(grid, (80,80,80), (x*TILE_SIZE, 0), (x*TILE_SIZE, h), 1)
+        return grid
+
+    def draw(self, screen, level, camera_x, camera_y):
+        view = level.read_rect(camera_x, camera_y, VIEW_WIDTH, VIEW_HEIGHT)
+        self.rgb[...] = self.lut[view.T]
+        pygame.surfarray.blit_array(self.small, self.rgb)
+        pygame.transform.scale(self.small, self.scaled.get_size(), self.scaled)
+        screen.blit(self.scaled, (TOOLBAR_WIDTH, MENU_HEIGHT))
+        screen.blit(self.grid, (TOOLBAR_WIDTH, MENU_HEIGHT))
+
 # ----------------------------------------------------------------------
 # Editor class
 # ----------------------------------------------------------------------
@@ -343,8 +677,10 @@ class Editor:
         self.camera_x = 0
         self.camera_y = 0
         self.dragging = False
-        self.last_mouse_grid = None
+        self.last_mouse_grid = None     # last painted cell of a drag
+        self.drag_target = None         # latest cell under the mouse, painted in update()
         self.tool = "pencil"
+        self.autotile = False
         self.active_dropdown = None
         self.next_action = None
         
@@ -362,6 +698,7 @@ class Editor:
 
         self.status_bar = StatusBar((0, WINDOW_HEIGHT - STATUS_HEIGHT, WINDOW_WIDTH, STATUS_HEIGHT))
         self.font = pygame.font.Font(None, 24)
+        self.renderer = TileRenderer()
 
     def setup_menu(self):
         # Menu structure
@@ -373,7 +710,8 @@ class Editor:
                 ("Quit to Menu", self.cmd_quit)
             ],
             "Edit": [
-                ("Clear Level", self.cmd_clear)
+                ("Clear Level", self.cmd_clear),
+                ("Toggle Auto-Tile", self.cmd_toggle_autotile)
             ],
             "View": [
                 ("Reset Camera", self.cmd_reset_camera)
@@ -411,18 +749,19 @@ class Editor:
         self.status_bar.set_text("New level created")
 
     def cmd_load(self):
-        loaded = Level.load("level.json")
+        path = level_path()
+        loaded = Level.load(path)
         if loaded:
             self.level = loaded
             self.camera_x = 0
             self.camera_y = 0
-            self.status_bar.set_text("Level loaded from level.json")
+            self.status_bar.set_text(f"Level loaded from {path}")
         else:
-            self.status_bar.set_text("Error loading level.json")
+            self.status_bar.set_text(f"Error loading {path}")
 
     def cmd_save(self):
-        if self.level.save("level.json"):
-            self.status_bar.set_text("Level saved to level.json")
+        if self.level.save(LEVEL_FILE):
+            self.status_bar.set_text(f"Level saved to {LEVEL_FILE}")
         else:
             self.status_bar.set_text("Error saving level")
 
@@ -433,6 +772,10 @@ class Editor:
         self.level = Level()
         self.status_bar.set_text("Level cleared")
 
+    def cmd_toggle_autotile(self):
+        self.autotile = not self.autotile
+        self.status_bar.set_text(f"Auto-tile pipes: {'on' if self.autotile else 'off'}")
+
     def cmd_reset_camera(self):
         self.camera_x = 0
         self.camera_y = 0
@@ -480,13 +823,13 @@ class Editor:
             if event.key == pygame.K_ESCAPE:
                 return "MENU"
             elif event.key == pygame.K_LEFT:
-                self.camera_x = max(0, self.camera_x - 1)
+                self.scroll(-1, 0)
             elif event.key == pygame.K_RIGHT:
-                self.camera_x = min(self.level.width - VIEW_WIDTH, self.camera_x + 1)
+                self.scroll(1, 0)
             elif event.key == pygame.K_UP:
-                self.camera_y = max(0, self.camera_y - 1)
+                self.scroll(0, -1)
             elif event.key == pygame.K_DOWN:
-                self.camera_y = min(self.level.height - VIEW_HEIGHT, self.camera_y + 1)
+                self.scroll(0, 1)
             elif event.key == pygame.K_s and pygame.key.get_mods() & pygame.KMOD_CTRL:
                 self.cmd_save()
             elif event.key == pygame.K_l and pygame.key.get_mods() & pygame.KMOD_CTRL:
@@ -501,20 +844,21 @@ class Editor:
                 elif event.button == 3:
                     self.place_tile_at_mouse(event.pos, TILE_EMPTY)
                 elif event.button == 4:
-                    self.camera_y = max(0, self.camera_y - 1)
+                    self.scroll(0, -1)
                 elif event.button == 5:
-                    self.camera_y = min(self.level.height - VIEW_HEIGHT, self.camera_y + 1)
+                    self.scroll(0, 1)
 
         elif event.type == pygame.MOUSEBUTTONUP:
             if event.button == 1:
+                self.flush_drag()
                 self.dragging = False
-                self.last_mouse_grid = None
+                self.last_mouse_grid = self.drag_target = None
 
         elif event.type == pygame.MOUSEMOTION:
             if self.dragging:
                 edit_area = pygame.Rect(TOOLBAR_WIDTH, MENU_HEIGHT, WINDOW_WIDTH - TOOLBAR_WIDTH - PALETTE_WIDTH, WINDOW_HEIGHT - MENU_HEIGHT - STATUS_HEIGHT)
                 if edit_area.collidepoint(event.pos):
-                    self.place_tile_at_mouse(event.pos)
+                    self.drag_target = self.grid_at(event.pos)
 
         mouse_pos = pygame.mouse.get_pos()
         edit_area = pygame.Rect(TOOLBAR_WIDTH, MENU_HEIGHT, WINDOW_WIDTH - TOOLBAR_WIDTH - PALETTE_WIDTH, WINDOW_HEIGHT - MENU_HEIGHT - STATUS_HEIGHT)
@@ -533,40 +877,51 @@ class Editor:
             
         return None
 
+    def scroll(self, dx, dy):
+        # The view may run half a screen past the occupied area so the level
+        # can grow in any direction.
+        x0, y0, x1, y1 = self.level.extent()
+        self.camera_x = max(x0 - VIEW_WIDTH // 2, min(self.camera_x + dx, x1 - VIEW_WIDTH // 2))
+        self.camera_y = max(y0 - VIEW_HEIGHT // 2, min(self.camera_y + dy, y1 - VIEW_HEIGHT // 2))
+
+    def grid_at(self, mouse_pos):
+        return (((mouse_pos[0] - TOOLBAR_WIDTH) // TILE_SIZE) + self.camera_x,
+                ((mouse_pos[1] - MENU_HEIGHT) // TILE_SIZE) + self.camera_y)
+
+    def drag_tile(self):
+        return TILE_EMPTY if self.tool == "eraser" else self.palette.selected_tile
+
     def place_tile_at_mouse(self, mouse_pos, tile_type=None):
         if tile_type is None:
-            if self.tool == "eraser":
-                tile_type = TILE_EMPTY
-            else:
-                tile_type = self.palette.selected_tile
-        grid_x = ((mouse_pos[0] - TOOLBAR_WIDTH) // TILE_SIZE) + self.camera_x
-        grid_y = ((mouse_pos[1] - MENU_HEIGHT) // TILE_SIZE) + self.camera_y
+            tile_type = self.drag_tile()
+        grid_x, grid_y = self.grid_at(mouse_pos)
         if (grid_x, grid_y) != self.last_mouse_grid:
             self.level.set_tile(grid_x, grid_y, tile_type)
+            if self.autotile:
+                self.level.autotile_rect(grid_x - 1, grid_y - 1, 3, 3)
             self.last_mouse_grid = (grid_x, grid_y)
 
+    def flush_drag(self):
+        # Motion events only move drag_target; the line from the last painted
+        # cell to it is written here in one batch, so fast drags leave no gaps.
+        if not self.dragging or self.drag_target is None or self.last_mouse_grid is None:
+            return
+        if self.drag_target != self.last_mouse_grid:
+            xs, ys = line_cells(*self.last_mouse_grid, *self.drag_target)
+            self.level.set_cells(xs[1:], ys[1:], self.drag_tile())
+            if self.autotile:
+                x0, y0 = int(xs.min()), int(ys.min())
+                self.level.autotile_rect(x0 - 1, y0 - 1, int(xs.max()) - x0 + 3, int(ys.max()) - y0 + 3)
+            self.last_mouse_grid = self.drag_target
+
     def update(self):
-        pass
+        self.flush_drag()
 
     def draw(self, screen):
         edit_rect = pygame.Rect(TOOLBAR_WIDTH, MENU_HEIGHT, WINDOW_WIDTH - TOOLBAR_WIDTH - PALETTE_WIDTH, WINDOW_HEIGHT - MENU_HEIGHT - STATUS_HEIGHT)
         screen.fill(COLOR_BG, edit_rect)
 
-        for y in range(VIEW_HEIGHT):
-            for x in range(VIEW_WIDTH):
-                world_x = x + self.camera_x
-                world_y = y + self.camera_y
-                tile = self.level.get_tile(world_x, world_y)
-                if tile is not None:
-                    color = TILE_COLORS.get(tile, (255,255,255))
-                    rect = pygame.Rect(TOOLBAR_WIDTH + x * TILE_SIZE, MENU_HEIGHT + y * TILE_SIZE, TILE_SIZE, TILE_SIZE)
-                    pygame.draw.rect(screen, color, rect)
-                    pygame.draw.rect(screen, (100,100,100), rect, 1)
-
-        for y in range(VIEW_HEIGHT+1):
-            pygame.draw.line(screen, (80,80,80), (TOOLBAR_WIDTH, MENU_HEIGHT + y*TILE_SIZE), (WINDOW_WIDTH - PALETTE_WIDTH, MENU_HEIGHT + y*TILE_SIZE), 1)
-        for x in range(VIEW_WIDTH+1):
-            pygame.draw.line(screen, (80,80,80), (TOOLBAR_WIDTH + x*TILE_SIZE, MENU_HEIGHT), (TOOLBAR_WIDTH + x*TILE_SIZE, WINDOW_HEIGHT - STATUS_HEIGHT), 1)
+        self.renderer.draw(screen, self.level, self.camera_x, self.camera_y)
 
         self.menu_bar.draw(screen)
         self.toolbar.draw(screen)
@@ -650,7 +1005,7 @@ def main_menu(screen):
                     if selected == 0:
                         return ("NEW", None)
                     elif selected == 1:
-                        return ("LOAD", "level.json")
+                        return ("LOAD", level_path())
                     elif selected == 2:
                         return "QUIT"
         clock.tick(30)
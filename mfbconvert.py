@@ -0,0 +1,810 @@
+import sys
+import os
+import json
+import time
+import struct
+import argparse
+from array import array
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# Headless level converter for every Mario Fan Builder variant.
+#
+#   python mfbconvert.py levels/ out/ --to lvl
+#   python mfbconvert.py old.json new.lvl
+#
+# Formats:
+#   lvl      headered SMBX-style .lvl (###########acholdingmmarofanbuilderv0.py)
+#   lvl0     headerless 12-byte-count .lvl (###acfanbuilder0.1.py, ####acfanbuilderhdrv0.py)
+#   layered  sections/layers JSON (######mfb4k.py mfb_level.json, ####smbx.py)
+#   grid     2D tile grid JSON (#######acholdingsmfb.py, ####mfb0.1.1.py Level.save to .json)
+#   mfc      sparse 32x32 chunk grid (the same editors' default level.mfc save)
+#   mfb01    tiles/enemies/coins/powerups JSON (#mfb0.1.py save_level)
+#   export   flat "Export as JSON" dump (###########acholdingmmarofanbuilderv0.py)
+
+# -------------------------
+# CONSTANTS & ID TABLES
+# -------------------------
+GRID_SIZE = 32
+MFB01_GRID_SIZE = 50
+MAX_LAYERS = 100
+
+TILE_SMBX_IDS = {
+    'ground':1, 'grass':2, 'sand':3, 'dirt':4,
+    'brick':45, 'question':34, 'pipe_vertical':112, 'pipe_horizontal':113,
+    'platform':159, 'coin':10, 'bridge':47,
+    'stone':48, 'ice':55, 'mushroom_platform':91, 'pswitch':60,
+    'slope_left':182, 'slope_right':183, 'water':196, 'lava':197,
+    'conveyor_left':188, 'conveyor_right':189, 'semisolid':190,
+}
+BGO_SMBX_IDS  = {'cloud':5, 'bush':6, 'hill':7, 'fence':8, 'bush_3':9, 'tree':10,
+                 'castle':11, 'waterfall':12, 'sign':13, 'fence2':14, 'fence3':15}
+NPC_SMBX_IDS  = {
+    'goomba':1, 'koopa_green':2, 'koopa_red':3, 'paratroopa_green':4,
+    'paratroopa_red':5, 'piranha':6, 'hammer_bro':7, 'lakitu':8,
+    'mushroom':9, 'flower':10, 'star':11, '1up':12,
+    'buzzy':13, 'spiny':14, 'cheep':15, 'blooper':16, 'thwomp':17, 'bowser':18, 'boo':19,
+    'podoboo':20, 'piranha_fire':21, 'sledge_bro':22, 'rotodisc':23,
+    'burner':24, 'cannon':25, 'bullet_bill':26, 'bowser_statue':27,
+    'grinder':28, 'fishbone':29, 'dry_bones':30, 'boo_ring':31,
+    'bomber_bill':32, 'bony_beetle':33, 'skull_platform':34,
+}
+TILE_ID_TO_NAME = {v:k for k,v in TILE_SMBX_IDS.items()}
+BGO_ID_TO_NAME  = {v:k for k,v in BGO_SMBX_IDS.items()}
+NPC_ID_TO_NAME  = {v:k for k,v in NPC_SMBX_IDS.items()}
+
+# Names used by the smaller tools, mapped onto the SMBX vocabulary.
+NAME_ALIASES = {'pipe':'pipe_vertical', 'koopa':'koopa_green', 'fire_flower':'flower'}
+SHORT_NAMES  = {'pipe_vertical':'pipe', 'pipe_horizontal':'pipe', 'koopa_green':'koopa',
+                'koopa_red':'koopa', 'flower':'fire_flower'}
+
+# Grid editor tile ids -> (kind, name). Several grid ids collapse onto one
+# SMBX type; the first entry wins when converting back.
+GRID_TILES = [
+    (1, 'tile', 'ground'), (2, 'tile', 'brick'), (3, 'tile', 'question'),
+    (4, 'tile', 'pipe_vertical'), (5, 'tile', 'pipe_vertical'),
+    (6, 'tile', 'pipe_vertical'), (7, 'tile', 'pipe_vertical'),
+    (8, 'tile', 'coin'), (9, 'npc', 'goomba'), (10, 'npc', 'koopa_green'),
+    (11, 'npc', 'piranha'), (12, 'npc', 'star'), (13, 'npc', 'mushroom'),
+    (14, 'npc', 'flower'), (15, 'tile', 'question'), (16, 'tile', 'question'),
+    (17, 'tile', 'pswitch'), (18, 'tile', 'bridge'), (19, 'bgo', 'cloud'),
+    (20, 'bgo', 'hill'), (21, 'bgo', 'fence'), (22, 'tile', 'water'), (23, 'tile', 'lava'),
+]
+GRID_ID_TO_OBJ = {gid:(kind, name) for gid, kind, name in GRID_TILES}
+OBJ_TO_GRID_ID = {}
+for gid, kind, name in GRID_TILES:
+    OBJ_TO_GRID_ID.setdefault((kind, name), gid)
+
+MFC_MAGIC = b'MFBC'
+MFC_HEAD = struct.Struct('<4sHIII')   # magic, chunk size, width, height, chunk count
+MFC_POS = struct.Struct('<ii')
+MFC_CHUNK = 32
+
+MFB01_TILES = ['ground', 'brick', 'question', 'pipe', 'platform', 'water']
+MFB01_POWERUPS = ['mushroom', 'fire_flower', 'star']
+
+# -------------------------
+# NEUTRAL LEVEL MODEL
+# -------------------------
+class LevelFormatError(ValueError):
+    def __init__(self, message, offset=None, field=None):
+        super().__init__(message if offset is None else f"{message} (at byte {offset})")
+        self.offset = offset
+        self.field = field
+
+class SectionData:
+    def __init__(self, width=100*GRID_SIZE, height=30*GRID_SIZE):
+        self.width = width
+        self.height = height
+        self.bg_color = (92,148,252)
+        self.music = 1
+        self.layers = ["Layer 1"]
+        self.blocks = []   # (x, y, name, layer, event_id, flags)
+        self.bgos = []     # (x, y, name, layer, flags)
+        self.npcs = []     # (x, y, name, layer, event_id, flags, direction, special)
+        self.events = []   # event names
+        self.num_warps = 0
+
+    def ensure_layer(self, li):
+        if not 0 <= li < MAX_LAYERS:
+            raise LevelFormatError(f"layer index {li} outside 0..{MAX_LAYERS-1}", field='layer')
+        while len(self.layers) <= li:
+            self.layers.append(f"Layer {len(self.layers)+1}")
+
+    def object_count(self):
+        return len(self.blocks) + len(self.bgos) + len(self.npcs)
+
+class LevelData:
+    def __init__(self):
+        self.name = "Untitled"
+        self.author = "Unknown"
+        self.time_limit = 300
+        self.stars = 0
+        self.no_background = False
+        self.theme = None
+        self.sections = [SectionData()]
+
+    def object_count(self):
+        return sum(s.object_count() for s in self.sections)
+
+def canonical(name):
+    return NAME_ALIASES.get(name, name)
+
+def _u32(v):
+    return v & 0xFFFFFFFF
+
+def _int(v, field):
+    # JSON numbers become coordinates and ids packed as 32-bit ints: whole
+    # values only (32.0 passes, 1.5 / "32" / true don't).
+    if isinstance(v, bool) or not isinstance(v, (int, float)):
+        raise LevelFormatError(f"{field} must be a number, got {v!r}", field=field)
+    if v != v or v in (float('inf'), float('-inf')) or v != int(v):
+        raise LevelFormatError(f"{field} must be a whole number, got {v!r}", field=field)
+    if not -2**31 <= v < 2**31:
+        raise LevelFormatError(f"{field} {v!r} does not fit in 32 bits", field=field)
+    return int(v)
+
+def _text(v, field):
+    if not isinstance(v, str):
+        raise LevelFormatError(f"{field} must be a string, got {v!r}", field=field)
+    return v
+
+# -------------------------
+# DECODERS (bytes -> LevelData)
+# -------------------------
+class LvlReader:
+    """Bounds-checked cursor over .lvl bytes.
+
+    Every count is checked against the bytes left before anything is
+    decoded, so a corrupt count fails at once instead of looping or
+    allocating, and record tables come back as exactly sized arrays.
+    """
+    HEADER_SIZE = 128
+    SECTION_MIN = 16 + 5*4      # section header + five empty counts
+    EVENT_MIN = 1 + 8
+
+    def __init__(self, data):
+        self.data = data
+        self.size = len(data)
+        self.pos = 0
+        if data[:4] != b'LVL\x1a':
+            raise LevelFormatError("missing LVL magic", 0, 'magic')
+        if self.size < self.HEADER_SIZE + 4:
+            raise LevelFormatError("file shorter than the .lvl header", self.size, 'header')
+
+    def unpack(self, fmt, field):
+        st = struct.Struct(fmt)
+        if self.pos + st.size > self.size:
+            raise LevelFormatError(f"truncated {field}", self.pos, field)
+        vals = st.unpack_from(self.data, self.pos)
+        self.pos += st.size
+        return vals
+
+    def count(self, rec_size, field):
+        (n,) = self.unpack('<I', f"{field} count")
+        if n * rec_size > self.size - self.pos:
+            raise LevelFormatError(f"{field} count {n} needs {n*rec_size} bytes, "
+                                   f"only {self.size-self.pos} left", self.pos - 4, field)
+        return n
+
+    def check_layer(self, li, offset, field):
+        if not 0 <= li < MAX_LAYERS:
+            raise LevelFormatError(f"{field} layer index {li} outside 0..{MAX_LAYERS-1}", offset, field)
+
+    def table(self, n, width, field):
+        # n has already been checked by count(), so the slice is exact.
+        t = array('i')
+        t.frombytes(self.data[self.pos:self.pos+4*width*n])
+        if sys.byteorder != 'little':
+            t.byteswap()
+        layers = t[3::width]
+        if layers and not (0 <= min(layers) and max(layers) < MAX_LAYERS):
+            i = next(i for i, li in enumerate(layers) if not 0 <= li < MAX_LAYERS)
+            self.check_layer(layers[i], self.pos + 4*(i*width + 3), field)
+        self.pos += 4*width*n
+        return t
+
+    def raw(self, n, field):
+        if self.pos + n > self.size:
+            raise LevelFormatError(f"truncated {field}", self.pos, field)
+        b = self.data[self.pos:self.pos+n]
+        self.pos += n
+        return b
+
+    def header(self, level):
+        d = self.data
+        level.name = d[8:40].split(b'\x00')[0].decode('utf-8', errors='ignore')
+        level.author = d[40:72].split(b'\x00')[0].decode('utf-8', errors='ignore')
+        level.time_limit, level.stars, flags = struct.unpack_from('<III', d, 72)
+        level.no_background = bool(flags & 1)
+        self.pos = self.HEADER_SIZE
+        return self.count(self.SECTION_MIN, 'section')
+
+    def events(self):
+        out = []
+        for _ in range(self.count(self.EVENT_MIN, 'event')):
+            (ln,) = self.unpack('<B', 'event name')
+            name = self.raw(ln, 'event name').decode('utf-8', errors='ignore')
+            (trigger,) = self.unpack('<I', 'event trigger')
+            self.raw(12*self.count(12, 'event action'), 'event action')
+            out.append((name, trigger))
+        return out
+
+def decode_lvl(data):
+    r = LvlReader(data)
+    level = LevelData()
+    level.sections = []
+    for _ in range(r.header(level)):
+        sec = SectionData()
+        sec.width, sec.height, cr, cg, cb, sec.music = r.unpack('<IIBBBxI', 'section header')
+        sec.bg_color = (cr, cg, cb)
+        n = r.count(24, 'block')
+        base = r.pos
+        for i, (x, y, tid, li, ev, fl) in enumerate(struct.iter_unpack('<iiiiii', r.raw(24*n, 'block'))):
+            r.check_layer(li, base + 24*i + 12, 'block')
+            if tid in TILE_ID_TO_NAME:
+                sec.ensure_layer(li)
+                sec.blocks.append((x, y, TILE_ID_TO_NAME[tid], li, ev, fl))
+        n = r.count(20, 'bgo')
+        base = r.pos
+        for i, (x, y, tid, li, fl) in enumerate(struct.iter_unpack('<iiiii', r.raw(20*n, 'bgo'))):
+            r.check_layer(li, base + 20*i + 12, 'bgo')
+            if tid in BGO_ID_TO_NAME:
+                sec.ensure_layer(li)
+                sec.bgos.append((x, y, BGO_ID_TO_NAME[tid], li, fl))
+        n = r.count(32, 'npc')
+        base = r.pos
+        for i, (x, y, tid, li, ev, fl, d, sp) in enumerate(struct.iter_unpack('<iiiiiiii', r.raw(32*n, 'npc'))):
+            r.check_layer(li, base + 32*i + 12, 'npc')
+            if tid in NPC_ID_TO_NAME:
+                sec.ensure_layer(li)
+                sec.npcs.append((x, y, NPC_ID_TO_NAME[tid], li, ev, fl, 1 if d else -1, sp))
+        sec.num_warps = r.count(64, 'warp')
+        r.raw(64*sec.num_warps, 'warp')
+        sec.events = [name for name, trigger in r.events()]
+        level.sections.append(sec)
+    return level
+
+def decode_lvl_bulk(data):
+    # Same layout as decode_lvl, but each record table is read with a single
+    # array.frombytes and walked column-wise instead of one struct per record.
+    r = LvlReader(data)
+    level = LevelData()
+    level.sections = []
+    for _ in range(r.header(level)):
+        sec = SectionData()
+        sec.width, sec.height, cr, cg, cb, sec.music = r.unpack('<IIBBBxI', 'section header')
+        sec.bg_color = (cr, cg, cb)
+        t = r.table(r.count(24, 'block'), 6, 'block')
+        names = TILE_ID_TO_NAME
+        sec.blocks = [(x, y, names[tid], li, ev, fl) for x, y, tid, li, ev, fl
+                      in zip(t[0::6], t[1::6], t[2::6], t[3::6], t[4::6], t[5::6]) if tid in names]
+        top = max(t[3::6], default=0)
+        t = r.table(r.count(20, 'bgo'), 5, 'bgo')
+        names = BGO_ID_TO_NAME
+        sec.bgos = [(x, y, names[tid], li, fl) for x, y, tid, li, fl
+                    in zip(t[0::5], t[1::5], t[2::5], t[3::5], t[4::5]) if tid in names]
+        top = max(top, max(t[3::5], default=0))
+        t = r.table(r.count(32, 'npc'), 8, 'npc')
+        names = NPC_ID_TO_NAME
+        sec.npcs = [(x, y, names[tid], li, ev, fl, 1 if d else -1, sp) for x, y, tid, li, ev, fl, d, sp
+                    in zip(t[0::8], t[1::8], t[2::8], t[3::8], t[4::8], t[5::8], t[6::8], t[7::8])
+                    if tid in names]
+        sec.ensure_layer(max(top, max(t[3::8], default=0)))
+        sec.num_warps = r.count(64, 'warp')
+        r.raw(64*sec.num_warps, 'warp')
+        sec.events = [name for name, trigger in r.events()]
+        level.sections.append(sec)
+    return level
+
+def decode_lvl0(data):
+    if len(data) < 12:
+        raise LevelFormatError("file shorter than the count header")
+    nb, ng, nn = struct.unpack_from('<III', data)
+    if 12 + 20*(nb+ng+nn) != len(data):
+        raise LevelFormatError("record counts do not match the file size")
+    level = LevelData()
+    sec = level.sections[0]
+    recs = struct.iter_unpack('<IIIIi', data[12:])
+    for i, (x, y, sid, li, ev) in enumerate(recs):
+        if i < nb:
+            if sid in TILE_ID_TO_NAME:
+                sec.ensure_layer(li); sec.blocks.append((x, y, TILE_ID_TO_NAME[sid], li, ev, 0))
+        elif i < nb+ng:
+            if sid in BGO_ID_TO_NAME:
+                sec.ensure_layer(li); sec.bgos.append((x, y, BGO_ID_TO_NAME[sid], li, 0))
+        elif sid in NPC_ID_TO_NAME:
+            sec.ensure_layer(li); sec.npcs.append((x, y, NPC_ID_TO_NAME[sid], li, ev, 0, 1, 0))
+    return level
+
+def _load_json(data):
+    try:
+        return json.loads(data.decode('utf-8'))
+    except (UnicodeDecodeError, ValueError) as e:
+        raise LevelFormatError(f"bad JSON: {e}")
+
+def decode_layered(data):
+    doc = _load_json(data)
+    try:
+        level = LevelData()
+        level.theme = doc.get("theme")
+        level.sections = []
+        for sd in doc["sections"]:
+            sec = SectionData()
+            sec.layers = []
+            for li, ld in enumerate(sd["layers"]):
+                sec.layers.append(_text(ld.get("name", f"Layer {li+1}"), 'layer name'))
+                for td in ld.get("tiles", []):
+                    x, y, name = _int(td["x"], 'x'), _int(td["y"], 'y'), canonical(_text(td["type"], 'type'))
+                    if name in NPC_SMBX_IDS:
+                        sec.npcs.append((x, y, name, li, -1, 0, 1, 0))
+                    else:
+                        sec.blocks.append((x, y, name, li, -1, 0))
+                for nd in ld.get("npcs", []):
+                    sec.npcs.append((_int(nd["x"], 'x'), _int(nd["y"], 'y'), canonical(_text(nd["type"], 'type')),
+                                     li, -1, 0, 1, 0))
+            if not sec.layers:
+                sec.layers = ["Layer 1"]
+            level.sections.append(sec)
+    except (KeyError, TypeError, AttributeError) as e:
+        raise LevelFormatError(f"unexpected layered JSON shape: {e!r}")
+    return level
+
+def _place_grid(sec, tid, gx, gy):
+    kind, name = GRID_ID_TO_OBJ[tid]
+    x, y = gx*GRID_SIZE, gy*GRID_SIZE
+    if kind == 'tile':
+        sec.blocks.append((x, y, name, 0, -1, 0))
+    elif kind == 'bgo':
+        sec.bgos.append((x, y, name, 0, 0))
+    else:
+        sec.npcs.append((x, y, name, 0, -1, 0, 1, 0))
+
+def decode_grid(data):
+    doc = _load_json(data)
+    try:
+        w, h, rows = _int(doc["width"], 'width'), _int(doc["height"], 'height'), doc["tiles"]
+        if w < 0 or h < 0:
+            raise LevelFormatError(f"negative grid size {w}x{h}", field='width')
+        level = LevelData()
+        sec = level.sections[0]
+        sec.width, sec.height = w*GRID_SIZE, h*GRID_SIZE
+        for gy, row in enumerate(rows):
+            for gx, tid in enumerate(row):
+                if isinstance(tid, int) and tid in GRID_ID_TO_OBJ:
+                    _place_grid(sec, tid, gx, gy)
+    except LevelFormatError:
+        raise
+    except (KeyError, TypeError, ValueError) as e:
+        raise LevelFormatError(f"unexpected grid JSON shape: {e!r}")
+    return level
+
+def decode_mfc(data):
+    if len(data) < MFC_HEAD.size:
+        raise LevelFormatError("truncated chunk header", offset=len(data))
+    magic, size, w, h, count = MFC_HEAD.unpack_from(data)
+    record = MFC_POS.size + size*size
+    if magic != MFC_MAGIC or size == 0:
+        raise LevelFormatError("bad chunk header", offset=0)
+    if len(data) != MFC_HEAD.size + count*record:
+        raise LevelFormatError(f"{count} chunks of {size}x{size} do not fill {len(data)} bytes", field='count')
+    level = LevelData()
+    sec = level.sections[0]
+    sec.width, sec.height = w*GRID_SIZE, h*GRID_SIZE
+    for off in range(MFC_HEAD.size, len(data), record):
+        cx, cy = MFC_POS.unpack_from(data, off)
+        cells = data[off + MFC_POS.size:off + record]
+        for i, tid in enumerate(cells):
+            if tid in GRID_ID_TO_OBJ:
+                _place_grid(sec, tid, cx*size + i % size, cy*size + i // size)
+    return level
+
+def decode_mfb01(data):
+    doc = _load_json(data)
+    def px(v):
+        return _int(v, 'coordinate') * GRID_SIZE // MFB01_GRID_SIZE
+    try:
+        level = LevelData()
+        level.theme = doc.get("theme")
+        sec = level.sections[0]
+        for td in doc["tiles"]:
+            sec.blocks.append((px(td["x"]), px(td["y"]), canonical(_text(td["type"], 'type')), 0, -1, 0))
+        for ed in doc.get("enemies", []):
+            sec.npcs.append((px(ed["x"]), px(ed["y"]), canonical(_text(ed.get("enemy_type", "goomba"), 'enemy_type')),
+                             0, -1, 0, 1, 0))
+        for cd in doc.get("coins", []):
+            sec.blocks.append((px(cd["x"]), px(cd["y"]), 'coin', 0, -1, 0))
+        for pd in doc.get("powerups", []):
+            sec.npcs.append((px(pd["x"]), px(pd["y"]), canonical(_text(pd.get("powerup_type", "mushroom"), 'powerup_type')),
+                             0, -1, 0, 1, 0))
+    except LevelFormatError:
+        raise
+    except (KeyError, TypeError, ValueError) as e:
+        raise LevelFormatError(f"unexpected mfb0.1 JSON shape: {e!r}")
+    return level
+
+def decode_export(data):
+    doc = _load_json(data)
+    try:
+        level = LevelData()
+        level.name = _text(doc.get("name", level.name), 'name')
+        level.author = _text(doc.get("author", level.author), 'author')
+        sec = level.sections[0]
+
+        def place(od):
+            li = _int(od.get("layer", 0), 'layer')
+            sec.ensure_layer(li)
+            return _int(od["x"], 'x'), _int(od["y"], 'y'), _text(od["type"], 'type'), li
+
+        for td in doc["tiles"]:
+            sec.blocks.append(place(td) + (-1, 0))
+        for bd in doc.get("bgos", []):
+            sec.bgos.append(place(bd) + (0,))
+        for nd in doc.get("npcs", []):
+            sec.npcs.append(place(nd) + (-1, 0, 1, 0))
+    except LevelFormatError:
+        raise
+    except (KeyError, TypeError, ValueError) as e:
+        raise LevelFormatError(f"unexpected export JSON shape: {e!r}")
+    return level
+
+# -------------------------
+# ENCODERS (LevelData -> bytes)
+# -------------------------
+def encode_lvl(level):
+    out = [b'LVL\x1a', struct.pack('<I', 1)]
+    out.append((level.name.encode('utf-8')[:31] + b'\x00').ljust(32, b'\x00'))
+    out.append((level.author.encode('utf-8')[:31] + b'\x00').ljust(32, b'\x00'))
+    out.append(struct.pack('<III', level.time_limit, level.stars, 1 if level.no_background else 0))
+    out = [b''.join(out).ljust(128, b'\x00'), struct.pack('<I', len(level.sections))]
+    for sec in level.sections:
+        out.append(struct.pack('<IIBBBxI', sec.width, sec.height, *sec.bg_color[:3], sec.music))
+        out.append(struct.pack('<I', len(sec.blocks)))
+        out += [struct.pack('<IIIIII', _u32(x), _u32(y), TILE_SMBX_IDS.get(n, 1), li, _u32(ev), _u32(fl))
+                for x, y, n, li, ev, fl in sec.blocks]
+        out.append(struct.pack('<I', len(sec.bgos)))
+        out += [struct.pack('<IIIII', _u32(x), _u32(y), BGO_SMBX_IDS.get(n, 5), li, _u32(fl))
+                for x, y, n, li, fl in sec.bgos]
+        out.append(struct.pack('<I', len(sec.npcs)))
+        out += [struct.pack('<IIIIIIII', _u32(x), _u32(y), NPC_SMBX_IDS.get(n, 1), li, _u32(ev), _u32(fl),
+                            1 if d > 0 else 0, _u32(sp))
+                for x, y, n, li, ev, fl, d, sp in sec.npcs]
+        out.append(struct.pack('<I', sec.num_warps) + b'\x00' * (64*sec.num_warps))
+        out.append(struct.pack('<I', len(sec.events)))
+        for ev_name in sec.events:
+            nb = ev_name.encode('utf-8')[:255]
+            out.append(struct.pack('<B', len(nb)) + nb + struct.pack('<II', 0, 0))
+    return b''.join(out)
+
+def encode_lvl0(level):
+    sec = level.sections[0]
+    out = [struct.pack('<III', len(sec.blocks), len(sec.bgos), len(sec.npcs))]
+    out += [struct.pack('<IIIIi', _u32(x), _u32(y), TILE_SMBX_IDS.get(n, 1), li, 0)
+            for x, y, n, li, ev, fl in sec.blocks]
+    out += [struct.pack('<IIIIi', _u32(x), _u32(y), BGO_SMBX_IDS.get(n, 5), li, 0)
+            for x, y, n, li, fl in sec.bgos]
+    out += [struct.pack('<IIIIi', _u32(x), _u32(y), NPC_SMBX_IDS.get(n, 1), li, 0)
+            for x, y, n, li, ev, fl, d, sp in sec.npcs]
+    return b''.join(out)
+
+def encode_layered(level):
+    doc = {"sections": [], "theme": level.theme or "SMB1"}
+    for sec in level.sections:
+        layers = [{"name": name, "tiles": [], "npcs": []} for name in sec.layers]
+        for x, y, n, li, ev, fl in sec.blocks:
+            layers[li]["tiles"].append({"x": x, "y": y, "type": SHORT_NAMES.get(n, n)})
+        for x, y, n, li, ev, fl, d, sp in sec.npcs:
+            layers[li]["npcs"].append({"x": x, "y": y, "type": SHORT_NAMES.get(n, n)})
+        doc["sections"].append({"layers": layers})
+    return json.dumps(doc).encode('utf-8')
+
+def _grid_cells(sec):
+    # (x, y, grid id) per object; later objects win a shared cell.
+    cells = []
+    for x, y, n, *_ in sec.blocks:
+        cells.append((x, y, OBJ_TO_GRID_ID.get(('tile', n), 1)))
+    for x, y, n, *_ in sec.bgos:
+        if ('bgo', n) in OBJ_TO_GRID_ID:
+            cells.append((x, y, OBJ_TO_GRID_ID[('bgo', n)]))
+    for x, y, n, *_ in sec.npcs:
+        if ('npc', n) in OBJ_TO_GRID_ID:
+            cells.append((x, y, OBJ_TO_GRID_ID[('npc', n)]))
+    return cells
+
+def encode_grid(level):
+    sec = level.sections[0]
+    cells = _grid_cells(sec)
+    w = max([1, sec.width // GRID_SIZE] + [x // GRID_SIZE + 1 for x, _, _ in cells])
+    h = max([1, sec.height // GRID_SIZE] + [y // GRID_SIZE + 1 for _, y, _ in cells])
+    rows = [[0]*w for _ in range(h)]
+    for x, y, gid in cells:
+        if x >= 0 and y >= 0:
+            rows[y // GRID_SIZE][x // GRID_SIZE] = gid
+    return json.dumps({'width': w, 'height': h, 'tiles': rows}).encode('utf-8')
+
+def encode_mfc(level):
+    sec = level.sections[0]
+    chunks = {}
+    for x, y, gid in _grid_cells(sec):
+        gx, gy = x // GRID_SIZE, y // GRID_SIZE
+        key = (gx // MFC_CHUNK, gy // MFC_CHUNK)
+        chunk = chunks.get(key)
+        if chunk is None:
+            chunk = chunks[key] = bytearray(MFC_CHUNK*MFC_CHUNK)
+        chunk[gy % MFC_CHUNK * MFC_CHUNK + gx % MFC_CHUNK] = gid
+    out = [MFC_HEAD.pack(MFC_MAGIC, MFC_CHUNK, max(0, sec.width // GRID_SIZE),
+                         max(0, sec.height // GRID_SIZE), len(chunks))]
+    for key in sorted(chunks):
+        out.append(MFC_POS.pack(*key))
+        out.append(bytes(chunks[key]))
+    return b''.join(out)
+
+def encode_mfb01(level):
+    sec = level.sections[0]
+    def px(v):
+        return v * MFB01_GRID_SIZE // GRID_SIZE
+    doc = {"tiles": [], "enemies": [], "coins": [], "powerups": [], "theme": level.theme or "Mario Fan Builder Default"}
+    for x, y, n, *_ in sec.blocks:
+        short = SHORT_NAMES.get(n, n)
+        if n == 'coin':
+            doc["coins"].append({"x": px(x), "y": px(y), "value": 1})
+        else:
+            doc["tiles"].append({"x": px(x), "y": px(y), "type": short if short in MFB01_TILES else 'ground',
+                                 "contains_item": None})
+    for x, y, n, *_ in sec.npcs:
+        short = SHORT_NAMES.get(n, n)
+        if short in MFB01_POWERUPS:
+            doc["powerups"].append({"x": px(x), "y": px(y), "powerup_type": short})
+        else:
+            doc["enemies"].append({"x": px(x), "y": px(y), "enemy_type": short})
+    return json.dumps(doc, indent=4).encode('utf-8')
+
+def encode_export(level):
+    sec = level.sections[0]
+    doc = {"name": level.name, "author": level.author,
+           "tiles": [{"x": x, "y": y, "type": n, "layer": li} for x, y, n, li, *_ in sec.blocks],
+           "bgos":  [{"x": x, "y": y, "type": n, "layer": li} for x, y, n, li, *_ in sec.bgos],
+           "npcs":  [{"x": x, "y": y, "type": n, "layer": li} for x, y, n, li, *_ in sec.npcs]}
+    return json.dumps(doc, indent=2).encode('utf-8')
+
+# -------------------------
+# LOSSES (what an encoder can't represent)
+# -------------------------
+# Each returns {what: count} for objects an encoder drops, moves or
+# rewrites, so a batch run can say so instead of quietly losing them.
+def _other_sections(level):
+    return sum(s.object_count() for s in level.sections[1:])
+
+def losses_lvl0(level):
+    return {'objects in other sections': _other_sections(level)}
+
+def losses_layered(level):
+    return {'BGOs': sum(len(s.bgos) for s in level.sections)}
+
+def _grid_losses(level, negative):
+    sec = level.sections[0]
+    objs = ([('tile', o) for o in sec.blocks] + [('bgo', o) for o in sec.bgos]
+            + [('npc', o) for o in sec.npcs])
+    cells = _grid_cells(sec)
+    out = {'objects in other sections': _other_sections(level),
+           'objects with no grid id': sum((kind, o[2]) not in OBJ_TO_GRID_ID for kind, o in objs),
+           'off-grid objects snapped to a cell': sum(bool(o[0] % GRID_SIZE or o[1] % GRID_SIZE)
+                                                     for _, o in objs),
+           'objects sharing a cell': len(cells) - len({(x // GRID_SIZE, y // GRID_SIZE) for x, y, _ in cells})}
+    if negative:
+        out['objects at negative coordinates'] = sum(x < 0 or y < 0 for x, y, _ in cells)
+    return out
+
+def losses_grid(level):
+    return _grid_losses(level, True)
+
+def losses_mfc(level):
+    return _grid_losses(level, False)
+
+def losses_mfb01(level):
+    return {'objects in other sections': _other_sections(level),
+            'BGOs': len(level.sections[0].bgos)}
+
+def losses_export(level):
+    return {'objects in other sections': _other_sections(level)}
+
+# -------------------------
+# FORMAT REGISTRY
+# -------------------------
+# Every format sniffs the first SNIFF_BYTES of a file (plus its total size)
+# and carries a relative decode cost. When several formats accept the same
+# bytes the cheapest is tried first and the next only if it rejects the data,
+# so v1 .lvl files go through the bulk array path and fall back to struct.
+SNIFF_BYTES = 512
+
+class LevelFormat:
+    def __init__(self, name, sniff, decode, encode=None, ext='.json', cost=1.0, losses=None):
+        self.name = name
+        self.sniff = sniff
+        self.decode = decode
+        self.encode = encode
+        self.ext = ext
+        self.cost = cost
+        self.losses = losses
+
+FORMATS = []
+
+def register_format(fmt):
+    FORMATS.append(fmt)
+    FORMATS.sort(key=lambda f: f.cost)
+    return fmt
+
+def _json_head(head):
+    head = head.lstrip()
+    if head[:3] == b'\xef\xbb\xbf':
+        head = head[3:].lstrip()
+    return head if head[:1] == b'{' else None
+
+def sniff_lvl(head, size):
+    return head[:4] == b'LVL\x1a'
+
+def sniff_lvl0(head, size):
+    if size < 12 or head[:4] == b'LVL\x1a':
+        return False
+    nb, ng, nn = struct.unpack_from('<III', head)
+    return 12 + 20*(nb+ng+nn) == size
+
+def sniff_layered(head, size):
+    j = _json_head(head)
+    return j is not None and b'"sections"' in j
+
+def sniff_grid(head, size):
+    j = _json_head(head)
+    return j is not None and b'"width"' in j and b'"tiles"' in j
+
+def sniff_mfc(head, size):
+    return head[:4] == MFC_MAGIC
+
+def sniff_export(head, size):
+    j = _json_head(head)
+    return j is not None and b'"name"' in j and b'"author"' in j
+
+def sniff_mfb01(head, size):
+    j = _json_head(head)
+    return j is not None and b'"tiles"' in j
+
+register_format(LevelFormat('lvl',        sniff_lvl,     decode_lvl_bulk, encode_lvl,     '.lvl', cost=1.0))
+register_format(LevelFormat('lvl0',       sniff_lvl0,    decode_lvl0,     encode_lvl0,    '.lvl', cost=2.0,
+                            losses=losses_lvl0))
+register_format(LevelFormat('lvl-stream', sniff_lvl,     decode_lvl,      None,           '.lvl', cost=3.0))
+register_format(LevelFormat('layered',    sniff_layered, decode_layered,  encode_layered, cost=4.0,
+                            losses=losses_layered))
+register_format(LevelFormat('grid',       sniff_grid,    decode_grid,     encode_grid,    cost=5.0,
+                            losses=losses_grid))
+register_format(LevelFormat('mfc',        sniff_mfc,     decode_mfc,      encode_mfc,     '.mfc', cost=5.5,
+                            losses=losses_mfc))
+register_format(LevelFormat('export',     sniff_export,  decode_export,   encode_export,  cost=6.0,
+                            losses=losses_export))
+register_format(LevelFormat('mfb01',      sniff_mfb01,   decode_mfb01,    encode_mfb01,   cost=7.0,
+                            losses=losses_mfb01))
+
+def get_format(name):
+    for fmt in FORMATS:
+        if fmt.name == name:
+            return fmt
+    raise LevelFormatError(f"unknown format {name!r}")
+
+def sniff_formats(head, size):
+    return [f for f in FORMATS if f.sniff(head, size)]
+
+def decode_level(data, fmt=None):
+    """Decode with the cheapest format that accepts the bytes; returns (format name, LevelData)."""
+    candidates = [get_format(fmt)] if fmt else sniff_formats(data[:SNIFF_BYTES], len(data))
+    if not candidates:
+        raise LevelFormatError("unrecognised level format")
+    error = None
+    for cand in candidates:
+        try:
+            return cand.name, cand.decode(data)
+        except LevelFormatError as e:
+            error = error or e
+    raise error
+
+def load_level_file(path, fmt=None):
+    """Read any editor's level file; raises LevelFormatError rather than returning an empty level."""
+    with open(path, 'rb') as f:
+        data = f.read()
+    name, level = decode_level(data, fmt)
+    return name, level, len(data)
+
+# -------------------------
+# BATCH CONVERSION
+# -------------------------
+def convert_file(src, dst, to_fmt, from_fmt=None):
+    """Convert one file; runs inside a worker process and never raises.
+
+    Anything going wrong with one file, even a bug in a codec, is reported
+    in its result so the rest of the batch still converts. 'lost' counts
+    what the target format couldn't represent.
+    """
+    t0 = time.perf_counter()
+    result = {'src': src, 'dst': dst, 'from': from_fmt, 'to': to_fmt,
+              'bytes_in': 0, 'bytes_out': 0, 'objects': 0, 'seconds': 0.0, 'error': None, 'lost': {}}
+    try:
+        fmt, level, size = load_level_file(src, from_fmt)
+        result['from'], result['bytes_in'], result['objects'] = fmt, size, level.object_count()
+        target = get_format(to_fmt)
+        if target.losses:
+            result['lost'] = {k: n for k, n in target.losses(level).items() if n}
+        data = target.encode(level)
+        d = os.path.dirname(dst)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        with open(dst, 'wb') as f:
+            f.write(data)
+        result['bytes_out'] = len(data)
+    except Exception as e:
+        result['error'] = f"{type(e).__name__}: {e}"
+    result['seconds'] = time.perf_counter() - t0
+    return result
+
+def plan_jobs(src, dst, to_fmt):
+    ext = get_format(to_fmt).ext
+    if os.path.isfile(src):
+        if os.path.isdir(dst):
+            dst = os.path.join(dst, os.path.splitext(os.path.basename(src))[0] + ext)
+        return [(src, dst)]
+    jobs = []
+    for root, dirs, files in os.walk(src):
+        dirs.sort()
+        for fn in sorted(files):
+            if os.path.splitext(fn)[1].lower() not in ('.lvl', '.json', '.mfc'):
+                continue
+            path = os.path.join(root, fn)
+            rel = os.path.relpath(path, src)
+            jobs.append((path, os.path.join(dst, os.path.splitext(rel)[0] + ext)))
+    return jobs
+
+def report_line(r):
+    if r['error']:
+        return f"FAIL  {r['src']}: {r['error']}"
+    rate = r['bytes_in'] / r['seconds'] / 1e6 if r['seconds'] > 0 else 0.0
+    line = (f"{'lossy' if r['lost'] else 'ok':<5} {r['from']:>7} -> {r['to']:<7} {r['objects']:>8} obj "
+            f"{r['bytes_in']/1024:>9.1f} KB {r['seconds']*1000:>8.1f} ms {rate:>7.2f} MB/s  {r['src']}")
+    if r['lost']:
+        line += "\n      lost: " + ", ".join(f"{n} {what}" for what, n in r['lost'].items())
+    return line
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Convert Mario Fan Builder levels between formats.")
+    ap.add_argument("src", help="level file or directory tree")
+    ap.add_argument("dst", help="output file or directory")
+    ap.add_argument("--to", dest="to_fmt", default="lvl", choices=sorted(f.name for f in FORMATS if f.encode))
+    ap.add_argument("--from", dest="from_fmt", default=None, choices=sorted(f.name for f in FORMATS),
+                    help="skip auto-detection")
+    ap.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1)
+    args = ap.parse_args(argv)
+
+    jobs = plan_jobs(args.src, args.dst, args.to_fmt)
+    if not jobs:
+        print("No level files found.")
+        return 1
+    t0 = time.perf_counter()
+    results = []
+    with ProcessPoolExecutor(max_workers=max(1, args.jobs)) as pool:
+        futures = [pool.submit(convert_file, s, d, args.to_fmt, args.from_fmt) for s, d in jobs]
+        for fut in as_completed(futures):
+            r = fut.result()
+            results.append(r)
+            print(report_line(r))
+    elapsed = time.perf_counter() - t0
+    failed = [r for r in results if r['error']]
+    lossy = [r for r in results if r['lost']]
+    total_in = sum(r['bytes_in'] for r in results)
+    total_obj = sum(r['objects'] for r in results)
+    print(f"\n{len(results)-len(failed)}/{len(results)} converted, {total_obj} objects, "
+          f"{total_in/1e6:.2f} MB in {elapsed:.2f}s ({total_in/1e6/elapsed if elapsed else 0:.2f} MB/s)")
+    if lossy:
+        print(f"{len(lossy)} file(s) lost objects the target format can't hold (see 'lost:' lines)")
+    if failed:
+        print(f"{len(failed)} failure(s):")
+        for r in failed:
+            print(f"  {r['src']}: {r['error']}")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,21 @@
+import threading
+
+from test_lvl_roundtrip import ed
+
+
+def test_worker_survives_unexpected_sheet_errors(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(ed, 'USE_GRAPHICS', True)
+
+    def load_sheet(kind, name, index):
+        if name == 'brick':
+            raise RuntimeError("bad sheet")
+        return []
+    monkeypatch.setattr(ed, 'load_sheet', load_sheet)
+    loader = ed.AssetLoader(workers=0)
+    threading.Thread(target=loader._run, daemon=True).start()
+    loader.request('tile', 'brick')
+    loader.request('tile', 'ground')
+    results = [loader.results.get(timeout=5) for _ in range(2)]
+    assert [(name, type(err).__name__ if err else None) for _, name, _, err in results] == [
+        ('brick', 'RuntimeError'), ('ground', None)]
@@ -0,0 +1,36 @@
+import random
+
+from test_lvl_roundtrip import ed
+
+G = ed.GRID_SIZE
+
+
+def test_rect_resolve_matches_pick():
+    rng = random.Random(7)
+    names = ['pipe_vertical', 'pipe_horizontal', 'ground', 'grass', 'slope_left', 'brick']
+    tids = [ed.TILE_SMBX_IDS[n] for n in names] + [0, 60000]
+    store = ed.Level().current_layer().tiles
+    for cy in range(-2, 14):
+        for cx in range(-2, 22):
+            tid = rng.choice(tids)
+            if tid:
+                store.add_record(cx * G, cy * G, tid)
+    pending = {(cx, cy): rng.choice(tids) for cx in range(20) for cy in range(12) if rng.random() < 0.5}
+    tiler = ed.AutoTiler()
+
+    def tid_at(cx, cy):
+        if (cx, cy) in pending:
+            return pending[(cx, cy)]
+        slot = store._get_cell(cx, cy)
+        return store.type_id[slot] if slot >= 0 else 0
+
+    expected = {}
+    for cy in range(-1, 13):
+        for cx in range(-1, 21):
+            tid = tid_at(cx, cy)
+            if tid in tiler.variants:
+                want = tiler.pick(tid, tid_at(cx, cy - 1), tid_at(cx + 1, cy), tid_at(cx, cy + 1), tid_at(cx - 1, cy))
+                if want != tid:
+                    expected[(cx, cy)] = want
+    assert expected
+    assert tiler._resolve_rect(store, pending, -1, -1, 21, 13) == expected
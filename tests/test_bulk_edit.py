@@ -0,0 +1,44 @@
+from test_lvl_roundtrip import ed
+
+G = ed.GRID_SIZE
+
+
+def _state(level):
+    section = level.current_section()
+    out = []
+    for layer in section.layers:
+        out.append(sorted(layer.tiles.records()))
+        out.append(sorted((o.rect.x, o.rect.y, o.obj_type) for o in (*layer.bgos, *layer.npcs)))
+    return out
+
+
+def test_crop_only_captures_the_cropped_chunks(monkeypatch):
+    level = ed.Level()
+    section, layer = level.current_section(), level.current_layer()
+    for cx in range(0, 100, 3):
+        for cy in range(0, 30, 2):
+            layer.tiles.add_record(cx * G, cy * G, 1)
+    layer.tiles.add_record(95 * G + 8, 3 * G, 2)
+    layer.bgos.add(ed.BGO(70 * G, 25 * G, 'cloud', 0))
+    layer.npcs.add(ed.NPC(20 * G, 28 * G, 'goomba', 0))
+    layer.npcs.add(ed.NPC(5 * G, 5 * G, 'goomba', 0))
+    screen = ed.pygame.display.set_mode((ed.WINDOW_WIDTH, ed.WINDOW_HEIGHT))
+    editor = ed.Editor(level, screen)
+    before = _state(level)
+
+    seen = []
+    capture = ed.capture_chunks
+    monkeypatch.setattr(ed, 'capture_chunks', lambda s, rects=None: seen.append(rects) or capture(s, rects))
+    section.width, section.height = 50 * G, 20 * G
+    cmd = editor.crop_section(section)
+    assert None not in seen
+    kept = _state(level)
+    assert all(x < 50 * G and y < 20 * G for x, y, *_ in kept[0])
+    assert [(o.rect.x, o.rect.y) for o in layer.npcs] == [(5 * G, 5 * G)]
+    assert not layer.bgos
+    assert {k[1:] for k in cmd.keys} <= {(chx, chy) for chx in range(-1, 7) for chy in range(-1, 2)}
+
+    cmd.undo(editor)
+    assert _state(level) == before
+    cmd.redo(editor)
+    assert _state(level) == kept
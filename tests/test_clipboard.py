@@ -0,0 +1,43 @@
+import struct
+import zlib
+from array import array
+
+import pytest
+
+from test_lvl_roundtrip import ed
+
+G = ed.GRID_SIZE
+
+
+def _editor(level):
+    screen = ed.pygame.display.set_mode((ed.WINDOW_WIDTH, ed.WINDOW_HEIGHT))
+    return ed.Editor(level, screen)
+
+
+def test_unknown_tile_type_is_refused():
+    body = array('i', [0])
+    body.frombytes(array('H', [1, 999]).tobytes())
+    data = struct.pack(ed.CLIP_HEAD, ed.CLIP_MAGIC, ed.CLIP_VERSION, 2, 1, 1, 0, 0) + zlib.compress(body.tobytes())
+    with pytest.raises(ed.LevelFormatError, match="unknown tile type 999"):
+        ed.ClipboardBlock.from_bytes(data)
+
+
+def test_off_grid_tiles_keep_their_offset_through_copy_and_paste():
+    level = ed.Level()
+    layer = level.current_layer()
+    layer.tiles.add_record(0, 0, 1)
+    layer.tiles.add_record(8, 8, 2)
+    editor = _editor(level)
+    editor.select_all()
+    editor.copy_selection()
+    block = ed.ClipboardBlock.from_bytes(editor.clipboard.to_bytes())
+    assert len(block) == 2
+
+    editor.clipboard = block
+    editor.camera.camera.x = -10 * G
+    editor.mouse_pos = (ed.SIDEBAR_WIDTH + 1, ed.CANVAS_Y + 1)
+    editor.paste_clipboard()
+    assert sorted(r[:3] for r in layer.tiles.records()) == [
+        (0, 0, 1), (8, 8, 2), (10 * G, 0, 1), (10 * G + 8, 8, 2)]
+    editor.paste_merge()
+    assert len(layer.tiles) == 4
@@ -0,0 +1,29 @@
+from test_lvl_roundtrip import ed
+
+G = ed.GRID_SIZE
+
+
+def test_over_limit_fill_preview_is_cached(monkeypatch):
+    level = ed.Level()
+    screen = ed.pygame.display.set_mode((ed.WINDOW_WIDTH, ed.WINDOW_HEIGHT))
+    editor = ed.Editor(level, screen)
+    editor.tool = 'fill'
+    editor.sidebar.current_category = "Tiles"
+    monkeypatch.setattr(ed, 'FILL_MAX_CELLS', 50)
+    calls = []
+    flood = ed.TileStore.flood_spans
+    monkeypatch.setattr(ed.TileStore, 'flood_spans', lambda *a, **k: calls.append(1) or flood(*a, **k))
+
+    editor.mouse_pos = (ed.SIDEBAR_WIDTH + G + 4, ed.CANVAS_Y + G + 4)
+    editor.update_fill_preview()
+    assert editor.fill_preview['spans'] is None
+    editor.mouse_pos = (ed.SIDEBAR_WIDTH + 2 * G + 4, ed.CANVAS_Y + G + 4)
+    editor.update_fill_preview()
+    assert len(calls) == 1
+    assert editor.fill_preview['hover'] != editor.fill_preview['start']
+    editor.draw(screen)
+
+    level.current_layer().tiles.add_record(0, 0, 1)
+    editor.edit_rev += 1
+    editor.update_fill_preview()
+    assert len(calls) == 2
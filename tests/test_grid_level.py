@@ -0,0 +1,170 @@
+import importlib.util
+import io
+import json
+import os
+import random
+import struct
+import sys
+
+import numpy as np
+import pytest
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import mfbconvert
+
+
+def _load(name, filename):
+    spec = importlib.util.spec_from_file_location(name, os.path.join(ROOT, filename))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+EDITORS = [_load("mfb_grid", "#######acholdingsmfb.py"), _load("mfb_grid_011", "####mfb0.1.1.py")]
+
+
+@pytest.fixture(params=EDITORS, ids=["acholdingsmfb", "mfb0.1.1"])
+def grid(request):
+    return request.param
+
+
+def _scan(level):
+    # Reference bounding box straight from the chunks.
+    boxes = []
+    for (cx, cy), chunk in level.chunks.items():
+        rows, cols = np.nonzero(chunk)
+        boxes.append((cx * 32 + cols.min(), cy * 32 + rows.min(), cx * 32 + cols.max() + 1, cy * 32 + rows.max() + 1))
+    if not boxes:
+        return None
+    return (min(b[0] for b in boxes), min(b[1] for b in boxes),
+            max(b[2] for b in boxes), max(b[3] for b in boxes))
+
+
+def test_negative_coordinates_and_freed_chunks(grid):
+    level = grid.Level()
+    level.set_tile(-1, -40, grid.TILE_GROUND)
+    assert level.get_tile(-1, -40) == grid.TILE_GROUND
+    assert set(level.chunks) == {(-1, -2)}
+    assert level.bounds() == (-1, -40, 0, -39)
+    assert level.extent() == (-1, -40, level.width, level.height)
+    level.set_tile(-1, -40, grid.TILE_EMPTY)
+    assert level.chunks == {} and level.bounds() is None
+    level.fill_rect(-5, -5, 10, 10, grid.TILE_BRICK)
+    assert len(level.chunks) == 4
+    level.fill_rect(-5, -5, 10, 10, grid.TILE_EMPTY)
+    assert level.chunks == {}
+
+
+def test_bounds_track_writes_and_erases(grid):
+    rng = random.Random(3)
+    level = grid.Level()
+    for _ in range(400):
+        x, y = rng.randrange(-80, 80), rng.randrange(-80, 80)
+        op = rng.randrange(5)
+        if op == 0:
+            level.set_tile(x, y, rng.choice([grid.TILE_EMPTY, grid.TILE_GROUND]))
+        elif op == 1:
+            level.fill_rect(x, y, rng.randrange(1, 40), rng.randrange(1, 40),
+                            rng.choice([grid.TILE_EMPTY, grid.TILE_BRICK]))
+        elif op == 2:
+            block = np.array(rng.choices([0, 0, 1, 2], k=30), dtype=np.uint8).reshape(5, 6)
+            level.paste(block, x, y)
+        elif op == 3:
+            xs, ys = np.array([x, x + 33, x - 40]), np.array([y, y - 1, y + 35])
+            level.set_cells(xs, ys, rng.choice([grid.TILE_EMPTY, grid.TILE_COIN]))
+        else:
+            level.flip_rect(x, y, 50, 20, horizontal=rng.random() < 0.5)
+        assert level.bounds() == _scan(level)
+
+
+def test_flip_and_replace_across_chunk_seams(grid):
+    level = grid.Level()
+    level.set_tile(30, 5, grid.TILE_GROUND)
+    level.set_tile(31, 5, grid.TILE_BRICK)
+    level.flip_rect(28, 5, 8, 1)
+    assert [level.get_tile(x, 5) for x in range(28, 36)] == [0, 0, 0, 0, grid.TILE_BRICK, grid.TILE_GROUND, 0, 0]
+    level.flip_rect(32, 3, 1, 4, horizontal=False)
+    assert level.get_tile(32, 4) == grid.TILE_BRICK
+    level.set_tile(-1, 64, grid.TILE_BRICK)
+    assert level.replace(grid.TILE_BRICK, grid.TILE_COIN) == 2
+    assert level.get_tile(-1, 64) == grid.TILE_COIN and level.get_tile(32, 4) == grid.TILE_COIN
+
+
+def test_autotile_rect_picks_pipe_corners(grid):
+    level = grid.Level()
+    level.fill_rect(31, 31, 2, 2, grid.TILE_PIPE_TOP_LEFT)
+    assert level.autotile_rect(31, 31, 2, 2) == 3
+    assert level.read_rect(31, 31, 2, 2).tolist() == [
+        [grid.TILE_PIPE_TOP_LEFT, grid.TILE_PIPE_TOP_RIGHT],
+        [grid.TILE_PIPE_BOTTOM_LEFT, grid.TILE_PIPE_BOTTOM_RIGHT]]
+    assert level.autotile_rect(31, 31, 2, 2) == 0
+
+
+def _sample(grid):
+    level = grid.Level(40, 20)
+    level.fill_rect(0, 18, 40, 2, grid.TILE_GROUND)
+    level.set_tile(33, 4, grid.TILE_COIN)
+    return level
+
+
+def test_chunk_save_round_trips_negative_tiles(grid, tmp_path):
+    level = _sample(grid)
+    level.set_tile(-3, -70, grid.TILE_BRICK)
+    path = str(tmp_path / "level.mfc")
+    assert level.save(path)
+    back = grid.Level.load(path)
+    assert (back.width, back.height) == (40, 20)
+    assert back.bounds() == level.bounds() == (-3, -70, 40, 20)
+    assert back.read_rect(-3, -70, 43, 90).tolist() == level.read_rect(-3, -70, 43, 90).tolist()
+
+
+@pytest.mark.parametrize("ext", [".npy", ".json"])
+def test_dense_saves_round_trip(grid, tmp_path, ext):
+    level = _sample(grid)
+    path = str(tmp_path / ("level" + ext))
+    assert level.save(path)
+    back = grid.Level.load(path)
+    assert back.read_rect(0, 0, 40, 20).tolist() == level.read_rect(0, 0, 40, 20).tolist()
+    level.set_tile(-1, 0, grid.TILE_GROUND)
+    assert not level.save(path)
+
+
+def test_rle_load(grid, tmp_path):
+    tiles = np.zeros((3, 4), dtype=np.uint8)
+    tiles[2] = grid.TILE_GROUND
+    lengths, values = [8, 4], [0, grid.TILE_GROUND]
+    data = (struct.pack('<4sIII', b'MFBR', 4, 3, 2) + struct.pack('<2I', *lengths) + bytes(values))
+    path = tmp_path / "level.rle"
+    path.write_bytes(data)
+    back = grid.Level.load(str(path))
+    assert back.read_rect(0, 0, 4, 3).tolist() == tiles.tolist()
+    path.write_bytes(data[:-1])
+    assert grid.Level.load(str(path)) is None
+
+
+def test_mfbconvert_reads_and_writes_chunk_saves(grid, tmp_path):
+    level = _sample(grid)
+    level.set_tile(-2, -1, grid.TILE_BRICK)
+    path = tmp_path / "level.mfc"
+    level.save(str(path))
+    fmt, data, _ = mfbconvert.load_level_file(str(path))
+    assert fmt == 'mfc'
+    blocks = sorted(b[:3] for b in data.sections[0].blocks)
+    assert (-64, -32, 'brick') in blocks and (33 * 32, 4 * 32, 'coin') in blocks
+    assert len(blocks) == 82
+    path.write_bytes(mfbconvert.encode_mfc(data))
+    back = grid.Level.load(str(path))
+    assert back.read_rect(-2, -1, 42, 21).tolist() == level.read_rect(-2, -1, 42, 21).tolist()
+
+
+def test_level_path_prefers_the_newest_save(grid, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    assert grid.level_path() == grid.LEVEL_FILE
+    _sample(grid).save(grid.LEVEL_FILE)
+    os.utime(grid.LEVEL_FILE, (1000, 1000))
+    (tmp_path / "level.json").write_bytes(mfbconvert.encode_grid(mfbconvert.LevelData()))
+    assert grid.level_path() == "level.json"
@@ -0,0 +1,76 @@
+import os
+
+from test_lvl_roundtrip import ed
+
+G = ed.GRID_SIZE
+
+
+def _editor(path):
+    level = ed.Level()
+    level.current_layer().tiles.add_record(8, 8, 1)
+    ed.compact_level(str(path), ed.snapshot_level(level))
+    screen = ed.pygame.display.set_mode((ed.WINDOW_WIDTH, ed.WINDOW_HEIGHT))
+    editor = ed.Editor(ed.read_lvl(str(path)), screen)
+    editor.journal = ed.EditJournal(str(path))
+    editor.sidebar.current_category = "Tiles"
+    editor.sidebar.selected_item = 'brick'
+    return editor
+
+
+def _records(level):
+    return sorted(level.sections[0].layers[0].tiles.records())
+
+
+def test_strokes_and_fills_are_journaled(tmp_path):
+    path = tmp_path / "j.lvl"
+    editor = _editor(path)
+    editor.start_drag((3, 3), False)
+    editor.drag_target = (11, 3)
+    editor.flush_drag()
+    editor.end_stroke()
+    assert not editor.journal.stale
+    assert len(editor.journal.pending) == 9 * ed.JOURNAL_REC.size
+
+    editor.tool = 'rect'
+    editor.apply_shape((2, 5), (6, 8))
+    editor.sidebar.selected_item = 'ground'
+    editor.fill_area(2 * G, 6 * G)
+    editor.undo()
+    editor.redo()
+    editor.undo()
+    assert not editor.journal.stale
+
+    ed.append_journal(editor.journal.path, editor.journal.take())
+    _, tail = ed.read_journal(str(path))
+    replayed = ed.read_lvl(str(path))
+    ed.replay_journal(replayed, tail)
+    assert _records(replayed) == _records(editor.level)
+
+
+def test_reopened_journal_counts_earlier_sessions(tmp_path):
+    path = tmp_path / "j.lvl"
+    editor = _editor(path)
+    editor.start_drag((3, 3), False)
+    editor.end_stroke()
+    written = ed.append_journal(editor.journal.path, editor.journal.take(commit=True))
+    assert ed.EditJournal(str(path)).on_disk == written
+    assert ed.EditJournal(str(path), fresh=True).on_disk == 0
+
+
+def test_replay_skips_corrupt_records():
+    level = ed.Level()
+    rec = (ed.OP_ADD, ed.KIND_TILE, 0, 0, 0, 0, 1, -1, 0, 0, 0)
+    bad_kind = (ed.OP_ADD, 9, 0, 0, 32, 0, 1, -1, 0, 0, 0)
+    bad_layer = (ed.OP_ADD, ed.KIND_TILE, 0, 65535, 64, 0, 1, -1, 0, 0, 0)
+    bad_op = (7, ed.KIND_TILE, 0, 0, 96, 0, 1, -1, 0, 0, 0)
+    ed.replay_journal(level, [bad_kind, bad_layer, bad_op, rec])
+    assert len(level.sections[0].layers) == 1
+    assert [r[:3] for r in level.current_layer().tiles.records()] == [(0, 0, 1)]
+
+
+def test_recovery_slots_are_per_level(tmp_path):
+    a = ed.recovery_path(str(tmp_path / "a" / "world.lvl"), 0)
+    b = ed.recovery_path(str(tmp_path / "b" / "world.lvl"), 0)
+    assert a != b
+    assert os.path.dirname(a) == str(tmp_path / "a" / ed.AUTOSAVE_DIR)
+    assert ed.recovery_path(None, 1) == os.path.join(ed.AUTOSAVE_DIR, "untitled.autosave1.lvl")
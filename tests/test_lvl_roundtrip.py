@@ -0,0 +1,86 @@
+import importlib.util
+import os
+import sys
+from array import array
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+_spec = importlib.util.spec_from_file_location(
+    "mfb_editor", os.path.join(ROOT, "###########acholdingmmarofanbuilderv0.py"))
+ed = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(ed)
+
+
+def _level_bytes(tiles):
+    blocks = array('i')
+    for x, y, tid in tiles:
+        blocks.extend((x, y, tid, 0, -1, 0))
+    section = (3200, 960, (92, 148, 252), 1, blocks, array('i'), array('i'), 0, [])
+    return ed.encode_lvl(("Test", "Tester", 300, 0, False, [section]))
+
+
+def test_off_grid_tiles_survive_read_and_encode(tmp_path):
+    # Half-grid tiles share cells with each other and with a grid tile.
+    tiles = [(0, 0, 1), (8, 0, 2), (16, 0, 3), (16, 16, 4), (64, 32, 1), (-8, 40, 2)]
+    data = _level_bytes(tiles)
+    path = tmp_path / "offgrid.lvl"
+    path.write_bytes(data)
+
+    level = ed.read_lvl(str(path))
+    store = level.sections[0].layers[0].tiles
+    assert len(store) == len(tiles)
+    assert sorted((x, y, tid) for x, y, tid, _, _ in store.records()) == sorted(tiles)
+    assert ed.encode_lvl(ed.snapshot_level(level)) == data
+
+
+def test_exact_position_replaces_only_that_tile():
+    store = ed.TileStore()
+    store.add_record(0, 0, 1)
+    store.add_record(8, 0, 2)
+    store.add_record(8, 0, 3)
+    assert sorted(r[:3] for r in store.records()) == [(0, 0, 1), (8, 0, 3)]
+    store.remove_slot(store.slot_exact(0, 0))
+    assert [r[:3] for r in store.records()] == [(8, 0, 3)]
+    assert store.slots_in(0, 0, 1, 1) == [store.slot_exact(8, 0)]
+
+
+def _editor(level):
+    screen = ed.pygame.display.set_mode((ed.WINDOW_WIDTH, ed.WINDOW_HEIGHT))
+    return ed.Editor(level, screen)
+
+
+def test_off_grid_tile_sharing_a_cell_is_deleted_and_moved_by_id():
+    level = ed.Level()
+    section, layer = level.current_section(), level.current_layer()
+    store = layer.tiles
+    store.add_record(0, 0, 1)
+    store.add_record(8, 8, 2)
+    editor = _editor(level)
+    loose = level.objects.slot_ids(section, layer, [store.slot_exact(8, 8)])
+
+    editor.selection.replace(loose)
+    editor.move_selection(1, 0)
+    assert sorted(r[:3] for r in store.records()) == [(0, 0, 1), (40, 8, 2)]
+    editor.undo()
+    assert sorted(r[:3] for r in store.records()) == [(0, 0, 1), (8, 8, 2)]
+
+    editor.erase_ids(loose)
+    assert [r[:3] for r in store.records()] == [(0, 0, 1)]
+    editor.undo()
+    assert sorted(r[:3] for r in store.records()) == [(0, 0, 1), (8, 8, 2)]
+
+
+def test_tile_views_carry_their_layer_index(tmp_path):
+    blocks = array('i', [0, 0, 1, 0, -1, 0, 32, 0, 2, 2, -1, 0])
+    section = (3200, 960, (92, 148, 252), 1, blocks, array('i'), array('i'), 0, [])
+    path = tmp_path / "layers.lvl"
+    path.write_bytes(ed.encode_lvl(("Test", "Tester", 300, 0, False, [section])))
+    sec = ed.read_lvl(str(path)).sections[0]
+    tile = sec.layers[2].tiles.at(32, 0)
+    assert tile.layer == 2
+    sec.layers.pop(0)
+    sec.renumber_layers()
+    assert tile.layer == 1 and sec.layers[1].tiles.at(32, 0).layer == 1
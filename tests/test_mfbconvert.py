@@ -0,0 +1,57 @@
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import mfbconvert
+
+
+@pytest.mark.parametrize("x", [1.5, "3", True, float("inf"), 2**40])
+def test_bad_json_coordinates_raise_level_format_error(x):
+    doc = {"name": "a", "author": "b", "tiles": [{"x": x, "y": 0, "type": "ground"}]}
+    with pytest.raises(mfbconvert.LevelFormatError):
+        mfbconvert.decode_export(json.dumps(doc).encode())
+
+
+def test_negative_flags_encode():
+    level = mfbconvert.LevelData()
+    level.sections[0].blocks.append((0, 0, 'ground', 0, -1, -5))
+    level.sections[0].npcs.append((0, 0, 'goomba', 0, -1, -1, 1, -3))
+    _, back = mfbconvert.decode_level(mfbconvert.encode_lvl(level))
+    assert back.sections[0].blocks == [(0, 0, 'ground', 0, -1, -5)]
+
+
+def test_convert_file_reports_instead_of_raising(tmp_path, monkeypatch):
+    src = tmp_path / "a.json"
+    src.write_text(json.dumps({"tiles": [{"x": 1.5, "y": 0, "type": "ground"}]}))
+    r = mfbconvert.convert_file(str(src), str(tmp_path / "a.lvl"), 'lvl')
+    assert r['error'].startswith("LevelFormatError")
+
+    def boom(level):
+        raise RuntimeError("codec bug")
+    monkeypatch.setattr(mfbconvert.get_format('lvl'), 'encode', boom)
+    src.write_text(json.dumps({"tiles": [{"x": 0, "y": 0, "type": "ground"}]}))
+    r = mfbconvert.convert_file(str(src), str(tmp_path / "a.lvl"), 'lvl')
+    assert r['error'] == "RuntimeError: codec bug"
+
+
+def test_convert_file_counts_what_the_target_drops(tmp_path):
+    level = mfbconvert.LevelData()
+    sec = level.sections[0]
+    sec.blocks += [(0, 0, 'ground', 0, -1, 0), (16, 0, 'brick', 0, -1, 0), (-32, 0, 'ground', 0, -1, 0)]
+    sec.bgos.append((64, 0, 'tree', 0, 0))
+    src = tmp_path / "a.lvl"
+    src.write_bytes(mfbconvert.encode_lvl(level))
+
+    r = mfbconvert.convert_file(str(src), str(tmp_path / "a.json"), 'layered')
+    assert r['error'] is None and r['lost'] == {'BGOs': 1}
+    assert "lost: 1 BGOs" in mfbconvert.report_line(r)
+
+    r = mfbconvert.convert_file(str(src), str(tmp_path / "g.json"), 'grid')
+    assert r['lost'] == {'objects with no grid id': 1, 'off-grid objects snapped to a cell': 1,
+                         'objects sharing a cell': 1, 'objects at negative coordinates': 1}
+
+    r = mfbconvert.convert_file(str(src), str(tmp_path / "a2.lvl"), 'lvl')
+    assert r['lost'] == {} and mfbconvert.report_line(r).startswith("ok")